@@ -3,13 +3,24 @@ Admin Routes - User Management
 Admin-only functionality for managing users
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context
 from flask_login import login_required, current_user
 from werkzeug.security import generate_password_hash
 from models import get_db
 from database import IS_POSTGRES
 from permissions import admin_required
-from audit.service import log_action
+from audit.service import (
+    log_action, query_audit_logs, iter_audit_logs, get_audit_counters, reaches_archive
+)
+from audit.retention import archive_cutoff
+from auth.user_cache import user_cache, invalidate_user
+from services.cache import cache
+from services.invalidation_bus import bus
+from services.metrics import metrics
+from services.job_scheduler import job_scheduler, get_job_runs, format_schedule
+from datetime import datetime, timedelta
+import csv
+import io
 import re
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
@@ -100,13 +111,13 @@ def create_user():
     # Create user
     hashed_password = generate_password_hash(password)
     try:
-        cursor.execute(f"""
-            INSERT INTO users (username, email, password, role)
-            VALUES ({ph()}, {ph()}, {ph()}, {ph()})
-        """, (username, email, hashed_password, role))
-        conn.commit()
-        
-        log_action('USER_CREATED', 'user', None, f'Created user: {username} ({role})')
+        with conn.transaction():
+            cursor.execute(f"""
+                INSERT INTO users (username, email, password, role)
+                VALUES ({ph()}, {ph()}, {ph()}, {ph()})
+            """, (username, email, hashed_password, role))
+            log_action('USER_CREATED', 'user', None, f'Created user: {username} ({role})')
+        invalidate_user()
         flash(f'✅ สร้างผู้ใช้ "{username}" สำเร็จ', 'success')
     except Exception as e:
         flash(f'เกิดข้อผิดพลาด: {str(e)}', 'danger')
@@ -165,14 +176,14 @@ def edit_user(user_id):
     
     # Update user
     try:
-        cursor.execute(f"""
-            UPDATE users 
-            SET email = {ph()}, role = {ph()}
-            WHERE id = {ph()}
-        """, (email, role, user_id))
-        conn.commit()
-        
-        log_action('USER_UPDATED', 'user', user_id, f'Updated user: {user["username"]} to {role}')
+        with conn.transaction():
+            cursor.execute(f"""
+                UPDATE users 
+                SET email = {ph()}, role = {ph()}
+                WHERE id = {ph()}
+            """, (email, role, user_id))
+            log_action('USER_UPDATED', 'user', user_id, f'Updated user: {user["username"]} to {role}')
+        invalidate_user(user_id)
         flash(f'✅ อัปเดตผู้ใช้ "{user["username"]}" สำเร็จ', 'success')
     except Exception as e:
         flash(f'เกิดข้อผิดพลาด: {str(e)}', 'danger')
@@ -201,10 +212,10 @@ def delete_user(user_id):
     
     try:
         # Delete user
-        cursor.execute(f"DELETE FROM users WHERE id = {ph()}", (user_id,))
-        conn.commit()
-        
-        log_action('USER_DELETED', 'user', user_id, f'Deleted user: {user["username"]}')
+        with conn.transaction():
+            cursor.execute(f"DELETE FROM users WHERE id = {ph()}", (user_id,))
+            log_action('USER_DELETED', 'user', user_id, f'Deleted user: {user["username"]}')
+        invalidate_user(user_id)
         flash(f'✅ ลบผู้ใช้ "{user["username"]}" สำเร็จ', 'success')
     except Exception as e:
         flash(f'เกิดข้อผิดพลาด: {str(e)}', 'danger')
@@ -238,16 +249,128 @@ def reset_password(user_id):
     
     try:
         hashed_password = generate_password_hash(new_password)
-        cursor.execute(f"""
-            UPDATE users 
-            SET password = {ph()}
-            WHERE id = {ph()}
-        """, (hashed_password, user_id))
-        conn.commit()
-        
-        log_action('PASSWORD_RESET', 'user', user_id, f'Reset password for: {user["username"]}')
+        with conn.transaction():
+            cursor.execute(f"""
+                UPDATE users 
+                SET password = {ph()}
+                WHERE id = {ph()}
+            """, (hashed_password, user_id))
+            log_action('PASSWORD_RESET', 'user', user_id, f'Reset password for: {user["username"]}')
+        invalidate_user(user_id)
         flash(f'✅ รีเซ็ตรหัสผ่านผู้ใช้ "{user["username"]}" สำเร็จ', 'success')
     except Exception as e:
         flash(f'เกิดข้อผิดพลาด: {str(e)}', 'danger')
     
     return redirect(url_for('admin.users'))
+
+
+@admin_bp.route('/api/cache-stats')
+@login_required
+@admin_required
+def cache_stats():
+    """API: hit-rate metrics of the per-process caches and the invalidation bus"""
+    return jsonify({
+        'success': True,
+        'user_cache': user_cache.stats(),
+        'shared_cache': cache.stats(),
+        'invalidation_bus': bus.stats()
+    })
+
+
+@admin_bp.route('/api/jobs')
+@login_required
+@admin_required
+def job_runs():
+    """API: recent runs of the built-in scheduler"""
+    conn = get_db()
+    runs = get_job_runs(conn, limit=request.args.get('limit', 50, type=int),
+                        job=request.args.get('job') or None)
+    return jsonify({
+        'success': True,
+        'schedules': {name: format_schedule(sched) for name, sched in job_scheduler.schedules.items()},
+        'runs': [dict(r) for r in runs]
+    })
+
+
+# ---------------------------------------------------------
+# Audit Explorer
+# ---------------------------------------------------------
+AUDIT_PAGE_SIZE = 50
+AUDIT_EXPORT_COLUMNS = ['id', 'timestamp', 'user_id', 'username', 'action',
+                        'target_type', 'target_id', 'details', 'ip_address']
+
+
+def _audit_filters_from_args():
+    """Read explorer filters from the query string (dates are YYYY-MM-DD)."""
+    filters = {
+        'user_id': request.args.get('user_id', type=int),
+        'action': request.args.get('action', '').strip() or None,
+        'target_type': request.args.get('target_type', '').strip() or None,
+        'target_id': request.args.get('target_id', type=int),
+        'start': None,
+        'end': None,
+    }
+    try:
+        if request.args.get('start'):
+            filters['start'] = datetime.strptime(request.args['start'], '%Y-%m-%d').isoformat()
+        if request.args.get('end'):
+            # Inclusive end date -> exclusive bound at the next midnight
+            end = datetime.strptime(request.args['end'], '%Y-%m-%d') + timedelta(days=1)
+            filters['end'] = end.isoformat()
+    except ValueError:
+        flash('รูปแบบวันที่ไม่ถูกต้อง', 'warning')
+    return filters
+
+
+@admin_bp.route('/audit')
+@login_required
+@admin_required
+def audit():
+    """Browse audit logs with filters (keyset paging)"""
+    filters = _audit_filters_from_args()
+    # Rows past the retention window come from the archive segments once the table runs out
+    logs, next_cursor = query_audit_logs(filters, cursor=request.args.get('cursor'),
+                                         limit=AUDIT_PAGE_SIZE, include_archived=True)
+    
+    # Keep the current filters on the next-page / export links
+    args = {k: v for k, v in request.args.items() if k != 'cursor' and v}
+    
+    # Rolled-up read activity (VIEW_REPORT / EXPORT_DATA) for the last 30 days
+    counters = get_audit_counters(days=30, user_id=filters['user_id'], action=filters['action'])
+    return render_template('admin/audit.html', logs=logs, args=args, next_cursor=next_cursor,
+                           counters=counters, archive_cutoff=archive_cutoff()[:10],
+                           reaches_archive=reaches_archive(filters))
+
+
+@admin_bp.route('/audit/export.csv')
+@login_required
+@admin_required
+def audit_export():
+    """Stream filtered audit logs as CSV without loading them all into memory"""
+    filters = _audit_filters_from_args()
+    log_action('EXPORT_AUDIT', details=f'filters: {dict((k, v) for k, v in filters.items() if v)}')
+    
+    def flush(buffer):
+        chunk = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate(0)
+        metrics.inc('itrack_export_bytes_total', len(chunk), export='audit_csv')
+        return chunk
+    
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        buffer.write('\ufeff')  # BOM so Excel opens Thai text correctly
+        writer.writerow(AUDIT_EXPORT_COLUMNS)
+        for i, row in enumerate(iter_audit_logs(filters, include_archived=True), 1):
+            writer.writerow([row[c] for c in AUDIT_EXPORT_COLUMNS])
+            if i % 500 == 0:
+                yield flush(buffer)
+        yield flush(buffer)
+    
+    filename = f"audit_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
@@ -1,14 +1,23 @@
 import os
+import hmac
 import logging
 from datetime import datetime
-from flask import Flask, request, render_template
+from flask import Flask, Response, request, render_template
 from flask_login import LoginManager
 from dotenv import load_dotenv
 
-from models import init_db, get_db, close_db, User
+from models import init_db, close_db, User
 from auth.routes import auth_bp
+from auth.user_cache import load_user_row
 from research.routes import research_bp
 from notifications.scheduler import notify_deadlines
+from audit.retention import archive_audit_logs
+from notifications.outbox import outbox_worker, drain_outbox, get_outbox_stats
+from notifications.digest import send_digests
+from services.job_scheduler import job_scheduler
+from services.invalidation_bus import bus
+from services import timing
+from services.metrics import metrics, METRICS_ENABLED
 from extensions import csrf, limiter
 
 # Configure Logging
@@ -35,11 +44,20 @@ app.config['MAIL_SENDER'] = os.getenv("MAIL_SENDER")
 # Cron API Key for scheduled tasks
 app.config['CRON_API_KEY'] = os.getenv("CRON_API_KEY", "")
 
+# Token for /metrics scrapes (falls back to CRON_API_KEY; neither set = no /metrics)
+app.config['METRICS_TOKEN'] = os.getenv("METRICS_TOKEN") or app.config['CRON_API_KEY']
+
 if not app.config['SENDGRID_API_KEY'] or not app.config['MAIL_SENDER']:
     logger.warning("⚠️ SendGrid environment variables not configured")
 else:
     logger.info(f"📨 SendGrid ready. Sender: {app.config['MAIL_SENDER']}")
 
+# Per-request timing breakdown (REQUEST_TIMING=true)
+timing.init_app(app)
+
+# Prometheus metrics, aggregated across worker processes (served at /metrics)
+metrics.init_app(app)
+
 # Initialize Extensions
 csrf.init_app(app)
 limiter.init_app(app)
@@ -52,15 +70,12 @@ login_manager.login_message = "กรุณาเข้าสู่ระบบ
 login_manager.login_message_category = "warning"
 
 @login_manager.user_loader
+@timing.timed_function('auth')
 def load_user(user_id):
-    from database import IS_POSTGRES
-    conn = get_db()
-    cursor = conn.cursor()
-    placeholder = '%s' if IS_POSTGRES else '?'
-    cursor.execute(f"SELECT * FROM users WHERE id = {placeholder}", (user_id,))
-    u = cursor.fetchone()
-    if u:
-        return User(u['id'], u['username'], u['email'], u['role'])
+    # Served from a short-TTL per-process cache (see auth/user_cache.py)
+    row = load_user_row(user_id)
+    if row:
+        return User(*row)
     return None
 
 # Register Blueprints
@@ -83,6 +98,15 @@ app.register_blueprint(notifications_bp)
 with app.app_context():
     init_db()
 
+# Email outbox drain thread (started lazily per worker process)
+outbox_worker.init_app(app)
+
+# Built-in job scheduler (one leader across all workers/nodes)
+job_scheduler.init_app(app)
+
+# Cache/push invalidations from other workers and nodes
+bus.init_app(app)
+
 @app.teardown_appcontext
 def shutdown_session(exception=None):
     close_db(exception)
@@ -108,11 +132,11 @@ def file_too_large(e):
 # Cron Endpoint (Protected by API Key)
 # ---------------------------------------------------------
 
-@app.route('/cron/check-deadlines', methods=['GET', 'POST'])
-@csrf.exempt  # Exempt from CSRF for external cron services
-@limiter.limit("10 per minute")
-def check_deadlines_endpoint():
-    # Verify API Key
+def _cron_unauthorized():
+    """
+    Verify the cron API key.
+    Returns an error response, or None if the request is allowed.
+    """
     api_key = request.headers.get('X-API-Key') or request.args.get('api_key')
     expected_key = app.config['CRON_API_KEY']
     
@@ -121,6 +145,33 @@ def check_deadlines_endpoint():
     elif api_key != expected_key:
         logger.warning(f"🚫 Unauthorized cron access attempt from {request.remote_addr}")
         return {'success': False, 'error': 'Unauthorized'}, 401
+    return None
+
+
+def _metrics_unauthorized():
+    """
+    Verify the metrics token (Authorization: Bearer <token> or X-API-Key).
+    Unlike the cron endpoints, never open: without a token the endpoint is not served.
+    """
+    expected = app.config['METRICS_TOKEN']
+    if not expected:
+        return {'success': False, 'error': 'Not found'}, 404
+    auth = request.headers.get('Authorization', '')
+    token = auth[7:] if auth.startswith('Bearer ') else request.headers.get('X-API-Key', '')
+    if not hmac.compare_digest(token.encode(), expected.encode()):
+        logger.warning(f"🚫 Unauthorized metrics access attempt from {request.remote_addr}")
+        return {'success': False, 'error': 'Unauthorized'}, 401
+    return None
+
+
+@app.route('/cron/check-deadlines', methods=['GET', 'POST'])
+@csrf.exempt  # Exempt from CSRF for external cron services
+@limiter.limit("10 per minute")
+def check_deadlines_endpoint():
+    # Verify API Key
+    denied = _cron_unauthorized()
+    if denied:
+        return denied
     
     try:
         count = notify_deadlines()
@@ -138,6 +189,103 @@ def check_deadlines_endpoint():
             'timestamp': datetime.now().isoformat()
         }, 500
 
+@app.route('/cron/archive-audit-logs', methods=['GET', 'POST'])
+@csrf.exempt  # Exempt from CSRF for external cron services
+@limiter.limit("10 per minute")
+def archive_audit_logs_endpoint():
+    denied = _cron_unauthorized()
+    if denied:
+        return denied
+    
+    try:
+        result = archive_audit_logs()
+        logger.info(f"✅ Audit retention completed. Archived {result['archived']} row(s)")
+        return {
+            'success': True,
+            **result,
+            'timestamp': datetime.now().isoformat()
+        }, 200
+    except Exception as e:
+        logger.error(f"❌ Audit retention failed: {e}")
+        return {
+            'success': False,
+            'error': str(e),
+            'timestamp': datetime.now().isoformat()
+        }, 500
+
+@app.route('/cron/drain-outbox', methods=['GET', 'POST'])
+@csrf.exempt  # Exempt from CSRF for external cron services
+@limiter.limit("10 per minute")
+def drain_outbox_endpoint():
+    denied = _cron_unauthorized()
+    if denied:
+        return denied
+    
+    try:
+        result = drain_outbox()
+        logger.info(f"✅ Outbox drained. Sent {result['sent']} email(s)")
+        return {
+            'success': True,
+            **result,
+            'outbox': get_outbox_stats(),
+            'timestamp': datetime.now().isoformat()
+        }, 200
+    except Exception as e:
+        logger.error(f"❌ Outbox drain failed: {e}")
+        return {
+            'success': False,
+            'error': str(e),
+            'timestamp': datetime.now().isoformat()
+        }, 500
+
+@app.route('/cron/send-digests', methods=['GET', 'POST'])
+@csrf.exempt  # Exempt from CSRF for external cron services
+@limiter.limit("10 per minute")
+def send_digests_endpoint():
+    denied = _cron_unauthorized()
+    if denied:
+        return denied
+    
+    try:
+        result = send_digests(force=request.args.get('force') == '1')
+        logger.info(f"✅ Digest job completed. {result['events']} event(s) to {result['recipients']} manager(s)")
+        return {
+            'success': True,
+            **result,
+            'timestamp': datetime.now().isoformat()
+        }, 200
+    except Exception as e:
+        logger.error(f"❌ Digest job failed: {e}")
+        return {
+            'success': False,
+            'error': str(e),
+            'timestamp': datetime.now().isoformat()
+        }, 500
+
+# ---------------------------------------------------------
+# Metrics Endpoint (Protected by the cron API key)
+# ---------------------------------------------------------
+
+@app.route('/metrics')
+@limiter.exempt  # Scraped every few seconds
+def metrics_endpoint():
+    denied = _metrics_unauthorized()
+    if denied:
+        return denied
+    if not METRICS_ENABLED:
+        return {'success': False, 'error': 'Metrics disabled'}, 404
+    
+    # Database-wide numbers are read once here, not summed per worker
+    outbox = {}
+    try:
+        outbox = get_outbox_stats()
+    except Exception as e:
+        logger.error(f"❌ Metrics: outbox stats failed: {e}")
+    body = metrics.render({
+        'itrack_email_outbox_messages': [({'status': status}, count) for status, count in outbox.items()],
+    })
+    return Response(body, mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 # ---------------------------------------------------------
 # Run Application
 # ---------------------------------------------------------
@@ -0,0 +1,270 @@
+"""
+Audit Retention - Move old audit_logs rows into compressed archive segments
+Segments are append-only gzip JSONL files partitioned by month, listed in
+a manifest so archived history stays searchable without touching the DB.
+
+Layout:
+    <AUDIT_ARCHIVE_DIR>/manifest.json
+    <AUDIT_ARCHIVE_DIR>/.lock
+    <AUDIT_ARCHIVE_DIR>/2025-01/audit-2025-01-000001-004999.jsonl.gz
+
+Archiving is off unless AUDIT_ARCHIVE_DIR is set: archived rows are deleted
+from the database, so the directory must be durable storage (the app's own
+disk is discarded by the PaaS on every deploy/restart) and mounted at the
+same path on every node, or archived history is only searchable on one of
+them. Without it, archive_audit_logs() does nothing, the scheduler does not
+run the job and the audit explorer reads the table only.
+
+Runs are serialized (the scheduler and /cron/archive-audit-logs can overlap):
+a database lock (advisory lock / lease row) across nodes plus an flock on
+<AUDIT_ARCHIVE_DIR>/.lock across processes sharing the directory. A run that
+finds either held returns without doing anything.
+"""
+import os
+import gzip
+import json
+import fcntl
+import logging
+from datetime import datetime, timedelta
+from models import get_db
+
+logger = logging.getLogger(__name__)
+
+# Retention settings
+AUDIT_RETENTION_DAYS = int(os.getenv('AUDIT_RETENTION_DAYS', 180))
+AUDIT_ARCHIVE_DIR = os.getenv('AUDIT_ARCHIVE_DIR') or None
+AUDIT_ARCHIVE_BATCH = int(os.getenv('AUDIT_ARCHIVE_BATCH', 5000))
+
+MANIFEST_NAME = 'manifest.json'
+LOCK_NAME = '.lock'
+# Advisory lock key (PostgreSQL) / lease row name (SQLite) for archive runs
+ARCHIVE_LOCK_KEY = 7_310_033
+ARCHIVE_LEASE_NAME = 'audit_archive'
+
+
+# ---------------------------------------------------------
+# Manifest
+# ---------------------------------------------------------
+def load_manifest(archive_dir=None):
+    """Return the manifest dict ({'segments': [...]}) or an empty one."""
+    archive_dir = archive_dir or AUDIT_ARCHIVE_DIR
+    if not archive_dir:
+        return {'segments': []}
+    path = os.path.join(archive_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {'segments': []}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save_manifest(archive_dir, manifest):
+    path = os.path.join(archive_dir, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _write_segment(archive_dir, month, rows):
+    """Write one immutable segment file and return its manifest entry."""
+    month_dir = os.path.join(archive_dir, month)
+    os.makedirs(month_dir, exist_ok=True)
+
+    min_id, max_id = rows[0]['id'], rows[-1]['id']
+    filename = f"audit-{month}-{min_id:06d}-{max_id:06d}.jsonl.gz"
+    path = os.path.join(month_dir, filename)
+    tmp_path = path + '.tmp'
+
+    with open(tmp_path, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as gz:
+            for row in rows:
+                gz.write((json.dumps(row, ensure_ascii=False) + '\n').encode('utf-8'))
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp_path, path)
+
+    return {
+        'file': f"{month}/{filename}",
+        'month': month,
+        'min_id': min_id,
+        'max_id': max_id,
+        'min_ts': min(r['timestamp'] for r in rows),
+        'max_ts': max(r['timestamp'] for r in rows),
+        'rows': len(rows),
+        'created_at': datetime.now().isoformat(),
+    }
+
+
+# ---------------------------------------------------------
+# Archival Job
+# ---------------------------------------------------------
+def _try_file_lock(archive_dir):
+    """Non-blocking exclusive flock on the archive dir; returns the open file or None."""
+    lock_file = open(os.path.join(archive_dir, LOCK_NAME), 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def archive_audit_logs(retention_days=None, archive_dir=None, batch_size=None):
+    """
+    Move audit rows older than the retention window into archive segments.
+    Each batch is written and fsynced (segment + manifest) before its rows
+    are deleted, so a crash can only duplicate rows, never lose them.
+
+    Returns:
+        dict: {'archived': rows moved, 'segments': files written}
+              (+ 'skipped': 'locked' when another run is in progress,
+                 'not_configured' when there is no archive directory)
+    """
+    from services.job_scheduler import named_lock
+
+    archive_dir = archive_dir or AUDIT_ARCHIVE_DIR
+    if not archive_dir:
+        # Fail closed: never delete audit rows without durable storage to move them to
+        logger.warning("⚠️ AUDIT_ARCHIVE_DIR not set, audit logs are not archived")
+        return {'archived': 0, 'segments': 0, 'skipped': 'not_configured'}
+    os.makedirs(archive_dir, exist_ok=True)
+
+    db_lock = named_lock(ARCHIVE_LEASE_NAME, ARCHIVE_LOCK_KEY)
+    if not db_lock.acquire():
+        logger.info("⏭️ Audit archive already running elsewhere, skipped")
+        return {'archived': 0, 'segments': 0, 'skipped': 'locked'}
+    lock_file = _try_file_lock(archive_dir)
+    if lock_file is None:
+        db_lock.release()
+        logger.info("⏭️ Audit archive directory locked by another process, skipped")
+        return {'archived': 0, 'segments': 0, 'skipped': 'locked'}
+    try:
+        return _archive_locked(db_lock, retention_days, archive_dir, batch_size)
+    finally:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+        db_lock.release()
+
+
+def _archive_locked(db_lock, retention_days, archive_dir, batch_size):
+    retention_days = AUDIT_RETENTION_DAYS if retention_days is None else retention_days
+    batch_size = batch_size or AUDIT_ARCHIVE_BATCH
+
+    cutoff = archive_cutoff(retention_days)
+    conn = get_db()
+    archived = segments = 0
+
+    while True:
+        # Renews the lease; stop if it expired and another run took over
+        if not db_lock.acquire():
+            logger.warning("⚠️ Lost the audit archive lock, stopping")
+            break
+        rows = conn.execute("""
+            SELECT id, timestamp, user_id, username, action, target_type, target_id, details, ip_address
+            FROM audit_logs
+            WHERE timestamp < ?
+            ORDER BY id
+            LIMIT ?
+        """, (cutoff, batch_size)).fetchall()
+        if not rows:
+            break
+        rows = [dict(r) for r in rows]
+
+        # Partition the batch by month of the event
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(row['timestamp'][:7], []).append(row)
+
+        entries = [_write_segment(archive_dir, month, month_rows)
+                   for month, month_rows in sorted(by_month.items())]
+        # Re-read under the lock: never overwrite entries saved by an earlier run
+        manifest = load_manifest(archive_dir)
+        manifest['segments'].extend(entries)
+        _save_manifest(archive_dir, manifest)
+        segments += len(entries)
+
+        # Every row in this id range older than the cutoff was just archived
+        with conn.transaction():
+            conn.execute(
+                "DELETE FROM audit_logs WHERE id >= ? AND id <= ? AND timestamp < ?",
+                (rows[0]['id'], rows[-1]['id'], cutoff)
+            )
+        archived += len(rows)
+
+        if len(rows) < batch_size:
+            break
+
+    if archived:
+        logger.info(f"🗄️ Archived {archived} audit log(s) into {segments} segment(s)")
+    return {'archived': archived, 'segments': segments}
+
+
+# ---------------------------------------------------------
+# Archive Search
+# ---------------------------------------------------------
+def _iter_segment(archive_dir, entry):
+    with gzip.open(os.path.join(archive_dir, entry['file']), 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def archive_cutoff(retention_days=None):
+    """ISO timestamp before which audit rows live in the archive, not audit_logs."""
+    retention_days = AUDIT_RETENTION_DAYS if retention_days is None else retention_days
+    return (datetime.now() - timedelta(days=retention_days)).isoformat()
+
+
+def search_archived_logs(limit=100, user_id=None, action=None, target_type=None,
+                         target_id=None, start=None, end=None, before=None, archive_dir=None):
+    """
+    Search archived audit rows, newest first.
+    Segments outside [start, end) are skipped using the manifest alone.
+    before: keyset position (timestamp, id) - only rows strictly after it
+    in newest-first order are returned (continues an explorer page).
+
+    Returns:
+        list of dicts (same columns as audit_logs)
+    """
+    archive_dir = archive_dir or AUDIT_ARCHIVE_DIR
+    if not archive_dir:
+        return []
+    segments = sorted(load_manifest(archive_dir)['segments'],
+                      key=lambda s: s['max_ts'], reverse=True)
+    results = {}
+
+    for entry in segments:
+        if start and entry['max_ts'] < start:
+            continue
+        if end and entry['min_ts'] >= end:
+            continue
+        if before and entry['min_ts'] > before[0]:
+            continue
+        # Enough rows and every remaining segment is older than all of them
+        if len(results) >= limit:
+            oldest_kept = sorted(r['timestamp'] for r in results.values())[-limit]
+            if entry['max_ts'] < oldest_kept:
+                break
+
+        for row in _iter_segment(archive_dir, entry):
+            if user_id and row['user_id'] != user_id:
+                continue
+            if action and row['action'] != action:
+                continue
+            if target_type and row['target_type'] != target_type:
+                continue
+            if target_id and row['target_id'] != target_id:
+                continue
+            if start and row['timestamp'] < start:
+                continue
+            if end and row['timestamp'] >= end:
+                continue
+            if before and (row['timestamp'], row['id']) >= tuple(before):
+                continue
+            # Keyed by id: a batch re-archived after a crash appears only once
+            results[row['id']] = row
+
+    rows = sorted(results.values(), key=lambda r: (r['timestamp'], r['id']), reverse=True)
+    return rows[:limit]
@@ -1,16 +1,20 @@
 """
 Audit Service - Logging user actions for security and compliance
 """
+import base64
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 from flask import request
 from flask_login import current_user
 from models import get_db
+from audit.writer import (
+    audit_writer, AUDIT_ASYNC, SYNC_ACTIONS, ROLLUP_ACTIONS, INSERT_SQL, COUNTER_UPSERT_SQL
+)
 
 logger = logging.getLogger(__name__)
 
 
-def log_action(action, target_type=None, target_id=None, details=None):
+def log_action(action, target_type=None, target_id=None, details=None, sync=False):
     """
     บันทึก audit log ลงฐานข้อมูล
     
@@ -19,13 +23,11 @@ def log_action(action, target_type=None, target_id=None, details=None):
         target_type: ประเภทของเป้าหมาย เช่น 'project', 'user'
         target_id: ID ของเป้าหมาย
         details: รายละเอียดเพิ่มเติม (string)
+        sync: บังคับเขียนทันที (action ใน SYNC_ACTIONS เขียนทันทีเสมอ)
     """
     try:
-        conn = get_db()
-        conn.execute("""
-            INSERT INTO audit_logs (timestamp, user_id, username, action, target_type, target_id, details, ip_address)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
+        # Capture request context now - the background writer has none
+        record = (
             datetime.now().isoformat(),
             current_user.id if current_user.is_authenticated else None,
             current_user.username if current_user.is_authenticated else None,
@@ -34,13 +36,50 @@ def log_action(action, target_type=None, target_id=None, details=None):
             target_id,
             details,
             request.remote_addr if request else None
-        ))
-        conn.commit()
+        )
+        
+        if action in ROLLUP_ACTIONS and not sync:
+            _count_action(record)
+            return
+        
+        write_now = sync or not AUDIT_ASYNC or action in SYNC_ACTIONS
+        conn = get_db()
+        if write_now:
+            _write_record(conn, record)
+        else:
+            # Queued only once the caller's unit of work commits (immediately
+            # outside one), so a rolled-back action leaves no audit row
+            conn.after_commit(lambda: _submit_record(conn, record))
         logger.info(f"📝 Audit: {action} by {current_user.username if current_user.is_authenticated else 'anonymous'}")
     except Exception as e:
         logger.error(f"❌ Audit log error: {e}")
 
 
+def _write_record(conn, record):
+    # Joins the caller's transaction when one is active (as a savepoint,
+    # so a failed audit insert never aborts the caller's work)
+    with conn.transaction():
+        conn.execute(INSERT_SQL, record)
+
+
+def _submit_record(conn, record):
+    """Hand a committed action's record to the background writer (sync if its queue is full)."""
+    if not audit_writer.submit(record):
+        _write_record(conn, record)
+
+
+def _count_action(record):
+    """Roll a read event up into audit_counters (details are not kept)."""
+    timestamp, user_id, username, action = record[:4]
+    day = timestamp[:10]
+    if AUDIT_ASYNC:
+        audit_writer.count(day, user_id, username, action, timestamp)
+    else:
+        conn = get_db()
+        with conn.transaction():
+            conn.execute(COUNTER_UPSERT_SQL, (day, user_id or 0, action, username, 1, timestamp))
+
+
 def log_login_attempt(username, success):
     """บันทึกการพยายาม login"""
     action = "LOGIN_SUCCESS" if success else "LOGIN_FAILED"
@@ -52,7 +91,7 @@ def log_project_action(action, project_id=None, details=None):
     log_action(action, target_type="project", target_id=project_id, details=details)
 
 
-def get_audit_logs(limit=100, user_id=None, action=None):
+def get_audit_logs(limit=100, user_id=None, action=None, include_archived=False):
     """
     ดึงประวัติ audit logs
     
@@ -60,6 +99,7 @@ def get_audit_logs(limit=100, user_id=None, action=None):
         limit: จำนวนรายการสูงสุด (default: 100)
         user_id: กรอง by user ID (optional)
         action: กรอง by action type (optional)
+        include_archived: ค้นต่อใน archive segments ถ้าตารางหลักมีไม่ครบ limit
     
     Returns:
         list of audit log entries
@@ -80,4 +120,152 @@ def get_audit_logs(limit=100, user_id=None, action=None):
     sql += " ORDER BY timestamp DESC LIMIT ?"
     params.append(limit)
     
-    return conn.execute(sql, params).fetchall()
+    rows = conn.execute(sql, params).fetchall()
+    if not include_archived or len(rows) >= limit:
+        return rows
+    
+    # Archived rows are all older than the hot table's retention window
+    from audit.retention import search_archived_logs
+    archived = search_archived_logs(limit=limit - len(rows), user_id=user_id, action=action)
+    return [dict(r) for r in rows] + archived
+
+
+# ---------------------------------------------------------
+# Audit Explorer (keyset paging)
+# ---------------------------------------------------------
+def encode_cursor(row):
+    """Opaque keyset cursor for the position after row."""
+    raw = f"{row['timestamp']}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Return (timestamp, id) or None for an invalid/empty cursor."""
+    if not cursor:
+        return None
+    try:
+        ts, row_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').rsplit('|', 1)
+        return ts, int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _audit_filter_sql(filters):
+    """
+    Build the WHERE clause for explorer filters.
+    filters keys: user_id, action, target_type, target_id, start, end (ISO strings)
+    Each combination is served by one of the composite (…, timestamp) indexes.
+    """
+    sql = " WHERE 1=1"
+    params = []
+    if filters.get('user_id'):
+        sql += " AND user_id = ?"
+        params.append(filters['user_id'])
+    if filters.get('action'):
+        sql += " AND action = ?"
+        params.append(filters['action'])
+    if filters.get('target_type'):
+        sql += " AND target_type = ?"
+        params.append(filters['target_type'])
+    if filters.get('target_id'):
+        sql += " AND target_id = ?"
+        params.append(filters['target_id'])
+    if filters.get('start'):
+        sql += " AND timestamp >= ?"
+        params.append(filters['start'])
+    if filters.get('end'):
+        sql += " AND timestamp < ?"
+        params.append(filters['end'])
+    return sql, params
+
+
+def reaches_archive(filters):
+    """Whether archiving is configured and the filters' date range goes back past its cutoff."""
+    from audit import retention
+    if not retention.AUDIT_ARCHIVE_DIR:
+        return False
+    start = (filters or {}).get('start')
+    return not start or start < retention.archive_cutoff()
+
+
+def query_audit_logs(filters=None, cursor=None, limit=50, include_archived=False):
+    """
+    ดึง audit logs แบบ keyset paging (ใหม่ → เก่า)
+    
+    Args:
+        filters: dict ของเงื่อนไข (user_id, action, target_type, target_id, start, end)
+        cursor: ค่า next_cursor จากหน้าก่อนหน้า (optional)
+        limit: จำนวนต่อหน้า
+        include_archived: ค้นต่อใน archive segments เมื่อตารางหลักหมดและช่วงวันที่
+            ย้อนไปก่อน retention cutoff (แถวจาก archive มี 'archived': True)
+    
+    Returns:
+        (rows, next_cursor) - next_cursor เป็น None เมื่อถึงหน้าสุดท้าย
+    """
+    conn = get_db()
+    filters = filters or {}
+    where, params = _audit_filter_sql(filters)
+    
+    position = decode_cursor(cursor)
+    if position:
+        where += " AND (timestamp < ? OR (timestamp = ? AND id < ?))"
+        params.extend([position[0], position[0], position[1]])
+    
+    # Fetch one extra row to know whether another page exists
+    rows = conn.execute(
+        "SELECT * FROM audit_logs" + where + " ORDER BY timestamp DESC, id DESC LIMIT ?",
+        params + [limit + 1]
+    ).fetchall()
+    
+    if include_archived and len(rows) <= limit and reaches_archive(filters):
+        # Archived rows are all older than the hot table's: the page continues there
+        from audit.retention import search_archived_logs
+        before = (rows[-1]['timestamp'], rows[-1]['id']) if rows else position
+        seen = {r['id'] for r in rows}
+        archived = search_archived_logs(
+            limit=limit + 1, before=before,
+            **{k: filters.get(k) for k in ('user_id', 'action', 'target_type', 'target_id', 'start', 'end')}
+        )
+        # A batch interrupted before its DELETE exists in both places
+        rows = [dict(r) for r in rows] + [
+            dict(r, archived=True) for r in archived if r['id'] not in seen
+        ][:limit + 1 - len(rows)]
+    
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def iter_audit_logs(filters=None, chunk_size=1000, include_archived=False):
+    """
+    Yield every matching audit row (newest first) in keyset-paged chunks,
+    so exports of any size hold at most chunk_size rows in memory.
+    """
+    cursor = None
+    while True:
+        rows, cursor = query_audit_logs(filters, cursor=cursor, limit=chunk_size,
+                                        include_archived=include_archived)
+        for row in rows:
+            yield row
+        if not cursor:
+            return
+
+
+def get_audit_counters(days=30, user_id=None, action=None):
+    """
+    ดึงสรุปจำนวน read events (VIEW_REPORT, EXPORT_DATA ฯลฯ) ย้อนหลัง
+    
+    Returns:
+        list of rows (day, user_id, username, action, count, last_seen) ใหม่ → เก่า
+    """
+    conn = get_db()
+    since = (datetime.now() - timedelta(days=days)).date().isoformat()
+    query = "SELECT * FROM audit_counters WHERE day >= ?"
+    params = [since]
+    if user_id:
+        query += " AND user_id = ?"
+        params.append(user_id)
+    if action:
+        query += " AND action = ?"
+        params.append(action)
+    query += " ORDER BY day DESC, count DESC"
+    return conn.execute(query, params).fetchall()
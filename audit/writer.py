@@ -0,0 +1,258 @@
+"""
+Audit Writer - Write-behind pipeline for audit events
+Events go onto a bounded in-process queue and a background thread
+inserts them in batches, so routine audited requests pay no commit.
+"""
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from database import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Pipeline settings
+AUDIT_ASYNC = os.getenv('AUDIT_ASYNC', 'true').lower() == 'true'
+AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', 100))
+AUDIT_FLUSH_INTERVAL = float(os.getenv('AUDIT_FLUSH_INTERVAL', 2.0))
+AUDIT_QUEUE_SIZE = int(os.getenv('AUDIT_QUEUE_SIZE', 10000))
+AUDIT_COUNTER_FLUSH_INTERVAL = float(os.getenv('AUDIT_COUNTER_FLUSH_INTERVAL', 30.0))
+
+# Security-critical actions: always written synchronously in the caller's transaction
+SYNC_ACTIONS = {
+    'LOGIN_SUCCESS',
+    'LOGIN_FAILED',
+    'PASSWORD_CHANGED',
+    'PASSWORD_RESET',
+    'USER_CREATED',
+    'USER_UPDATED',
+    'USER_DELETED',
+    'PROJECT_DELETED',
+    'DATA_CLEARED',
+}
+
+# High-frequency read events: rolled up into audit_counters per (day, user, action)
+# instead of one audit_logs row each
+ROLLUP_ACTIONS = {
+    'VIEW_REPORT',
+    'EXPORT_DATA',
+}
+
+INSERT_SQL = """
+    INSERT INTO audit_logs (timestamp, user_id, username, action, target_type, target_id, details, ip_address)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+COUNTER_UPSERT_SQL = """
+    INSERT INTO audit_counters (day, user_id, action, username, count, last_seen)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (day, user_id, action) DO UPDATE
+    SET count = audit_counters.count + excluded.count,
+        username = excluded.username,
+        last_seen = excluded.last_seen
+"""
+
+
+class AuditWriter:
+    """
+    Bounded queue + background flusher.
+    A batch is written when it reaches AUDIT_BATCH_SIZE events or
+    AUDIT_FLUSH_INTERVAL seconds have passed, whichever comes first.
+    Rolled-up read events are summed in memory and upserted into
+    audit_counters every AUDIT_COUNTER_FLUSH_INTERVAL seconds.
+    """
+
+    def __init__(self, batch_size=AUDIT_BATCH_SIZE, flush_interval=AUDIT_FLUSH_INTERVAL,
+                 max_queue=AUDIT_QUEUE_SIZE, counter_interval=AUDIT_COUNTER_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.counter_interval = counter_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._counters = {}
+        self._counters_lock = threading.Lock()
+        self._counters_flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        # One connection per thread: SQLite connections cannot cross threads
+        self._local = threading.local()
+        self._atexit_registered = False
+        self.written = 0
+        self.batches = 0
+        self.rejected = 0
+        self.failed = 0
+        self.rolled_up = 0
+        self.counter_rows = 0
+
+    def submit(self, record):
+        """
+        Queue an audit row tuple (same order as INSERT_SQL).
+        Returns False if the queue is full - the caller then writes synchronously.
+        """
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            self.rejected += 1
+            return False
+
+    def count(self, day, user_id, username, action, seen_at):
+        """Add one occurrence of a rolled-up event to the in-memory counters."""
+        self._ensure_started()
+        key = (day, user_id or 0, action)
+        with self._counters_lock:
+            entry = self._counters.get(key)
+            if entry is None:
+                self._counters[key] = [username, 1, seen_at]
+            else:
+                entry[0] = username
+                entry[1] += 1
+                entry[2] = max(entry[2], seen_at)
+            self.rolled_up += 1
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            'queue_depth': self.depth(),
+            'written': self.written,
+            'batches': self.batches,
+            'rejected': self.rejected,
+            'failed': self.failed,
+            'rolled_up': self.rolled_up,
+            'pending_counters': len(self._counters),
+            'counter_rows': self.counter_rows,
+        }
+
+    def _ensure_started(self):
+        # Checked per process: a thread started before a fork does not survive it
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.shutdown)
+                self._atexit_registered = True
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect_batch()
+            if batch:
+                self._write(batch)
+            if time.monotonic() - self._counters_flushed_at >= self.counter_interval:
+                self._flush_counters()
+        # Final drain on this thread, with its own connection, then close it
+        self._drain()
+        self._close_conn()
+
+    def _get_conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = get_connection()
+        return conn
+
+    def _close_conn(self):
+        """Close the calling thread's connection (the next write reconnects)."""
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _collect_batch(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        try:
+            conn = self._get_conn()
+            with conn.transaction():
+                conn.executemany(INSERT_SQL, batch)
+            self.written += len(batch)
+            self.batches += 1
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error(f"❌ Audit batch write failed ({len(batch)} events): {e}")
+            # Drop the connection so the next batch reconnects
+            self._close_conn()
+
+    def _flush_counters(self):
+        self._counters_flushed_at = time.monotonic()
+        with self._counters_lock:
+            counters, self._counters = self._counters, {}
+        if not counters:
+            return
+        rows = [
+            (day, user_id, action, username, n, seen_at)
+            for (day, user_id, action), (username, n, seen_at) in counters.items()
+        ]
+        try:
+            conn = self._get_conn()
+            with conn.transaction():
+                conn.executemany(COUNTER_UPSERT_SQL, rows)
+            self.counter_rows += len(rows)
+        except Exception as e:
+            logger.error(f"❌ Audit counter flush failed ({len(rows)} rows): {e}")
+            # Fold the counts back in so the next flush retries them
+            with self._counters_lock:
+                for key, (username, n, seen_at) in counters.items():
+                    entry = self._counters.setdefault(key, [username, 0, seen_at])
+                    entry[1] += n
+                    entry[2] = max(entry[2], seen_at)
+            self._close_conn()
+
+    def _drain(self):
+        """Write everything currently queued and all counters."""
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                break
+            self._write(batch)
+        self._flush_counters()
+
+    def flush(self):
+        """Write everything queued (and all counters) from the calling thread, on its own connection."""
+        try:
+            self._drain()
+        finally:
+            if threading.current_thread() is not self._thread:
+                self._close_conn()
+
+    def shutdown(self, timeout=5.0):
+        """Stop the flusher and persist whatever is still queued."""
+        self._stop.set()
+        if self._thread is not None and self._thread.is_alive():
+            # The flusher drains and closes its connection before it exits
+            self._thread.join(timeout)
+        # Not started in this process, or stuck past the timeout
+        self.flush()
+
+
+# Shared per-process writer
+audit_writer = AuditWriter()
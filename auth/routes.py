@@ -105,10 +105,9 @@ def change_password():
             return redirect(url_for('auth.change_password'))
 
         hashed = generate_password_hash(new)
-        cursor.execute(f"UPDATE users SET password = {ph()} WHERE id = {ph()}", (hashed, current_user.id))
-        conn.commit()
-
-        log_action("PASSWORD_CHANGED")
+        with conn.transaction():
+            cursor.execute(f"UPDATE users SET password = {ph()} WHERE id = {ph()}", (hashed, current_user.id))
+            log_action("PASSWORD_CHANGED")
         flash('เปลี่ยนรหัสผ่านเรียบร้อยแล้ว', 'success')
         
         # Role-based redirect after password change
@@ -0,0 +1,132 @@
+"""
+User Cache - Bounded TTL cache for the Flask-Login user_loader
+Avoids a users-table round trip on every authenticated request
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from models import get_db
+from services.cache import cache, USERS
+from services.invalidation_bus import bus, USER
+
+logger = logging.getLogger(__name__)
+
+# Seconds a cached user stays valid (admin edits also invalidate explicitly)
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 60))
+
+# Maximum number of users kept per worker process
+USER_CACHE_MAX = int(os.getenv('USER_CACHE_MAX', 1024))
+
+
+class UserCache:
+    """
+    Thread-safe LRU cache of (id, username, email, role) rows with a TTL.
+    Only the columns the User model needs are stored - never the password hash.
+    """
+
+    def __init__(self, ttl=USER_CACHE_TTL, max_size=USER_CACHE_MAX):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id):
+        """Return the cached row tuple or None if missing/expired."""
+        key = str(user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, user_id, row):
+        """Store a row tuple, evicting the least recently used entry if full."""
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+        key = str(user_id)
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, row)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id):
+        """Drop a single user (call after edit / delete / password reset)."""
+        with self._lock:
+            if self._data.pop(str(user_id), None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Return hit-rate metrics for monitoring."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# Shared per-process instance
+user_cache = UserCache()
+
+
+def load_user_row(user_id):
+    """
+    Return (id, username, email, role) for user_id, served from the cache when fresh.
+    A cache hit does not open a database connection at all.
+    Returns None if the user does not exist (misses are not cached).
+    """
+    row = user_cache.get(user_id)
+    if row is not None:
+        return row
+
+    u = get_db().execute(
+        "SELECT id, username, email, role FROM users WHERE id = ?", (user_id,)
+    ).fetchone()
+    if not u:
+        return None
+
+    row = (u['id'], u['username'], u['email'], u['role'])
+    user_cache.put(user_id, row)
+    return row
+
+
+def _apply_user_invalidation(event):
+    if event.get('user_id') is not None:
+        user_cache.invalidate(event['user_id'])
+    cache.invalidate_tags(USERS)
+
+
+bus.subscribe(USER, _apply_user_invalidation)
+
+
+def invalidate_user(user_id=None):
+    """
+    Write-through invalidation hook for routes that create or modify a user.
+    Also drops shared lookups built from the users table (researcher lists).
+    Every worker on every node drops its copy, not just this one.
+    """
+    bus.publish(get_db(), USER, user_id=user_id)
@@ -0,0 +1,156 @@
+"""
+Notification throughput benchmark
+Seeds N projects with deadlines spread around today into a throwaway SQLite
+database, then measures notify_deadlines (wall time, DB statements) and the
+outbox drain (wall time, API calls) without touching real SendGrid.
+
+    python benchmark_notifications.py --projects 5000 --admins 5
+    python benchmark_notifications.py --transport standin --latency 0.05 --rate-429 0.05
+    SMTP_PORT=8026 SMTP_STARTTLS=false python benchmark_notifications.py --transport smtp
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from datetime import date, timedelta
+
+parser = argparse.ArgumentParser(description="Benchmark the deadline notification path")
+parser.add_argument('--projects', type=int, default=2000)
+parser.add_argument('--admins', type=int, default=3)
+parser.add_argument('--researchers', type=int, default=200, help="users projects are assigned to")
+parser.add_argument('--transport', choices=['memory', 'standin', 'smtp'], default='memory')
+parser.add_argument('--latency', type=float, default=0.02, help="stand-in seconds per request")
+parser.add_argument('--rate-429', type=float, default=0.0)
+parser.add_argument('--rate-5xx', type=float, default=0.0)
+parser.add_argument('--seed', type=int, default=42)
+parser.add_argument('--keep', action='store_true', help="keep the benchmark database")
+args = parser.parse_args()
+
+# Must be set before the app modules read their settings
+workdir = tempfile.mkdtemp(prefix='itrack-bench-')
+os.environ['SQLITE_PATH'] = os.path.join(workdir, 'bench.db')
+os.environ.pop('DATABASE_URL', None)
+os.environ.setdefault('AUDIT_ASYNC', 'false')
+os.environ.setdefault('EMAIL_BACKOFF_SECONDS', '0.05')
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+from werkzeug.security import generate_password_hash
+from models import init_db, get_db, close_db
+from notifications.deadline_schedule import rebuild_schedule
+from notifications.scheduler import notify_deadlines
+from notifications.outbox import drain_outbox, get_outbox_stats
+from notifications.email_transport import MemoryTransport, StandInTransport, SMTPTransport, set_transport
+from notifications.email_dispatcher import dispatcher
+from notifications.sendgrid_standin import StandInServer
+
+app = Flask(__name__)
+app.config['MAIL_SENDER'] = 'bench@itrack.local'
+app.teardown_appcontext(close_db)
+
+
+def seed(conn, rng, today):
+    """Users (admins + researchers) and projects with deadlines from -60 to +45 days"""
+    password = generate_password_hash('bench')
+    with conn.transaction():
+        conn.executemany(
+            "INSERT INTO users (username, password, email, role) VALUES (?, ?, ?, ?)",
+            [(f"admin{i}", password, f"admin{i}@bench.local", 'admin') for i in range(args.admins)]
+            + [(f"researcher{i}", password, f"researcher{i}@bench.local", 'researcher')
+               for i in range(args.researchers)]
+        )
+        researcher_ids = [r['id'] for r in conn.execute(
+            "SELECT id FROM users WHERE role = 'researcher'"
+        ).fetchall()]
+        rows = []
+        for i in range(args.projects):
+            deadline = today + timedelta(days=rng.randint(-60, 45))
+            assigned = rng.choice(researcher_ids) if researcher_ids and rng.random() < 0.7 else None
+            rows.append((
+                f"โครงการทดสอบ {i}", f"Benchmark project {i}", f"Researcher {i}",
+                f"owner{i}@bench.local", deadline.isoformat(), assigned
+            ))
+        conn.executemany("""
+            INSERT INTO research_projects
+                (project_th, project_en, researcher_name, researcher_email, deadline, assigned_researcher_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, rows)
+        scheduled = rebuild_schedule(conn, today)
+    return scheduled
+
+
+def timed(func):
+    """Run func in a fresh app context; returns (result, seconds, db statements)"""
+    with app.app_context():
+        conn = get_db()
+        start_queries = conn.query_count
+        t0 = time.perf_counter()
+        result = func()
+        return result, time.perf_counter() - t0, conn.query_count - start_queries
+
+
+def main():
+    rng = random.Random(args.seed)
+    today = date.today()
+    server = None
+
+    if args.transport == 'standin':
+        server = StandInServer(latency=args.latency, rate_429=args.rate_429,
+                               rate_5xx=args.rate_5xx, seed=args.seed).start()
+        transport = StandInTransport(server.url)
+    elif args.transport == 'smtp':
+        # Relay from SMTP_* settings, e.g. python -m aiosmtpd -n -l 127.0.0.1:8026
+        transport = SMTPTransport()
+    else:
+        transport = MemoryTransport()
+    set_transport(transport)
+
+    print(f"--- 📊 NOTIFICATION BENCHMARK ({args.projects} projects, transport={args.transport}) ---")
+    print(f"   DB: {os.environ['SQLITE_PATH']}")
+
+    with app.app_context():
+        init_db()
+        scheduled = seed(get_db(), rng, today)
+        due_today = get_db().execute(
+            "SELECT COUNT(*) as cnt FROM notification_schedule WHERE due_on = ?", (today.isoformat(),)
+        ).fetchone()['cnt']
+    print(f"   Seeded {args.projects} projects, {scheduled} schedule rows, {due_today} due today")
+
+    queued, seconds, queries = timed(notify_deadlines)
+    print(f"\n[ ⏳ notify_deadlines ]")
+    print(f"   {seconds * 1000:.1f} ms | {queries} DB statements | {queued} researcher emails queued")
+    with app.app_context():
+        print(f"   Outbox: {get_outbox_stats()}")
+
+    stats_before = dispatcher.stats()
+    totals, seconds, queries = timed(drain_outbox)
+    print(f"\n[ 📤 drain_outbox ]")
+    print(f"   {seconds * 1000:.1f} ms | {queries} DB statements | {totals}")
+    if server is not None:
+        stats = server.stats()
+        print(f"   API calls accepted: {stats['accepted']} ({stats['recipients']} recipients), "
+              f"status counts: {stats['status_counts']}, max in flight: {stats['max_in_flight']}")
+        print(f"   Retries: {dispatcher.stats()['retries'] - stats_before['retries']}")
+        server.stop()
+    elif args.transport == 'smtp':
+        print(f"   SMTP: {transport.stats()}")
+        transport.close()
+    else:
+        stats = transport.stats()
+        print(f"   API calls: {stats['calls']} ({stats['messages']} recipients)")
+
+    queued, seconds, queries = timed(notify_deadlines)
+    print(f"\n[ 🔁 notify_deadlines again (same day) ]")
+    print(f"   {seconds * 1000:.1f} ms | {queries} DB statements | {queued} emails queued")
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
@@ -3,8 +3,10 @@ Database Connection Module for ITrackCDTI
 Supports both SQLite (development) and PostgreSQL (production)
 """
 import os
+import time
 import sqlite3
 import logging
+from contextlib import contextmanager
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +16,32 @@ DATABASE_URL = os.getenv('DATABASE_URL')
 # Detect if we're using PostgreSQL
 IS_POSTGRES = DATABASE_URL is not None and 'postgres' in DATABASE_URL
 
+# SQLite file used when DATABASE_URL is not set (benchmarks point this elsewhere)
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'database.db')
+
+# Connections opened / closed by this process. There is no pool: each request
+# (and each background thread) opens its own connection and closes it after.
+connection_stats = {'opened': 0, 'closed': 0}
+
+# Callables observer(seconds) run after every statement (request timing, metrics).
+# Empty by default, so statements are not timed at all.
+_query_observers = []
+
+
+def add_query_observer(observer):
+    """Register observer(seconds), called after each execute()/executemany()."""
+    if observer not in _query_observers:
+        _query_observers.append(observer)
+
+
+def _observe_query(start):
+    elapsed = time.perf_counter() - start
+    for observer in _query_observers:
+        try:
+            observer(elapsed)
+        except Exception as e:
+            logger.error(f"❌ Query observer failed: {e}")
+
 
 class DatabaseWrapper:
     """
@@ -24,17 +52,120 @@ class DatabaseWrapper:
     def __init__(self, conn, is_postgres=False):
         self._conn = conn
         self._is_postgres = is_postgres
+        self._tx_depth = 0
+        self._savepoint_seq = 0
+        self._after_commit = []
+        # Statements sent through execute()/executemany() on this connection
+        self.query_count = 0
     
     def cursor(self):
         return self._conn.cursor()
     
+    @property
+    def raw_connection(self):
+        """Underlying driver connection (LISTEN, driver-specific settings)."""
+        return self._conn
+    
+    @property
+    def in_transaction(self):
+        """True while a transaction() block is active on this connection."""
+        return self._tx_depth > 0
+    
     def commit(self):
+        """
+        Commit the current transaction.
+        Inside a transaction() block the commit is deferred to the outermost
+        block, so helpers that call commit() simply join the unit of work.
+        """
+        if self._tx_depth > 0:
+            return None
         return self._conn.commit()
     
     def rollback(self):
+        if self._tx_depth > 0:
+            # Rolling back underneath an active block would silently discard
+            # the caller's work - let the block handle it instead.
+            raise RuntimeError("rollback() called inside transaction(); raise to abort the block")
         return self._conn.rollback()
     
+    @contextmanager
+    def transaction(self):
+        """
+        Unit-of-work context manager.
+        The outermost block commits once on success and rolls back on error.
+        Nested blocks use SAVEPOINTs, so a failing inner block only undoes
+        its own statements and the outer block can carry on.
+        
+        Usage:
+            with conn.transaction():
+                conn.execute(...)
+                log_action(...)   # joins the same commit
+        """
+        if self._tx_depth == 0:
+            self._begin()
+            self._tx_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._tx_depth -= 1
+                self._after_commit = []
+                self._conn.rollback()
+                raise
+            else:
+                self._tx_depth -= 1
+                try:
+                    self._conn.commit()
+                except BaseException:
+                    self._after_commit = []
+                    raise
+                self._run_after_commit()
+        else:
+            self._savepoint_seq += 1
+            name = f"sp_{self._savepoint_seq}"
+            self._conn.cursor().execute(f"SAVEPOINT {name}")
+            self._tx_depth += 1
+            pending = len(self._after_commit)
+            try:
+                yield self
+            except BaseException:
+                self._tx_depth -= 1
+                del self._after_commit[pending:]
+                self._conn.cursor().execute(f"ROLLBACK TO SAVEPOINT {name}")
+                self._conn.cursor().execute(f"RELEASE SAVEPOINT {name}")
+                raise
+            else:
+                self._tx_depth -= 1
+                self._conn.cursor().execute(f"RELEASE SAVEPOINT {name}")
+    
+    def after_commit(self, callback):
+        """
+        Run callback once the current unit of work is durably committed.
+        Callbacks registered inside a block that rolls back are discarded.
+        Outside a transaction() block the callback runs immediately.
+        """
+        if self._tx_depth == 0:
+            callback()
+        else:
+            self._after_commit.append(callback)
+    
+    def _run_after_commit(self):
+        callbacks, self._after_commit = self._after_commit, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"❌ after_commit callback failed: {e}")
+    
+    def _begin(self):
+        """Open a transaction explicitly so savepoints nest inside it."""
+        if self._is_postgres:
+            # psycopg2 opens a transaction implicitly on the first statement
+            return
+        if not self._conn.in_transaction:
+            self._conn.execute("BEGIN")
+    
     def close(self):
+        connection_stats['closed'] += 1
         return self._conn.close()
     
     def execute(self, query, params=None):
@@ -45,11 +176,37 @@ class DatabaseWrapper:
         if self._is_postgres:
             query = query.replace('?', '%s')
         
+        self.query_count += 1
         cursor = self._conn.cursor()
-        if params:
-            cursor.execute(query, params)
-        else:
-            cursor.execute(query)
+        start = time.perf_counter() if _query_observers else None
+        try:
+            if params:
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
+        finally:
+            if start is not None:
+                _observe_query(start)
+        return cursor
+    
+    def executemany(self, query, params_seq):
+        """
+        Execute a query once per parameter tuple.
+        On PostgreSQL the statements are sent in batches (execute_batch)
+        instead of one round trip per row.
+        """
+        self.query_count += 1
+        cursor = self._conn.cursor()
+        start = time.perf_counter() if _query_observers else None
+        try:
+            if self._is_postgres:
+                import psycopg2.extras
+                psycopg2.extras.execute_batch(cursor, query.replace('?', '%s'), params_seq)
+            else:
+                cursor.executemany(query, params_seq)
+        finally:
+            if start is not None:
+                _observe_query(start)
         return cursor
 
 
@@ -71,11 +228,13 @@ def get_connection():
         conn = psycopg2.connect(db_url)
         # Use RealDictCursor for dict-like row access
         conn.cursor_factory = psycopg2.extras.RealDictCursor
+        connection_stats['opened'] += 1
         logger.info("✅ Connected to PostgreSQL (Neon)")
         return DatabaseWrapper(conn, is_postgres=True)
     else:
-        conn = sqlite3.connect('database.db')
+        conn = sqlite3.connect(SQLITE_PATH)
         conn.row_factory = sqlite3.Row
+        connection_stats['opened'] += 1
         logger.info("✅ Connected to SQLite (local)")
         return DatabaseWrapper(conn, is_postgres=False)
 
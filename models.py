@@ -1,5 +1,6 @@
 import os
 import logging
+from datetime import datetime
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash
 from flask import g
@@ -221,6 +222,221 @@ def init_db():
             )
         """)
 
+    # ---------- Per-user Notification State (version stamp for ETags) ----------
+    # Same DDL on both databases (no auto-increment column)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS notification_state (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            unread_count INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    add_column_if_missing(cursor, 'notification_state', 'unread_count', 'INTEGER NOT NULL DEFAULT 0')
+
+    # ---------- Data Versions (bumped by every mutating route) ----------
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT
+        )
+    """)
+
+    # ---------- Audit Counters (rolled-up read events) ----------
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS audit_counters (
+            day TEXT NOT NULL,
+            user_id INTEGER NOT NULL DEFAULT 0,
+            action TEXT NOT NULL,
+            username TEXT,
+            count INTEGER NOT NULL DEFAULT 0,
+            last_seen TEXT,
+            PRIMARY KEY (day, user_id, action)
+        )
+    """)
+
+    # ---------- Notification Schedule (precomputed deadline reminders) ----------
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS notification_schedule (
+            project_id INTEGER NOT NULL,
+            due_on TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            PRIMARY KEY (project_id, due_on, kind)
+        )
+    """)
+
+    # ---------- Email Outbox (drained by notifications/outbox.py) ----------
+    if IS_POSTGRES:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS email_outbox (
+                id SERIAL PRIMARY KEY,
+                to_email TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                html TEXT NOT NULL,
+                text TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TEXT NOT NULL,
+                lease_until TEXT,
+                claim_token TEXT,
+                last_error TEXT,
+                created_at TEXT NOT NULL,
+                sent_at TEXT,
+                substitutions TEXT
+            )
+        """)
+    else:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS email_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                to_email TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                html TEXT NOT NULL,
+                text TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TEXT NOT NULL,
+                lease_until TEXT,
+                claim_token TEXT,
+                last_error TEXT,
+                created_at TEXT NOT NULL,
+                sent_at TEXT,
+                substitutions TEXT
+            )
+        """)
+
+    add_column_if_missing(cursor, 'email_outbox', 'substitutions', 'TEXT')
+
+    # ---------- Notification Ledger (one row per sent deadline notification) ----------
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS notification_ledger (
+            project_id INTEGER NOT NULL,
+            recipient TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            due_date TEXT NOT NULL,
+            created_at TEXT,
+            PRIMARY KEY (project_id, recipient, kind, due_date)
+        )
+    """)
+
+    # ---------- Job Scheduler (services/job_scheduler.py) ----------
+    if IS_POSTGRES:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS job_runs (
+                id SERIAL PRIMARY KEY,
+                job TEXT NOT NULL,
+                started_at TEXT NOT NULL,
+                finished_at TEXT,
+                duration_ms INTEGER,
+                status TEXT NOT NULL,
+                result TEXT,
+                node TEXT,
+                heartbeat_at TEXT
+            )
+        """)
+    else:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS job_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job TEXT NOT NULL,
+                started_at TEXT NOT NULL,
+                finished_at TEXT,
+                duration_ms INTEGER,
+                status TEXT NOT NULL,
+                result TEXT,
+                node TEXT,
+                heartbeat_at TEXT
+            )
+        """)
+
+    # 'running' rows are renewed by the job heartbeat
+    add_column_if_missing(cursor, 'job_runs', 'heartbeat_at', 'TEXT')
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS scheduler_lease (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at TEXT NOT NULL
+        )
+    """)
+
+    # ---------- Manager Digest (notifications/digest.py) ----------
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS notification_preferences (
+            user_id INTEGER PRIMARY KEY,
+            email_mode TEXT NOT NULL DEFAULT 'immediate',
+            updated_at TEXT
+        )
+    """)
+    if IS_POSTGRES:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS digest_events (
+                id SERIAL PRIMARY KEY,
+                kind TEXT NOT NULL,
+                project_id INTEGER,
+                project_name TEXT,
+                detail TEXT,
+                created_at TEXT NOT NULL,
+                digested_at TEXT
+            )
+        """)
+    else:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS digest_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                project_id INTEGER,
+                project_name TEXT,
+                detail TEXT,
+                created_at TEXT NOT NULL,
+                digested_at TEXT
+            )
+        """)
+
+    # ---------- Project Change Feed (services/project_changes.py) ----------
+    if IS_POSTGRES:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS project_changes (
+                seq SERIAL PRIMARY KEY,
+                project_id INTEGER,
+                op TEXT NOT NULL,
+                fields TEXT,
+                changed_at TEXT NOT NULL,
+                changed_by INTEGER
+            )
+        """)
+    else:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS project_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                project_id INTEGER,
+                op TEXT NOT NULL,
+                fields TEXT,
+                changed_at TEXT NOT NULL,
+                changed_by INTEGER
+            )
+        """)
+
+    # ---------- Invalidation Bus (services/invalidation_bus.py, polling backend) ----------
+    if IS_POSTGRES:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS invalidation_events (
+                seq SERIAL PRIMARY KEY,
+                origin TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            )
+        """)
+    else:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS invalidation_events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                origin TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            )
+        """)
+
     logger.info("✅ All tables ready")
 
     # ---------- Default Admin ----------
@@ -268,6 +484,45 @@ def init_db():
     # Create indexes for better query performance
     create_indexes(conn, cursor)
 
+    # Re-sync denormalized unread counters (index-only scan, self-heals drift)
+    refresh_unread_counters(conn)
+
+    # First run with the schedule table: build it from existing projects
+    from notifications.deadline_schedule import backfill_schedule
+    backfill_schedule(conn, datetime.today().date())
+
+
+def add_column_if_missing(cursor, table, column, definition):
+    """
+    Add a column to an existing table (CREATE TABLE IF NOT EXISTS never alters).
+    """
+    if IS_POSTGRES:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {definition}")
+        return
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in [r['name'] for r in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        logger.info(f"✅ Added column {table}.{column}")
+
+
+def refresh_unread_counters(conn):
+    """
+    Recompute notification_state.unread_count from the notifications table.
+    Used at startup and after bulk deletes; normal writes keep it in step.
+    """
+    with conn.transaction():
+        conn.execute("""
+            INSERT INTO notification_state (user_id, version, unread_count)
+            SELECT DISTINCT user_id, 0, 0 FROM notifications
+            WHERE user_id NOT IN (SELECT user_id FROM notification_state)
+        """)
+        conn.execute("""
+            UPDATE notification_state SET unread_count = (
+                SELECT COUNT(*) FROM notifications n
+                WHERE n.user_id = notification_state.user_id AND n.is_read = 0
+            )
+        """)
+
 
 def create_indexes(conn, cursor):
     """
@@ -287,6 +542,15 @@ def create_indexes(conn, cursor):
                 "CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)",
                 "CREATE INDEX IF NOT EXISTS idx_audit_timestamp ON audit_logs(timestamp)",
                 "CREATE INDEX IF NOT EXISTS idx_audit_action ON audit_logs(action)",
+                "CREATE INDEX IF NOT EXISTS idx_audit_user_timestamp ON audit_logs(user_id, timestamp)",
+                "CREATE INDEX IF NOT EXISTS idx_audit_target_timestamp ON audit_logs(target_type, target_id, timestamp)",
+                "CREATE INDEX IF NOT EXISTS idx_audit_action_timestamp ON audit_logs(action, timestamp)",
+                "CREATE INDEX IF NOT EXISTS idx_notifications_user_read_created ON notifications(user_id, is_read, created_at DESC)",
+                "CREATE INDEX IF NOT EXISTS idx_notification_schedule_due ON notification_schedule(due_on)",
+                "CREATE INDEX IF NOT EXISTS idx_email_outbox_status_next ON email_outbox(status, next_attempt_at)",
+                "CREATE INDEX IF NOT EXISTS idx_digest_events_pending ON digest_events(digested_at, created_at)",
+                "CREATE INDEX IF NOT EXISTS idx_notification_ledger_due ON notification_ledger(due_date)",
+                "CREATE INDEX IF NOT EXISTS idx_job_runs_job_started ON job_runs(job, started_at)",
             ]
         else:
             # SQLite indexes
@@ -300,6 +564,15 @@ def create_indexes(conn, cursor):
                 "CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)",
                 "CREATE INDEX IF NOT EXISTS idx_audit_timestamp ON audit_logs(timestamp)",
                 "CREATE INDEX IF NOT EXISTS idx_audit_action ON audit_logs(action)",
+                "CREATE INDEX IF NOT EXISTS idx_audit_user_timestamp ON audit_logs(user_id, timestamp)",
+                "CREATE INDEX IF NOT EXISTS idx_audit_target_timestamp ON audit_logs(target_type, target_id, timestamp)",
+                "CREATE INDEX IF NOT EXISTS idx_audit_action_timestamp ON audit_logs(action, timestamp)",
+                "CREATE INDEX IF NOT EXISTS idx_notifications_user_read_created ON notifications(user_id, is_read, created_at DESC)",
+                "CREATE INDEX IF NOT EXISTS idx_notification_schedule_due ON notification_schedule(due_on)",
+                "CREATE INDEX IF NOT EXISTS idx_email_outbox_status_next ON email_outbox(status, next_attempt_at)",
+                "CREATE INDEX IF NOT EXISTS idx_digest_events_pending ON digest_events(digested_at, created_at)",
+                "CREATE INDEX IF NOT EXISTS idx_notification_ledger_due ON notification_ledger(due_date)",
+                "CREATE INDEX IF NOT EXISTS idx_job_runs_job_started ON job_runs(job, started_at)",
             ]
         
         for idx_sql in indexes:
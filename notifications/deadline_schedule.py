@@ -0,0 +1,125 @@
+"""
+Deadline Schedule - Precomputed dates on which a project needs a notification
+Rows are regenerated whenever a project's deadline or recipient changes, so the
+daily job reads only today's rows instead of parsing every project's deadline.
+
+Kinds:
+    reminder - deadline is REMINDER_DAYS days away
+    overdue  - next weekly overdue boundary (day 1, then every 7 days);
+               only the next one is stored and the daily job rolls it forward
+"""
+import logging
+from datetime import timedelta
+from models import parse_date_fast
+
+logger = logging.getLogger(__name__)
+
+# Days before deadline to send reminders
+REMINDER_DAYS = [30, 15, 7, 0]
+
+# Ids per "IN (...)" list (bind params, well under SQLite's 999 limit);
+# a bulk import can touch thousands of projects at once
+ID_CHUNK = 500
+
+INSERT_SQL = """
+    INSERT INTO notification_schedule (project_id, due_on, kind)
+    VALUES (?, ?, ?)
+    ON CONFLICT (project_id, due_on, kind) DO NOTHING
+"""
+
+
+def schedule_for_deadline(deadline, start):
+    """
+    Return [(due_on, kind), ...] for one deadline, on or after start.
+    """
+    entries = [(deadline - timedelta(days=n), 'reminder') for n in REMINDER_DAYS]
+    entries = [(d, kind) for d, kind in entries if d >= start]
+
+    days_overdue = (start - deadline).days
+    if days_overdue <= 1:
+        next_overdue = 1
+    else:
+        # Round up to the next 7-day boundary
+        next_overdue = -(-days_overdue // 7) * 7
+    entries.append((deadline + timedelta(days=next_overdue), 'overdue'))
+    return entries
+
+
+def rebuild_schedule(conn, start, project_ids=None):
+    """
+    Regenerate schedule rows for the given projects (all projects if None).
+    Call inside the same transaction as the write that changed them.
+    Projects without a deadline or a recipient get no rows.
+    """
+    query = """
+        SELECT id, deadline, assigned_researcher_id, researcher_email
+        FROM research_projects
+    """
+    if project_ids is None:
+        projects = conn.execute(query).fetchall()
+    else:
+        project_ids = list(project_ids)
+        if not project_ids:
+            return 0
+        projects = []
+        for offset in range(0, len(project_ids), ID_CHUNK):
+            chunk = project_ids[offset:offset + ID_CHUNK]
+            projects.extend(conn.execute(
+                query + f" WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+            ).fetchall())
+
+    clear_schedule(conn, project_ids)
+
+    rows = []
+    for p in projects:
+        if not p['assigned_researcher_id'] and not p['researcher_email']:
+            continue
+        deadline = parse_date_fast(p['deadline'])
+        if not deadline:
+            continue
+        for due_on, kind in schedule_for_deadline(deadline, start):
+            rows.append((p['id'], due_on.isoformat(), kind))
+
+    if rows:
+        conn.executemany(INSERT_SQL, rows)
+    return len(rows)
+
+
+def clear_schedule(conn, project_ids=None):
+    """Drop schedule rows for the given projects (all rows if None)."""
+    if project_ids is None:
+        conn.execute("DELETE FROM notification_schedule")
+        return
+    project_ids = list(project_ids)
+    for offset in range(0, len(project_ids), ID_CHUNK):
+        chunk = project_ids[offset:offset + ID_CHUNK]
+        conn.execute(
+            f"DELETE FROM notification_schedule WHERE project_id IN ({', '.join('?' * len(chunk))})",
+            chunk
+        )
+
+
+def roll_forward_schedule(conn, today):
+    """
+    Regenerate projects whose rows are in the past (yesterday's overdue
+    boundary, or days the job did not run) so they point at the next date.
+    """
+    stale = conn.execute(
+        "SELECT DISTINCT project_id FROM notification_schedule WHERE due_on < ?",
+        (today.isoformat(),)
+    ).fetchall()
+    if not stale:
+        return 0
+    with conn.transaction():
+        rebuild_schedule(conn, today, [r['project_id'] for r in stale])
+    return len(stale)
+
+
+def backfill_schedule(conn, today):
+    """Build the schedule for existing projects the first time the table is created."""
+    if conn.execute("SELECT 1 FROM notification_schedule LIMIT 1").fetchone():
+        return
+    with conn.transaction():
+        count = rebuild_schedule(conn, today)
+    if count:
+        logger.info(f"✅ Notification schedule backfilled ({count} entries)")
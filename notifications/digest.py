@@ -0,0 +1,133 @@
+"""
+Manager Digest - Collect manager-facing events and send one summary per window
+Admins/managers choose 'immediate' (one email per event) or 'digest'
+(events are stored in digest_events and summarized once per
+DIGEST_WINDOW_HOURS in a single email, rendered once for all recipients).
+Managers without a stored preference get MANAGER_EMAIL_MODE (default
+'immediate'; digests are opt-in from the notification settings page).
+"""
+import os
+import logging
+from datetime import datetime, timedelta
+from models import get_db
+from notifications.email_service import build_digest_email, personalize, RECIPIENT_TOKEN
+from notifications.outbox import enqueue_emails
+
+logger = logging.getLogger(__name__)
+
+# Digest settings
+DIGEST_WINDOW_HOURS = float(os.getenv('DIGEST_WINDOW_HOURS', 24))
+DEFAULT_EMAIL_MODE = os.getenv('MANAGER_EMAIL_MODE', 'immediate')
+
+EMAIL_MODES = ('immediate', 'digest')
+
+# Event kinds (rows in digest_events)
+DEADLINE = 'deadline'
+OVERDUE = 'overdue'
+PROGRESS = 'progress'
+
+
+# ---------------------------------------------------------
+# Preferences
+# ---------------------------------------------------------
+def get_email_mode(user_id):
+    """Return 'immediate' or 'digest' for one user."""
+    row = get_db().execute(
+        "SELECT email_mode FROM notification_preferences WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    return row['email_mode'] if row else DEFAULT_EMAIL_MODE
+
+
+def set_email_mode(user_id, mode):
+    """Store a user's delivery preference."""
+    if mode not in EMAIL_MODES:
+        raise ValueError(f"Unknown email mode: {mode}")
+    conn = get_db()
+    with conn.transaction():
+        conn.execute("""
+            INSERT INTO notification_preferences (user_id, email_mode, updated_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE
+            SET email_mode = excluded.email_mode, updated_at = excluded.updated_at
+        """, (user_id, mode, datetime.now().isoformat()))
+
+
+def get_manager_recipients(conn):
+    """
+    Admins/managers with an email, split by delivery preference.
+
+    Returns:
+        (immediate, digest) - lists of rows with id, username, email
+    """
+    rows = conn.execute("""
+        SELECT u.id, u.username, u.email, p.email_mode
+        FROM users u
+        LEFT JOIN notification_preferences p ON p.user_id = u.id
+        WHERE u.role IN ('admin', 'manager') AND u.email IS NOT NULL AND u.email != ''
+    """).fetchall()
+    immediate, digest = [], []
+    for r in rows:
+        (digest if (r['email_mode'] or DEFAULT_EMAIL_MODE) == 'digest' else immediate).append(r)
+    return immediate, digest
+
+
+# ---------------------------------------------------------
+# Events
+# ---------------------------------------------------------
+def record_digest_events(conn, events):
+    """
+    Store manager-facing events for the next digest (joins the caller's transaction).
+    events: list of (kind, project_id, project_name, detail)
+    """
+    if not events:
+        return
+    now = datetime.now().isoformat()
+    conn.executemany("""
+        INSERT INTO digest_events (kind, project_id, project_name, detail, created_at)
+        VALUES (?, ?, ?, ?, ?)
+    """, [(kind, pid, name, detail, now) for kind, pid, name, detail in events])
+
+
+def send_digests(window_hours=None, force=False):
+    """
+    Queue one digest email per digest-mode manager once the oldest pending
+    event is older than the window (or immediately with force=True).
+    Pending events are claimed (digested_at set) in the same transaction that
+    queues the email, so concurrent runs (scheduler on two nodes, cron
+    endpoint) cannot send the same events twice.
+
+    Returns:
+        dict: {'events': events summarized, 'recipients': emails queued}
+    """
+    window_hours = DIGEST_WINDOW_HOURS if window_hours is None else window_hours
+    conn = get_db()
+    now = datetime.now()
+
+    oldest = conn.execute(
+        "SELECT MIN(created_at) as oldest FROM digest_events WHERE digested_at IS NULL"
+    ).fetchone()['oldest']
+    if not oldest:
+        return {'events': 0, 'recipients': 0}
+    if not force and oldest > (now - timedelta(hours=window_hours)).isoformat():
+        return {'events': 0, 'recipients': 0}
+
+    claim = now.isoformat()
+    with conn.transaction():
+        # Claim first: a concurrent run blocks on these rows and then finds none pending
+        conn.execute("UPDATE digest_events SET digested_at = ? WHERE digested_at IS NULL", (claim,))
+        events = conn.execute("""
+            SELECT * FROM digest_events
+            WHERE digested_at = ?
+            ORDER BY kind, created_at
+        """, (claim,)).fetchall()
+        if not events:
+            return {'events': 0, 'recipients': 0}
+        _, recipients = get_manager_recipients(conn)
+        if recipients:
+            # Rendered once; each manager gets a personalized copy in one API request
+            oldest = min(e['created_at'] for e in events)
+            message = build_digest_email(None, RECIPIENT_TOKEN, events, oldest[:10], now.date().isoformat())
+            enqueue_emails(conn, [personalize(message, r['email'], r['username']) for r in recipients])
+
+    logger.info(f"📰 Digest queued: {len(events)} event(s) to {len(recipients)} manager(s)")
+    return {'events': len(events), 'recipients': len(recipients)}
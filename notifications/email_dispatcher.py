@@ -0,0 +1,155 @@
+"""
+Email Dispatcher - Pooled, concurrent delivery to the SendGrid API
+One keep-alive requests.Session per process and a bounded thread pool,
+with retry + backoff on rate limits (429) and server errors (5xx).
+"""
+import os
+import time
+import random
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+SENDGRID_API = "https://api.sendgrid.com/v3/mail/send"
+
+# Dispatch settings (keep EMAIL_MAX_IN_FLIGHT within the SendGrid plan's rate limit)
+EMAIL_MAX_IN_FLIGHT = int(os.getenv('EMAIL_MAX_IN_FLIGHT', 4))
+EMAIL_MAX_RETRIES = int(os.getenv('EMAIL_MAX_RETRIES', 3))
+EMAIL_BACKOFF_SECONDS = float(os.getenv('EMAIL_BACKOFF_SECONDS', 1.0))
+EMAIL_TIMEOUT = float(os.getenv('EMAIL_TIMEOUT', 10))
+
+# Longest we wait before a single retry, whatever Retry-After says
+MAX_BACKOFF_SECONDS = 30
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class EmailDispatcher:
+    """
+    Sends SendGrid payloads over a shared connection pool.
+    send() delivers one payload; send_many() runs up to max_in_flight at once.
+    """
+
+    def __init__(self, max_in_flight=EMAIL_MAX_IN_FLIGHT, max_retries=EMAIL_MAX_RETRIES,
+                 backoff=EMAIL_BACKOFF_SECONDS, timeout=EMAIL_TIMEOUT):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        # Messages that rode along in another message's request
+        self.calls_saved = 0
+
+    def _get_session(self):
+        # A session (and its sockets) must not be shared across a fork
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_in_flight)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+                    self._pid = os.getpid()
+        return self._session
+
+    def _retry_delay(self, attempt, response=None):
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after:
+                try:
+                    return min(float(retry_after), MAX_BACKOFF_SECONDS)
+                except ValueError:
+                    pass
+        # Exponential backoff with jitter so parallel workers don't retry in step
+        delay = self.backoff * (2 ** attempt)
+        return min(delay + random.uniform(0, delay / 2), MAX_BACKOFF_SECONDS)
+
+    def send(self, payload, api_key, url=SENDGRID_API):
+        """
+        POST one payload, retrying on 429/5xx and connection errors.
+
+        Returns:
+            (success: bool, error: str or None)
+        """
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+        error = None
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                response = self._get_session().post(url, json=payload, headers=headers, timeout=self.timeout)
+                if response.status_code in (200, 202):
+                    self.sent += 1
+                    return True, None
+                error = response.text or f"HTTP {response.status_code}"
+                if response.status_code not in RETRY_STATUS:
+                    break
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = str(e)
+
+            if attempt < self.max_retries:
+                self.retries += 1
+                time.sleep(self._retry_delay(attempt, response))
+
+        self.failed += 1
+        return False, error
+
+    @property
+    def max_send_seconds(self):
+        """Upper bound for send() of one payload: every attempt times out, longest backoffs."""
+        return (self.max_retries + 1) * self.timeout + self.max_retries * MAX_BACKOFF_SECONDS
+
+    def send_many(self, payloads, api_key, url=SENDGRID_API):
+        """
+        Send payloads concurrently (at most max_in_flight at a time).
+
+        Returns:
+            list of (success, error), in the same order as payloads
+        """
+        if not payloads:
+            return []
+        if len(payloads) == 1:
+            return [self.send(payloads[0], api_key, url)]
+        workers = min(self.max_in_flight, len(payloads))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='email') as pool:
+            return list(pool.map(lambda p: self.send(p, api_key, url), payloads))
+
+    def pool_stats(self):
+        """Connections opened so far and idle right now in this process's HTTP pool."""
+        opened = idle = 0
+        session = self._session
+        if session is not None and self._pid == os.getpid():
+            pools = session.get_adapter('https://').poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                opened += pool.num_connections
+                if pool.pool is not None:
+                    idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        return {'connections_opened': opened, 'idle_connections': idle, 'max_in_flight': self.max_in_flight}
+
+    def stats(self):
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'retries': self.retries,
+            'calls_saved': self.calls_saved,
+            'max_in_flight': self.max_in_flight,
+        }
+
+
+# Shared per-process dispatcher
+dispatcher = EmailDispatcher()
@@ -1,53 +1,137 @@
-import requests
 import logging
 from flask import current_app
 from datetime import datetime
+from notifications.email_dispatcher import dispatcher
+from notifications.email_transport import get_transport
 
 logger = logging.getLogger(__name__)
 
-SENDGRID_API = "https://api.sendgrid.com/v3/mail/send"
+# Placeholder for the greeting name; replaced per recipient by SendGrid
+RECIPIENT_TOKEN = '-recipient_name-'
 
 # ---------------------------------------------------------
 # 📧 Email Sending Core
 # ---------------------------------------------------------
-def _send_email(to_email, subject, html_content, text_content=None):
-    """Core function to send email via SendGrid"""
+def _email_config():
+    """Read SendGrid settings (must run in the request/app context)"""
+    api_key = current_app.config.get('SENDGRID_API_KEY')
+    sender = current_app.config.get('MAIL_SENDER', 'noreply@itrack.local')
+    return api_key, sender
+
+
+def _build_payload(messages, sender):
+    """
+    Turn message dicts ({'to', 'subject', 'html', 'text', 'substitutions'})
+    that share one body into a SendGrid payload with one personalization each
+    """
+    first = messages[0]
+    personalizations = []
+    for m in messages:
+        personalization = {"to": [{"email": m['to']}]}
+        if m.get('substitutions'):
+            personalization["substitutions"] = m['substitutions']
+        personalizations.append(personalization)
+    
+    payload = {
+        "personalizations": personalizations,
+        "from": {"email": sender, "name": "ITRACK System"},
+        "subject": first['subject'],
+        "content": [
+            {"type": "text/html", "value": first['html']}
+        ]
+    }
+    
+    if first.get('text'):
+        payload["content"].append({"type": "text/plain", "value": first['text']})
+    return payload
+
+
+def _group_messages(messages, max_batch):
+    """
+    Group message indexes by identical (subject, html, text), split at the
+    transport's batch limit (personalizations per request). Each group
+    becomes one API request.
+    """
+    groups = {}
+    for i, m in enumerate(messages):
+        groups.setdefault((m['subject'], m['html'], m.get('text') or ''), []).append(i)
+    batches = []
+    for indexes in groups.values():
+        for start in range(0, len(indexes), max_batch):
+            batches.append(indexes[start:start + max_batch])
+    return batches
+
+
+def split_rounds(messages, max_batch, per_round):
+    """
+    Split message indexes into rounds that each need at most per_round
+    requests (messages with identical content stay in the same round).
+    """
+    batches = _group_messages(messages, max_batch)
+    return [
+        [i for batch in batches[start:start + per_round] for i in batch]
+        for start in range(0, len(batches), per_round)
+    ]
+
+
+def personalize(message, to_email, recipient_name):
+    """
+    Copy of a message rendered with RECIPIENT_TOKEN, addressed to one recipient.
+    Copies of the same message are sent in a single API request.
+    """
+    return dict(message, to=to_email, substitutions={RECIPIENT_TOKEN: recipient_name})
+
+
+def send_messages(messages):
+    """
+    Send many messages through the configured transport (EMAIL_TRANSPORT).
+    Messages with identical content share one request (one personalization each).
+    
+    Returns:
+        list of (success, error) in the same order as messages
+    """
+    if not messages:
+        return []
     try:
-        api_key = current_app.config.get('SENDGRID_API_KEY')
-        sender = current_app.config.get('MAIL_SENDER', 'noreply@itrack.local')
-        
-        if not api_key:
-            logger.warning("⚠️ SENDGRID_API_KEY not configured, skipping email")
-            return False, "API key not configured"
-        
-        payload = {
-            "personalizations": [{"to": [{"email": to_email}]}],
-            "from": {"email": sender, "name": "ITRACK System"},
-            "subject": subject,
-            "content": [
-                {"type": "text/html", "value": html_content}
-            ]
-        }
-        
-        if text_content:
-            payload["content"].append({"type": "text/plain", "value": text_content})
-        
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        r = requests.post(SENDGRID_API, json=payload, headers=headers, timeout=10)
-        
-        if r.status_code in [200, 202]:
-            logger.info(f"✅ Email sent to {to_email}: {subject}")
-            return True, None
-        else:
-            logger.error(f"❌ SendGrid error: {r.text}")
-            return False, r.text
+        api_key, sender = _email_config()
     except Exception as e:
         logger.error(f"❌ Email error: {str(e)}")
-        return False, str(e)
+        return [(False, str(e))] * len(messages)
+    
+    transport = get_transport()
+    if transport.requires_api_key and not api_key:
+        logger.warning("⚠️ SENDGRID_API_KEY not configured, skipping email")
+        return [(False, "API key not configured")] * len(messages)
+    
+    batches = _group_messages(messages, transport.max_batch)
+    payloads = [_build_payload([messages[i] for i in batch], sender) for batch in batches]
+    batch_results = transport.send(payloads, api_key)
+    
+    results = [None] * len(messages)
+    for batch, result in zip(batches, batch_results):
+        for i in batch:
+            results[i] = result
+    
+    saved = len(messages) - len(payloads)
+    if saved:
+        dispatcher.calls_saved += saved
+        logger.info(f"📦 {len(messages)} email(s) sent in {len(payloads)} API call(s), saved {saved}")
+    for message, (success, error) in zip(messages, results):
+        if success:
+            logger.info(f"✅ Email sent to {message['to']}: {message['subject']}")
+        else:
+            logger.error(f"❌ Email error via {transport.name} ({message['to']}): {error}")
+    return results
+
+
+def send_message(message):
+    """Send one message dict; returns (success, error)"""
+    return send_messages([message])[0]
+
+
+def _send_email(to_email, subject, html_content, text_content=None):
+    """Core function to send email via SendGrid"""
+    return send_message({'to': to_email, 'subject': subject, 'html': html_content, 'text': text_content})
 
 
 # ---------------------------------------------------------
@@ -107,8 +191,8 @@ def _get_email_template(title, content_html, accent_color="#3b82f6"):
 # ---------------------------------------------------------
 # 🆕 Assignment Notification
 # ---------------------------------------------------------
-def send_assignment_email(to_email, researcher_name, project_name, project_id):
-    """Notify researcher when assigned to a project"""
+def build_assignment_email(to_email, researcher_name, project_name, project_id):
+    """Build the assignment message for a researcher"""
     subject = f"🆕 คุณได้รับมอบหมายโครงการใหม่: {project_name[:50]}"
     
     content_html = f'''
@@ -125,14 +209,19 @@ def send_assignment_email(to_email, researcher_name, project_name, project_id):
     '''
     
     html = _get_email_template("📬 มอบหมายโครงการใหม่", content_html, "#0ea5e9")
-    return _send_email(to_email, subject, html)
+    return {'to': to_email, 'subject': subject, 'html': html}
+
+
+def send_assignment_email(to_email, researcher_name, project_name, project_id):
+    """Notify researcher when assigned to a project"""
+    return send_message(build_assignment_email(to_email, researcher_name, project_name, project_id))
 
 
 # ---------------------------------------------------------
 # ⏰ Deadline Reminder
 # ---------------------------------------------------------
-def send_deadline_reminder(to_email, recipient_name, project_name, days_left, researcher_email=None):
-    """Send deadline reminder based on days left"""
+def build_deadline_reminder(to_email, recipient_name, project_name, days_left):
+    """Build the deadline reminder message based on days left"""
     
     # Determine urgency and color
     if days_left == 30:
@@ -178,14 +267,19 @@ def send_deadline_reminder(to_email, recipient_name, project_name, days_left, re
     '''
     
     html = _get_email_template(f"{emoji} {urgency}", content_html, accent_color)
-    return _send_email(to_email, subject, html)
+    return {'to': to_email, 'subject': subject, 'html': html}
+
+
+def send_deadline_reminder(to_email, recipient_name, project_name, days_left, researcher_email=None):
+    """Send deadline reminder based on days left"""
+    return send_message(build_deadline_reminder(to_email, recipient_name, project_name, days_left))
 
 
 # ---------------------------------------------------------
 # ❌ Overdue Alert
 # ---------------------------------------------------------
-def send_overdue_alert(to_email, recipient_name, project_name, days_overdue, is_admin=False):
-    """Send overdue alert (weekly)"""
+def build_overdue_alert(to_email, recipient_name, project_name, days_overdue, is_admin=False):
+    """Build the (weekly) overdue alert message"""
     subject = f"❌ โครงการเลยกำหนดส่ง {days_overdue} วัน: {project_name[:40]}"
     
     admin_note = ""
@@ -215,24 +309,31 @@ def send_overdue_alert(to_email, recipient_name, project_name, days_overdue, is_
     '''
     
     html = _get_email_template("❌ โครงการเลยกำหนดส่ง", content_html, "#dc2626")
-    return _send_email(to_email, subject, html)
+    return {'to': to_email, 'subject': subject, 'html': html}
+
+
+def send_overdue_alert(to_email, recipient_name, project_name, days_overdue, is_admin=False):
+    """Send overdue alert (weekly)"""
+    return send_message(build_overdue_alert(to_email, recipient_name, project_name, days_overdue, is_admin))
 
 
 # ---------------------------------------------------------
 # 📊 Progress Update Notification (for Admin)
 # ---------------------------------------------------------
-def send_progress_update_email(to_email, project_name, researcher_name, progress_percent, status):
-    """Notify admin when researcher updates progress"""
+PROGRESS_STATUS = {
+    'not_started': ('ยังไม่เริ่ม', '#94a3b8'),
+    'in_progress': ('กำลังดำเนินการ', '#3b82f6'),
+    'completed': ('เสร็จสมบูรณ์', '#10b981'),
+    'on_hold': ('หยุดชั่วคราว', '#f59e0b'),
+    'delayed': ('ล่าช้า', '#ef4444')
+}
+
+
+def build_progress_update_email(to_email, project_name, researcher_name, progress_percent, status):
+    """Build the progress update message for admin"""
     subject = f"📊 อัปเดตความคืบหน้า: {project_name[:40]} ({progress_percent}%)"
     
-    status_map = {
-        'not_started': ('ยังไม่เริ่ม', '#94a3b8'),
-        'in_progress': ('กำลังดำเนินการ', '#3b82f6'),
-        'completed': ('เสร็จสมบูรณ์', '#10b981'),
-        'on_hold': ('หยุดชั่วคราว', '#f59e0b'),
-        'delayed': ('ล่าช้า', '#ef4444')
-    }
-    status_text, status_color = status_map.get(status, ('ไม่ระบุ', '#64748b'))
+    status_text, status_color = PROGRESS_STATUS.get(status, ('ไม่ระบุ', '#64748b'))
     
     content_html = f'''
     <p style="color:#475569;line-height:1.6;">มีการอัปเดตความคืบหน้าโครงการ:</p>
@@ -246,12 +347,62 @@ def send_progress_update_email(to_email, project_name, researcher_name, progress
     '''
     
     html = _get_email_template("📊 อัปเดตความคืบหน้าโครงการ", content_html, "#10b981")
-    return _send_email(to_email, subject, html)
+    return {'to': to_email, 'subject': subject, 'html': html}
+
+
+def send_progress_update_email(to_email, project_name, researcher_name, progress_percent, status):
+    """Notify admin when researcher updates progress"""
+    return send_message(build_progress_update_email(to_email, project_name, researcher_name, progress_percent, status))
+
+
+# ---------------------------------------------------------
+# 📰 Manager Digest
+# ---------------------------------------------------------
+def build_digest_email(to_email, recipient_name, events, period_start, period_end):
+    """Build the manager digest message (one table of all events in the window)"""
+    sections = [
+        ('overdue', '❌ โครงการเลยกำหนดส่ง', '#dc2626'),
+        ('deadline', '⏰ ใกล้ถึงกำหนดส่ง', '#f97316'),
+        ('progress', '📊 อัปเดตความคืบหน้า', '#10b981'),
+    ]
+    subject = f"📰 สรุปการแจ้งเตือนโครงการ ({len(events)} รายการ) {period_end}"
+    
+    tables_html = ""
+    for kind, heading, color in sections:
+        rows = [e for e in events if e['kind'] == kind]
+        if not rows:
+            continue
+        rows_html = "".join(f'''
+            <tr>
+                <td style="padding:8px;border-bottom:1px solid #e2e8f0;color:#1e293b;">{e['project_name']}</td>
+                <td style="padding:8px;border-bottom:1px solid #e2e8f0;color:#475569;">{e['detail']}</td>
+            </tr>''' for e in rows)
+        tables_html += f'''
+    <h3 style="color:{color};font-size:16px;margin:20px 0 8px;">{heading} ({len(rows)})</h3>
+    <table width="100%" cellpadding="0" cellspacing="0" style="border-collapse:collapse;font-size:14px;">
+        {rows_html}
+    </table>
+    '''
+    
+    content_html = f'''
+    <p style="color:#475569;line-height:1.6;">เรียน <strong>{recipient_name}</strong>,</p>
+    <p style="color:#475569;line-height:1.6;">สรุปเหตุการณ์ของโครงการวิจัยระหว่างวันที่ {period_start} ถึง {period_end}:</p>
+    {tables_html}
+    <p style="color:#475569;line-height:1.6;margin-top:20px;">ขอแสดงความนับถือ,<br><strong>ITRACK System</strong></p>
+    '''
+    
+    html = _get_email_template("📰 สรุปการแจ้งเตือนโครงการ", content_html, "#6366f1")
+    return {'to': to_email, 'subject': subject, 'html': html}
 
 
 # ---------------------------------------------------------
 # 🔄 Legacy Function (backward compatibility)
 # ---------------------------------------------------------
+def build_alert_email(to_email, project_name, days_left):
+    """Build the manual project alert message"""
+    return build_deadline_reminder(to_email, "ผู้รับผิดชอบโครงการ", project_name, days_left)
+
+
 def send_alert_email(to_email, project_name, days_left):
     """Legacy function for backward compatibility"""
-    return send_deadline_reminder(to_email, "ผู้รับผิดชอบโครงการ", project_name, days_left)
+    return send_message(build_alert_email(to_email, project_name, days_left))
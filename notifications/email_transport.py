@@ -0,0 +1,356 @@
+"""
+Email Transports - Where send_messages() delivers SendGrid payloads
+Selected with EMAIL_TRANSPORT:
+    sendgrid - the SendGrid v3 API (default)
+    standin  - the same client against a local stand-in server
+               (python -m notifications.sendgrid_standin)
+    smtp     - an SMTP relay over a small pool of persistent connections
+               (locally: python -m aiosmtpd -n -l 127.0.0.1:8026)
+    memory   - keep payloads in memory, nothing leaves the process
+"""
+import os
+import ssl
+import time
+import atexit
+import smtplib
+import logging
+import threading
+from email.message import EmailMessage
+from concurrent.futures import ThreadPoolExecutor
+from notifications.email_dispatcher import dispatcher, SENDGRID_API
+from services.timing import timed
+
+logger = logging.getLogger(__name__)
+
+EMAIL_TRANSPORT = os.getenv('EMAIL_TRANSPORT', 'sendgrid').lower()
+EMAIL_STANDIN_URL = os.getenv('EMAIL_STANDIN_URL', 'http://127.0.0.1:8025/v3/mail/send')
+
+# SMTP relay settings
+SMTP_HOST = os.getenv('SMTP_HOST', 'localhost')
+SMTP_PORT = int(os.getenv('SMTP_PORT', 587))
+SMTP_USERNAME = os.getenv('SMTP_USERNAME')
+SMTP_PASSWORD = os.getenv('SMTP_PASSWORD')
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', 'true').lower() == 'true'
+SMTP_SSL = os.getenv('SMTP_SSL', 'false').lower() == 'true'
+SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', 2))
+SMTP_TIMEOUT = float(os.getenv('SMTP_TIMEOUT', 10))
+# Reconnect after this many messages / seconds idle (before the relay drops us)
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv('SMTP_MAX_MESSAGES_PER_CONNECTION', 100))
+SMTP_IDLE_SECONDS = float(os.getenv('SMTP_IDLE_SECONDS', 60))
+SMTP_MAX_RETRIES = int(os.getenv('SMTP_MAX_RETRIES', 2))
+
+
+class SendGridTransport:
+    """POST payloads to a SendGrid-compatible endpoint via the pooled dispatcher."""
+
+    name = 'sendgrid'
+    requires_api_key = True
+    # SendGrid accepts up to 1000 personalizations per request
+    max_batch = 1000
+
+    def __init__(self, url=SENDGRID_API):
+        self.url = url
+
+    @property
+    def concurrency(self):
+        """Payloads sent in parallel by one send() call."""
+        return dispatcher.max_in_flight
+
+    @property
+    def max_send_seconds(self):
+        """Upper bound for one payload (a send() of up to concurrency payloads)."""
+        return dispatcher.max_send_seconds
+
+    def send(self, payloads, api_key):
+        """Returns list of (success, error) in the same order as payloads"""
+        with timed('http'):
+            return dispatcher.send_many(payloads, api_key, self.url)
+
+    def stats(self):
+        return dict(dispatcher.stats(), transport=self.name, url=self.url)
+
+
+class StandInTransport(SendGridTransport):
+    """SendGrid client pointed at the local stand-in (no real API key needed)."""
+
+    name = 'standin'
+    requires_api_key = False
+
+    def __init__(self, url=EMAIL_STANDIN_URL):
+        super().__init__(url)
+
+    def send(self, payloads, api_key):
+        return super().send(payloads, api_key or 'standin')
+
+
+class _PooledConnection:
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+
+class SMTPTransport:
+    """
+    Sends through an SMTP relay, reusing up to pool_size authenticated
+    connections across messages and calls. Each personalization becomes one
+    message, so results are per recipient (max_batch = 1).
+    """
+
+    name = 'smtp'
+    requires_api_key = False
+    max_batch = 1
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, username=SMTP_USERNAME, password=SMTP_PASSWORD,
+                 starttls=SMTP_STARTTLS, use_ssl=SMTP_SSL, pool_size=SMTP_POOL_SIZE, timeout=SMTP_TIMEOUT,
+                 max_messages=SMTP_MAX_MESSAGES_PER_CONNECTION, idle_seconds=SMTP_IDLE_SECONDS,
+                 max_retries=SMTP_MAX_RETRIES):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.use_ssl = use_ssl
+        self.pool_size = max(1, pool_size)
+        self.timeout = timeout
+        self.max_messages = max_messages
+        self.idle_seconds = idle_seconds
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self._idle = []
+        self._pid = os.getpid()
+        self._atexit_registered = False
+        self.sent = 0
+        self.failed = 0
+        self.connects = 0
+        self.reconnects = 0
+
+    @property
+    def concurrency(self):
+        return self.pool_size
+
+    @property
+    def max_send_seconds(self):
+        # Each attempt may reconnect: connect, EHLO/STARTTLS, login and DATA can each hit the timeout
+        return (self.max_retries + 1) * 4 * self.timeout
+
+    # ----- pool -----
+    def _connect(self):
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout,
+                                    context=ssl.create_default_context())
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            smtp.ehlo()
+            if self.starttls:
+                # Fails if the relay doesn't offer STARTTLS - never fall back to plain text
+                smtp.starttls(context=ssl.create_default_context())
+                smtp.ehlo()
+        if self.username:
+            smtp.login(self.username, self.password or '')
+        with self._lock:
+            self.connects += 1
+            if not self._atexit_registered:
+                atexit.register(self.close)
+                self._atexit_registered = True
+        return _PooledConnection(smtp)
+
+    def _acquire(self):
+        """Take an idle connection (or open one); blocks while pool_size are in use."""
+        self._slots.acquire()
+        try:
+            with self._lock:
+                if self._pid != os.getpid():
+                    # Sockets inherited from the parent process are not ours to use
+                    self._idle = []
+                    self._pid = os.getpid()
+                while self._idle:
+                    conn = self._idle.pop()
+                    if time.monotonic() - conn.last_used < self.idle_seconds:
+                        return conn
+                    self._quit(conn)
+            return self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, conn, broken=False):
+        try:
+            if broken or conn.sent >= self.max_messages:
+                self._quit(conn)
+            else:
+                conn.last_used = time.monotonic()
+                with self._lock:
+                    self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def _quit(conn):
+        try:
+            conn.smtp.quit()
+        except Exception:
+            try:
+                conn.smtp.close()
+            except Exception:
+                pass
+
+    def close(self):
+        """Close idle connections (connections in use are closed when released)."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._quit(conn)
+
+    # ----- messages -----
+    @staticmethod
+    def _render(payload, personalization):
+        subject = payload['subject']
+        content = {c['type']: c['value'] for c in payload['content']}
+        html, text = content.get('text/html'), content.get('text/plain')
+        for token, value in (personalization.get('substitutions') or {}).items():
+            subject = subject.replace(token, value)
+            html = html.replace(token, value) if html else html
+            text = text.replace(token, value) if text else text
+
+        message = EmailMessage()
+        sender = payload['from']
+        message['From'] = f"{sender['name']} <{sender['email']}>" if sender.get('name') else sender['email']
+        message['To'] = ', '.join(to['email'] for to in personalization['to'])
+        message['Subject'] = subject
+        message.set_content(text or 'This message requires an HTML-capable mail client.')
+        if html:
+            message.add_alternative(html, subtype='html')
+        return message
+
+    def _send_one(self, message):
+        """Send one message, reconnecting on dropped connections; returns (success, error)"""
+        error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                conn = self._acquire()
+            except (smtplib.SMTPException, OSError) as e:
+                error = f"connect: {e}"
+                continue
+            try:
+                conn.smtp.send_message(message)
+                conn.sent += 1
+                self._release(conn)
+                return True, None
+            except smtplib.SMTPServerDisconnected as e:
+                # Stale or dropped connection - the idle ones are likely stale too
+                # (relay restart), so drop them all and retry on a fresh one
+                self._release(conn, broken=True)
+                self.close()
+                with self._lock:
+                    self.reconnects += 1
+                error = str(e)
+            except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused) as e:
+                # Rejected by the relay (4xx: the outbox retries later, 5xx: permanent);
+                # smtplib has already reset the session, so the connection stays usable
+                self._release(conn)
+                if isinstance(e, smtplib.SMTPResponseException):
+                    return False, f"SMTP {e.smtp_code}: {e.smtp_error}"
+                return False, f"Recipients refused: {e.recipients}"
+            except (smtplib.SMTPException, OSError) as e:
+                # SMTPException subclasses OSError; anything else here is a socket problem
+                self._release(conn, broken=True)
+                with self._lock:
+                    self.reconnects += 1
+                error = str(e)
+        return False, error
+
+    def _send_payload(self, payload):
+        results = [self._send_one(self._render(payload, p)) for p in payload['personalizations']]
+        failed = [error for success, error in results if not success]
+        with self._lock:
+            self.sent += len(results) - len(failed)
+            self.failed += len(failed)
+        return (False, failed[0]) if failed else (True, None)
+
+    def send(self, payloads, api_key):
+        """Returns list of (success, error) in the same order as payloads"""
+        if not payloads:
+            return []
+        with timed('http'):
+            if len(payloads) == 1:
+                return [self._send_payload(payloads[0])]
+            workers = min(self.pool_size, len(payloads))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='smtp') as pool:
+                return list(pool.map(self._send_payload, payloads))
+
+    def stats(self):
+        return {
+            'transport': self.name,
+            'host': f"{self.host}:{self.port}",
+            'sent': self.sent,
+            'failed': self.failed,
+            'connects': self.connects,
+            'reconnects': self.reconnects,
+            'idle_connections': len(self._idle),
+            'pool_size': self.pool_size,
+        }
+
+
+class MemoryTransport:
+    """Records payloads instead of sending them."""
+
+    name = 'memory'
+    requires_api_key = False
+    max_batch = 1000
+    concurrency = 1000
+    max_send_seconds = 0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.payloads = []
+
+    def send(self, payloads, api_key):
+        with self._lock:
+            self.payloads.extend(payloads)
+        return [(True, None)] * len(payloads)
+
+    @property
+    def messages(self):
+        """One entry per recipient: (to, subject)"""
+        return [
+            (to['email'], p['subject'])
+            for p in self.payloads for pers in p['personalizations'] for to in pers['to']
+        ]
+
+    def clear(self):
+        with self._lock:
+            self.payloads = []
+
+    def stats(self):
+        return {'transport': self.name, 'calls': len(self.payloads), 'messages': len(self.messages)}
+
+
+TRANSPORTS = {
+    'sendgrid': SendGridTransport,
+    'standin': StandInTransport,
+    'smtp': SMTPTransport,
+    'memory': MemoryTransport,
+}
+
+_transport = None
+
+
+def get_transport():
+    """The process-wide transport (built from EMAIL_TRANSPORT on first use)."""
+    global _transport
+    if _transport is None:
+        factory = TRANSPORTS.get(EMAIL_TRANSPORT)
+        if factory is None:
+            logger.error(f"❌ Unknown EMAIL_TRANSPORT '{EMAIL_TRANSPORT}', using sendgrid")
+            factory = SendGridTransport
+        _transport = factory()
+    return _transport
+
+
+def set_transport(transport):
+    """Swap the transport (benchmarks, local runs). Returns the previous one."""
+    global _transport
+    previous, _transport = _transport, transport
+    return previous
@@ -0,0 +1,87 @@
+"""
+Notification Events - In-process pub/sub for pushing notifications to browsers
+Feeds the Server-Sent Events stream in notifications/routes.py
+
+Sizing: under gthread every open stream holds one request thread for up to
+SSE_MAX_STREAM_SECONDS, so each process accepts at most SSE_MAX_STREAMS
+streams and answers the rest with 204 (the browser falls back to ETag
+polling). Keep SSE_MAX_STREAMS well below --threads so page requests always
+find a free thread; the Procfile runs WEB_CONCURRENCY (default 2) workers x
+16 threads = 8 streams + 24 page threads with the default of 4 per worker.
+"""
+import os
+import json
+import queue
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Push channel settings
+PUSH_ENABLED = os.getenv('NOTIFICATION_PUSH_ENABLED', 'true').lower() == 'true'
+HEARTBEAT_SECONDS = int(os.getenv('SSE_HEARTBEAT_SECONDS', 15))
+MAX_STREAM_SECONDS = int(os.getenv('SSE_MAX_STREAM_SECONDS', 300))
+RECONNECT_MS = int(os.getenv('SSE_RECONNECT_MS', 3000))
+# Open streams allowed per worker process (each one occupies a request thread)
+MAX_STREAMS = int(os.getenv('SSE_MAX_STREAMS', 4))
+
+# Events buffered per open stream before new ones are dropped
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class NotificationBroker:
+    """
+    Tracks open streams per user and fans events out to them.
+    Each open browser tab holds one subscriber queue.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id, limit=None):
+        """
+        Register a stream for user_id. Returns its queue, or None if this
+        process already holds `limit` open streams.
+        """
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            if limit is not None and sum(len(s) for s in self._subscribers.values()) >= limit:
+                return None
+            self._subscribers.setdefault(user_id, set()).add(q)
+        return q
+
+    def unsubscribe(self, user_id, q):
+        with self._lock:
+            subs = self._subscribers.get(user_id)
+            if subs:
+                subs.discard(q)
+                if not subs:
+                    del self._subscribers[user_id]
+
+    def has_subscribers(self, user_id):
+        return user_id in self._subscribers
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
+
+    def publish(self, user_id, event, data):
+        """Deliver an event to every open stream of user_id (non-blocking)."""
+        with self._lock:
+            subs = list(self._subscribers.get(user_id, ()))
+        for q in subs:
+            try:
+                q.put_nowait((event, data))
+            except queue.Full:
+                # Slow/stalled tab - it resyncs from the next count event
+                logger.debug(f"SSE queue full for user {user_id}, dropping {event}")
+
+
+# Shared per-process broker
+broker = NotificationBroker()
+
+
+def format_sse(event, data):
+    """Serialize one Server-Sent Event frame."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
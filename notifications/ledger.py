@@ -0,0 +1,68 @@
+"""
+Notification Ledger - Remembers which deadline notifications were already sent
+One row per (project_id, recipient, kind, due_date). A notification is only
+queued if its row can be inserted, so re-running the daily job (retries,
+overlapping cron triggers) never sends the same notification twice.
+"""
+import os
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# How long ledger rows are kept (the job only ever looks at today's)
+LEDGER_RETENTION_DAYS = int(os.getenv('NOTIFICATION_LEDGER_RETENTION_DAYS', 90))
+
+# Recipient key for events collected into the manager digest
+DIGEST_RECIPIENT = 'digest'
+
+# Rows per multi-row claim INSERT (5 bind params each, well under SQLite's 999 limit)
+CLAIM_CHUNK = 100
+
+# Appended to a notification_schedule query aliased "s": keeps only
+# scheduled rows the job has not handled yet for that date
+UNSENT_CONDITION = """
+    NOT EXISTS (
+        SELECT 1 FROM notification_ledger l
+        WHERE l.project_id = s.project_id AND l.kind = s.kind AND l.due_date = s.due_on
+    )
+"""
+
+
+def claim_notifications(conn, claims, due_date):
+    """
+    Record a run's notifications as being sent (inside the sending transaction),
+    one multi-row INSERT per CLAIM_CHUNK claims.
+
+    Args:
+        claims: iterable of (project_id, recipient, kind)
+
+    Returns:
+        set: the (project_id, recipient, kind) keys this call inserted. Anything
+        missing was already claimed by another run - the caller must skip it.
+    """
+    keys = list(dict.fromkeys(claims))
+    now = datetime.now().isoformat()
+    claimed = set()
+    for start in range(0, len(keys), CLAIM_CHUNK):
+        chunk = keys[start:start + CLAIM_CHUNK]
+        values = ", ".join(["(?, ?, ?, ?, ?)"] * len(chunk))
+        params = []
+        for project_id, recipient, kind in chunk:
+            params.extend([project_id, recipient, kind, due_date, now])
+        cursor = conn.execute(f"""
+            INSERT INTO notification_ledger (project_id, recipient, kind, due_date, created_at)
+            VALUES {values}
+            ON CONFLICT (project_id, recipient, kind, due_date) DO NOTHING
+            RETURNING project_id, recipient, kind
+        """, params)
+        claimed.update((r['project_id'], r['recipient'], r['kind']) for r in cursor.fetchall())
+    return claimed
+
+
+def prune_ledger(conn, today, keep_days=None):
+    """Delete ledger rows older than the retention window."""
+    keep_days = LEDGER_RETENTION_DAYS if keep_days is None else keep_days
+    cutoff = (today - timedelta(days=keep_days)).isoformat()
+    with conn.transaction():
+        conn.execute("DELETE FROM notification_ledger WHERE due_date < ?", (cutoff,))
@@ -2,12 +2,74 @@
 Notification Service - In-app notifications management
 """
 import logging
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, timedelta
 from models import get_db
 from database import IS_POSTGRES
+from notifications.events import broker
+from services.invalidation_bus import bus, NOTIFICATION, UNREAD_COUNT
 
 logger = logging.getLogger(__name__)
 
+# Rows per multi-row INSERT (6 bind params each, well under SQLite's 999 limit)
+BULK_INSERT_CHUNK = 100
+
+
+# Advance a user's version stamp (ETag) and adjust the unread counter in one upsert
+_STATE_UPSERT_SQL = """
+    INSERT INTO notification_state (user_id, version, unread_count) VALUES (?, 1, ?)
+    ON CONFLICT (user_id) DO UPDATE
+    SET version = notification_state.version + 1,
+        unread_count = notification_state.unread_count + excluded.unread_count
+"""
+
+
+def _bump_state(conn, user_id, unread_delta=0):
+    """
+    Advance the user's version stamp (used as the ETag) and adjust the
+    denormalized unread counter in the same single-row upsert.
+    """
+    conn.execute(_STATE_UPSERT_SQL, (user_id, unread_delta))
+
+
+def get_notification_version(user_id):
+    """
+    Cheap version stamp of a user's notifications - a single primary-key read.
+    Changes whenever a notification is created, read or deleted.
+    """
+    try:
+        row = get_db().execute(
+            "SELECT version FROM notification_state WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return row['version'] if row else 0
+    except Exception as e:
+        logger.error(f"❌ Failed to get notification version: {e}")
+        return None
+
+
+def _publish_unread_count(event):
+    """Push the fresh unread count to the user's open streams (if any)."""
+    user_id = event['user_id']
+    if broker.has_subscribers(user_id):
+        broker.publish(user_id, 'count', {'count': get_unread_count(user_id)})
+
+
+def _publish_new_notification(event):
+    """Push a newly committed notification to the user's open streams (if any)."""
+    user_id = event['user_id']
+    if broker.has_subscribers(user_id):
+        row = get_db().execute("""
+            SELECT id, title, message, type, link, is_read, created_at
+            FROM notifications WHERE id = ?
+        """, (event['id'],)).fetchone()
+        if row:
+            broker.publish(user_id, 'notification', dict(row))
+
+
+# Streams can be open on any worker/node; each one pushes to its own subscribers
+bus.subscribe(NOTIFICATION, _publish_new_notification)
+bus.subscribe(UNREAD_COUNT, _publish_unread_count)
+
 
 def create_notification(user_id, title, message=None, notif_type='info', link=None):
     """
@@ -27,19 +89,26 @@ def create_notification(user_id, title, message=None, notif_type='info', link=No
         conn = get_db()
         now = datetime.now().isoformat()
         
-        cursor = conn.execute("""
-            INSERT INTO notifications (user_id, title, message, type, link, is_read, created_at)
-            VALUES (?, ?, ?, ?, ?, 0, ?)
-        """, (user_id, title, message, notif_type, link, now))
-        
-        conn.commit()
-        
-        # Get the inserted ID
-        if IS_POSTGRES:
-            # PostgreSQL needs to return the ID differently
-            notif_id = cursor.fetchone()
-        else:
-            notif_id = cursor.lastrowid
+        # Joins the caller's transaction when one is active
+        with conn.transaction():
+            cursor = conn.execute("""
+                INSERT INTO notifications (user_id, title, message, type, link, is_read, created_at)
+                VALUES (?, ?, ?, ?, ?, 0, ?)
+            """ + (" RETURNING id" if IS_POSTGRES else ""),
+                (user_id, title, message, notif_type, link, now))
+            
+            # Get the inserted ID
+            if IS_POSTGRES:
+                # PostgreSQL returns the ID from the RETURNING clause
+                notif_id = cursor.fetchone()['id']
+            else:
+                notif_id = cursor.lastrowid
+            
+            _bump_state(conn, user_id, 1)
+            
+            # Push to open browser tabs only once the row is committed
+            bus.publish(conn, NOTIFICATION, user_id=user_id, id=notif_id)
+            bus.publish(conn, UNREAD_COUNT, user_id=user_id)
             
         logger.info(f"🔔 Created notification for user {user_id}: {title}")
         return notif_id
@@ -49,6 +118,58 @@ def create_notification(user_id, title, message=None, notif_type='info', link=No
         return None
 
 
+def create_notifications_bulk(rows):
+    """
+    สร้าง notifications หลายรายการในคำสั่ง INSERT เดียว (transaction เดียว)
+    
+    Args:
+        rows: iterable ของ tuple (user_id, title, message, notif_type, link)
+    
+    Returns:
+        list: notification IDs ที่สร้าง (เรียงตาม rows) หรือ [] ถ้าล้มเหลว
+    """
+    rows = list(rows)
+    if not rows:
+        return []
+    
+    try:
+        conn = get_db()
+        now = datetime.now().isoformat()
+        ids = []
+        
+        with conn.transaction():
+            for start in range(0, len(rows), BULK_INSERT_CHUNK):
+                chunk = rows[start:start + BULK_INSERT_CHUNK]
+                values = ", ".join(["(?, ?, ?, ?, ?, 0, ?)"] * len(chunk))
+                params = []
+                for user_id, title, message, notif_type, link in chunk:
+                    params.extend([user_id, title, message, notif_type or 'info', link, now])
+                
+                cursor = conn.execute(f"""
+                    INSERT INTO notifications (user_id, title, message, type, link, is_read, created_at)
+                    VALUES {values}
+                    RETURNING id
+                """, params)
+                # IDs are allocated in VALUES order
+                ids.extend(sorted(r['id'] for r in cursor.fetchall()))
+            
+            # One counter upsert per recipient instead of per notification
+            per_user = Counter(r[0] for r in rows)
+            conn.executemany(_STATE_UPSERT_SQL, list(per_user.items()))
+            
+            bus.publish_many(conn, NOTIFICATION, [
+                {'user_id': row[0], 'id': notif_id} for notif_id, row in zip(ids, rows)
+            ])
+            bus.publish_many(conn, UNREAD_COUNT, [{'user_id': user_id} for user_id in per_user])
+        
+        logger.info(f"🔔 Created {len(ids)} notification(s) for {len(per_user)} user(s)")
+        return ids
+        
+    except Exception as e:
+        logger.error(f"❌ Failed to create notifications in bulk: {e}")
+        return []
+
+
 def create_notification_for_role(role, title, message=None, notif_type='info', link=None):
     """
     สร้าง notification สำหรับผู้ใช้ทุกคนที่มี role ที่กำหนด
@@ -66,12 +187,10 @@ def create_notification_for_role(role, title, message=None, notif_type='info', l
             "SELECT id FROM users WHERE role = ?", (role,)
         ).fetchall()
         
-        count = 0
-        for user in users:
-            if create_notification(user['id'], title, message, notif_type, link):
-                count += 1
-        
-        return count
+        ids = create_notifications_bulk(
+            (user['id'], title, message, notif_type, link) for user in users
+        )
+        return len(ids)
         
     except Exception as e:
         logger.error(f"❌ Failed to create notifications for role {role}: {e}")
@@ -122,12 +241,13 @@ def get_unread_count(user_id):
     """
     try:
         conn = get_db()
+        # Denormalized counter - a single primary-key read instead of COUNT(*)
         result = conn.execute(
-            "SELECT COUNT(*) as count FROM notifications WHERE user_id = ? AND is_read = 0",
+            "SELECT unread_count FROM notification_state WHERE user_id = ?",
             (user_id,)
         ).fetchone()
         
-        return result['count'] if result else 0
+        return max(result['unread_count'], 0) if result else 0
         
     except Exception as e:
         logger.error(f"❌ Failed to get unread count: {e}")
@@ -148,18 +268,28 @@ def mark_as_read(notification_id, user_id=None):
     try:
         conn = get_db()
         
-        if user_id:
-            conn.execute(
-                "UPDATE notifications SET is_read = 1 WHERE id = ? AND user_id = ?",
-                (notification_id, user_id)
-            )
-        else:
-            conn.execute(
-                "UPDATE notifications SET is_read = 1 WHERE id = ?",
-                (notification_id,)
-            )
+        with conn.transaction():
+            if user_id:
+                cursor = conn.execute(
+                    "UPDATE notifications SET is_read = 1 WHERE id = ? AND user_id = ? AND is_read = 0",
+                    (notification_id, user_id)
+                )
+                if cursor.rowcount:
+                    _bump_state(conn, user_id, -1)
+            else:
+                cursor = conn.execute(
+                    "UPDATE notifications SET is_read = 1 WHERE id = ? AND is_read = 0",
+                    (notification_id,)
+                )
+                if cursor.rowcount:
+                    conn.execute("""
+                        UPDATE notification_state
+                        SET version = version + 1, unread_count = unread_count - 1
+                        WHERE user_id = (SELECT user_id FROM notifications WHERE id = ?)
+                    """, (notification_id,))
+            if user_id:
+                bus.publish(conn, UNREAD_COUNT, user_id=user_id)
         
-        conn.commit()
         return True
         
     except Exception as e:
@@ -179,11 +309,17 @@ def mark_all_read(user_id):
     """
     try:
         conn = get_db()
-        cursor = conn.execute(
-            "UPDATE notifications SET is_read = 1 WHERE user_id = ? AND is_read = 0",
-            (user_id,)
-        )
-        conn.commit()
+        with conn.transaction():
+            cursor = conn.execute(
+                "UPDATE notifications SET is_read = 1 WHERE user_id = ? AND is_read = 0",
+                (user_id,)
+            )
+            if cursor.rowcount:
+                conn.execute(
+                    "UPDATE notification_state SET version = version + 1, unread_count = 0 WHERE user_id = ?",
+                    (user_id,)
+                )
+            bus.publish(conn, UNREAD_COUNT, user_id=user_id)
         
         return cursor.rowcount if hasattr(cursor, 'rowcount') else 0
         
@@ -194,36 +330,33 @@ def mark_all_read(user_id):
 
 def delete_old_notifications(days=30):
     """
-    ลบ notifications เก่ากว่า X วัน
+    ลบ notifications ที่อ่านแล้วและเก่ากว่า X วัน (ที่ยังไม่อ่านเก็บไว้เสมอ)
     
     Args:
         days: จำนวนวันที่เก็บไว้
     
     Returns:
         int: จำนวนที่ลบ
+    
+    Raises:
+        Exception: ส่งต่อให้ผู้เรียก (job scheduler บันทึกเป็น failed)
     """
-    try:
-        conn = get_db()
-        
-        if IS_POSTGRES:
-            cursor = conn.execute("""
-                DELETE FROM notifications 
-                WHERE created_at < NOW() - INTERVAL '%s days'
-            """, (days,))
-        else:
-            cursor = conn.execute("""
-                DELETE FROM notifications 
-                WHERE created_at < datetime('now', ?)
-            """, (f'-{days} days',))
-        
-        conn.commit()
-        count = cursor.rowcount if hasattr(cursor, 'rowcount') else 0
-        
-        if count > 0:
-            logger.info(f"🗑️ Deleted {count} old notifications")
-        
-        return count
-        
-    except Exception as e:
-        logger.error(f"❌ Failed to delete old notifications: {e}")
-        return 0
+    conn = get_db()
+    # created_at is ISO text on both databases: compare against an ISO cutoff
+    cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+    
+    with conn.transaction():
+        cursor = conn.execute(
+            "DELETE FROM notifications WHERE is_read = 1 AND created_at < ?",
+            (cutoff,)
+        )
+        count = cursor.rowcount or 0
+        if count:
+            # Deleted rows may belong to anyone - invalidate every stamp
+            # (only read rows go, so unread counters are unchanged)
+            conn.execute("UPDATE notification_state SET version = version + 1")
+    
+    if count > 0:
+        logger.info(f"🗑️ Deleted {count} old notifications")
+    
+    return count
@@ -0,0 +1,305 @@
+"""
+Email Outbox - Durable queue of rendered emails
+Producers insert messages in their own transaction (one INSERT per request);
+a worker claims batches with a lease, sends them through the dispatcher and
+records the outcome. Failed messages are retried with backoff and end up
+in the 'dead' state after OUTBOX_MAX_ATTEMPTS.
+
+Status flow:
+    pending -> sending -> sent
+                       -> pending (retry at next_attempt_at)
+                       -> dead
+
+A claimed batch is sent in rounds of at most transport.concurrency requests.
+The lease covers one round at its worst case (every retry timing out) and is
+extended after each round, so it cannot expire while the worker is still
+sending - otherwise another worker would re-claim and resend the rows.
+"""
+import os
+import json
+import uuid
+import atexit
+import logging
+import threading
+from datetime import datetime, timedelta
+from models import get_db
+from database import IS_POSTGRES
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Outbox settings
+OUTBOX_WORKER_ENABLED = os.getenv('OUTBOX_WORKER_ENABLED', 'true').lower() == 'true'
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 50))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 5))
+# Minimum lease; raised to the transport's worst-case round time (see outbox_lease_seconds)
+OUTBOX_LEASE_SECONDS = int(os.getenv('OUTBOX_LEASE_SECONDS', 120))
+OUTBOX_POLL_SECONDS = float(os.getenv('OUTBOX_POLL_SECONDS', 30))
+OUTBOX_RETRY_SECONDS = int(os.getenv('OUTBOX_RETRY_SECONDS', 60))
+
+# Longest delay between two attempts of the same message
+MAX_RETRY_SECONDS = 3600
+# Slack on top of a round's worst-case send time (DB writes, scheduling)
+LEASE_MARGIN_SECONDS = 30
+
+INSERT_SQL = """
+    INSERT INTO email_outbox (to_email, subject, html, text, substitutions, status, attempts, next_attempt_at, created_at)
+    VALUES (?, ?, ?, ?, ?, 'pending', 0, ?, ?)
+"""
+
+
+# ---------------------------------------------------------
+# Producers
+# ---------------------------------------------------------
+def enqueue_emails(conn, messages):
+    """
+    Queue message dicts ({'to', 'subject', 'html', 'text', 'substitutions'}) for delivery.
+    Call inside the producer's transaction; the worker is woken after commit.
+
+    Returns:
+        int: number of messages queued
+    """
+    if not messages:
+        return 0
+    now = datetime.now().isoformat()
+    conn.executemany(INSERT_SQL, [
+        (m['to'], m['subject'], m['html'], m.get('text'),
+         json.dumps(m['substitutions'], ensure_ascii=False) if m.get('substitutions') else None,
+         now, now)
+        for m in messages
+    ])
+    conn.after_commit(outbox_worker.wake)
+    return len(messages)
+
+
+def enqueue_email(conn, message):
+    """Queue a single message dict."""
+    return enqueue_emails(conn, [message])
+
+
+# ---------------------------------------------------------
+# Worker side
+# ---------------------------------------------------------
+def claim_batch(conn, limit=OUTBOX_BATCH_SIZE, lease_seconds=OUTBOX_LEASE_SECONDS):
+    """
+    Lease up to limit due messages (pending and due, or sending with an
+    expired lease). Concurrent workers never receive the same row.
+
+    Returns:
+        (claim_token, rows)
+    """
+    now = datetime.now()
+    token = uuid.uuid4().hex
+    # PostgreSQL: skip rows another worker is claiming right now.
+    # SQLite: the single UPDATE statement is already atomic.
+    lock_clause = "FOR UPDATE SKIP LOCKED" if IS_POSTGRES else ""
+    with conn.transaction():
+        conn.execute(f"""
+            UPDATE email_outbox
+            SET status = 'sending', claim_token = ?, lease_until = ?, attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM email_outbox
+                WHERE (status = 'pending' AND next_attempt_at <= ?)
+                   OR (status = 'sending' AND lease_until < ?)
+                ORDER BY id
+                LIMIT ?
+                {lock_clause}
+            )
+        """, (token, (now + timedelta(seconds=lease_seconds)).isoformat(),
+              now.isoformat(), now.isoformat(), limit))
+    rows = conn.execute(
+        "SELECT * FROM email_outbox WHERE claim_token = ? AND status = 'sending' ORDER BY id",
+        (token,)
+    ).fetchall()
+    return token, rows
+
+
+def outbox_lease_seconds(transport):
+    """Lease long enough for one round of sends on this transport, all retries included."""
+    return max(OUTBOX_LEASE_SECONDS, int(transport.max_send_seconds) + LEASE_MARGIN_SECONDS)
+
+
+def extend_lease(conn, token, lease_seconds):
+    """
+    Push lease_until forward for the rows of a claim that are still being sent.
+
+    Returns:
+        int: rows extended (0 means the lease was lost to another worker)
+    """
+    lease_until = (datetime.now() + timedelta(seconds=lease_seconds)).isoformat()
+    with conn.transaction():
+        cursor = conn.execute(
+            "UPDATE email_outbox SET lease_until = ? WHERE claim_token = ? AND status = 'sending'",
+            (lease_until, token)
+        )
+    return cursor.rowcount or 0
+
+
+def _retry_delay(attempts):
+    return min(OUTBOX_RETRY_SECONDS * (2 ** (attempts - 1)), MAX_RETRY_SECONDS)
+
+
+def record_results(conn, token, rows, results):
+    """
+    Store delivery outcomes for a claimed batch.
+    Updates are guarded by the claim token, so a worker whose lease expired
+    cannot overwrite a newer claim.
+    """
+    now = datetime.now()
+    sent, retry, dead = [], [], []
+    for row, (success, error) in zip(rows, results):
+        if success:
+            sent.append((now.isoformat(), row['id'], token))
+        elif row['attempts'] >= OUTBOX_MAX_ATTEMPTS:
+            dead.append(((error or '')[:1000], row['id'], token))
+        else:
+            next_at = (now + timedelta(seconds=_retry_delay(row['attempts']))).isoformat()
+            retry.append((next_at, (error or '')[:1000], row['id'], token))
+
+    with conn.transaction():
+        if sent:
+            conn.executemany("""
+                UPDATE email_outbox SET status = 'sent', sent_at = ?, last_error = NULL
+                WHERE id = ? AND claim_token = ?
+            """, sent)
+        if retry:
+            conn.executemany("""
+                UPDATE email_outbox SET status = 'pending', next_attempt_at = ?, last_error = ?
+                WHERE id = ? AND claim_token = ?
+            """, retry)
+        if dead:
+            conn.executemany("""
+                UPDATE email_outbox SET status = 'dead', last_error = ?
+                WHERE id = ? AND claim_token = ?
+            """, dead)
+    if dead:
+        logger.error(f"☠️ {len(dead)} email(s) moved to dead letter after {OUTBOX_MAX_ATTEMPTS} attempts")
+    return {'sent': len(sent), 'retried': len(retry), 'dead': len(dead)}
+
+
+def drain_outbox(max_batches=None):
+    """
+    Send due outbox messages until none are left (or max_batches is reached).
+    Needs an app context (SendGrid settings come from app.config).
+
+    Identical messages in a batch (e.g. admin fan-out) share one API request.
+
+    Returns:
+        dict: {'sent', 'retried', 'dead', 'batches', 'calls_saved'}
+    """
+    from notifications.email_service import send_messages, split_rounds
+    from notifications.email_dispatcher import dispatcher
+    from notifications.email_transport import get_transport
+
+    conn = get_db()
+    transport = get_transport()
+    lease_seconds = outbox_lease_seconds(transport)
+    totals = {'sent': 0, 'retried': 0, 'dead': 0, 'batches': 0}
+    saved_before = dispatcher.calls_saved
+    while max_batches is None or totals['batches'] < max_batches:
+        token, rows = claim_batch(conn, lease_seconds=lease_seconds)
+        if not rows:
+            break
+        messages = [
+            {'to': r['to_email'], 'subject': r['subject'], 'html': r['html'], 'text': r['text'],
+             'substitutions': json.loads(r['substitutions']) if r['substitutions'] else None}
+            for r in rows
+        ]
+        rounds = split_rounds(messages, transport.max_batch, transport.concurrency)
+        for n, indexes in enumerate(rounds):
+            if n and not extend_lease(conn, token, lease_seconds):
+                # Taken over by another worker: it sends the remaining rows
+                logger.warning(f"⚠️ Outbox lease lost, {sum(map(len, rounds[n:]))} message(s) left to the new claim")
+                break
+            round_rows = [rows[i] for i in indexes]
+            results = send_messages([messages[i] for i in indexes])
+            outcome = record_results(conn, token, round_rows, results)
+            for key, value in outcome.items():
+                totals[key] += value
+                metrics.inc('itrack_email_messages_total', value, outcome=key, transport=transport.name)
+        totals['batches'] += 1
+    totals['calls_saved'] = dispatcher.calls_saved - saved_before
+    return totals
+
+
+def get_outbox_stats():
+    """Message counts per status."""
+    rows = get_db().execute(
+        "SELECT status, COUNT(*) as cnt FROM email_outbox GROUP BY status"
+    ).fetchall()
+    return {r['status']: r['cnt'] for r in rows}
+
+
+class OutboxWorker:
+    """
+    Background drain thread, started lazily in each process (first request or wake).
+    Wakes immediately after a producer commits, and polls every
+    OUTBOX_POLL_SECONDS to pick up retries and expired leases.
+    """
+
+    def __init__(self, poll_seconds=OUTBOX_POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self._app = None
+        self._event = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._atexit_registered = False
+        self.runs = 0
+        self.errors = 0
+
+    def init_app(self, app):
+        self._app = app
+        # Also start in processes that never enqueue, so retries get picked up
+        app.before_request(self.start)
+
+    def start(self):
+        if OUTBOX_WORKER_ENABLED and self._app is not None:
+            self._ensure_started()
+
+    def wake(self):
+        if not OUTBOX_WORKER_ENABLED or self._app is None:
+            return
+        self._ensure_started()
+        self._event.set()
+
+    def _ensure_started(self):
+        # Checked per process: a thread started before a fork does not survive it
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='email-outbox', daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.shutdown)
+                self._atexit_registered = True
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._event.wait(self.poll_seconds)
+            self._event.clear()
+            if self._stop.is_set():
+                break
+            try:
+                with self._app.app_context():
+                    drain_outbox()
+                self.runs += 1
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"❌ Outbox drain failed: {e}")
+
+    def shutdown(self, timeout=5.0):
+        # Unsent rows stay in the table; the next process picks them up
+        self._stop.set()
+        self._event.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+
+
+# Shared per-process worker
+outbox_worker = OutboxWorker()
@@ -1,14 +1,29 @@
 """
 Notification Routes - API endpoints for in-app notifications
 """
-from flask import Blueprint, jsonify, render_template, redirect, url_for
+import queue
+import time
+from flask import Blueprint, Response, jsonify, render_template, redirect, url_for, request, flash
 from flask_login import login_required, current_user
+from extensions import limiter
 from notifications.notification_service import (
     get_notifications, 
     get_unread_count, 
+    get_notification_version,
     mark_as_read, 
     mark_all_read
 )
+from services.http_cache import conditional_response
+from notifications.digest import get_email_mode, set_email_mode, EMAIL_MODES, DIGEST_WINDOW_HOURS
+from notifications.events import (
+    broker,
+    format_sse,
+    PUSH_ENABLED,
+    HEARTBEAT_SECONDS,
+    MAX_STREAM_SECONDS,
+    MAX_STREAMS,
+    RECONNECT_MS
+)
 
 notifications_bp = Blueprint('notifications', __name__, url_prefix='/notifications')
 
@@ -20,35 +35,122 @@ def index():
     notifications = get_notifications(current_user.id, limit=50)
     unread_count = get_unread_count(current_user.id)
     
+    # Email delivery preference (admin/manager only)
+    email_mode = None
+    if current_user.role in ('admin', 'manager'):
+        email_mode = get_email_mode(current_user.id)
+    
     return render_template('notifications/index.html',
                           notifications=notifications,
-                          unread_count=unread_count)
+                          unread_count=unread_count,
+                          email_mode=email_mode,
+                          digest_window_hours=DIGEST_WINDOW_HOURS)
+
+
+@notifications_bp.route('/preferences', methods=['POST'])
+@login_required
+def preferences():
+    """บันทึกรูปแบบการรับอีเมล (ทันที / สรุปรายรอบ)"""
+    if current_user.role not in ('admin', 'manager'):
+        flash('คุณไม่มีสิทธิ์ในการดำเนินการนี้', 'danger')
+        return redirect(url_for('notifications.index'))
+    
+    mode = request.form.get('email_mode', '')
+    if mode not in EMAIL_MODES:
+        flash('รูปแบบการรับอีเมลไม่ถูกต้อง', 'warning')
+        return redirect(url_for('notifications.index'))
+    
+    set_email_mode(current_user.id, mode)
+    flash('✅ บันทึกการตั้งค่าอีเมลแล้ว', 'success')
+    return redirect(url_for('notifications.index'))
 
 
 @notifications_bp.route('/api/list')
+@limiter.exempt
 @login_required
 def api_list():
-    """API: ดึงรายการ notifications"""
+    """API: ดึงรายการ notifications (รองรับ ETag / 304)"""
     limit = 10
-    notifications = get_notifications(current_user.id, limit=limit)
     
-    return jsonify({
-        'success': True,
-        'notifications': notifications,
-        'count': len(notifications)
-    })
+    def build():
+        notifications = get_notifications(current_user.id, limit=limit)
+        return jsonify({
+            'success': True,
+            'notifications': notifications,
+            'count': len(notifications)
+        })
+    
+    version = get_notification_version(current_user.id)
+    if version is None:
+        return build()
+    return conditional_response(f"nl-{current_user.id}-{version}", build)
 
 
 @notifications_bp.route('/api/count')
+@limiter.exempt
 @login_required
 def api_count():
-    """API: นับจำนวนที่ยังไม่อ่าน"""
-    count = get_unread_count(current_user.id)
+    """API: นับจำนวนที่ยังไม่อ่าน (รองรับ ETag / 304)"""
+    def build():
+        return jsonify({
+            'success': True,
+            'count': get_unread_count(current_user.id)
+        })
     
-    return jsonify({
-        'success': True,
-        'count': count
-    })
+    version = get_notification_version(current_user.id)
+    if version is None:
+        return build()
+    return conditional_response(f"nc-{current_user.id}-{version}", build)
+
+
+@notifications_bp.route('/stream')
+@limiter.exempt
+@login_required
+def stream():
+    """
+    SSE: push unread-count and new-notification events to the browser.
+    The stream ends after MAX_STREAM_SECONDS and EventSource reconnects,
+    so a worker thread is never held indefinitely. At most MAX_STREAMS
+    streams per process; past that the client polls instead.
+    """
+    if not PUSH_ENABLED:
+        # 204 makes EventSource give up, the client then falls back to polling
+        return Response(status=204)
+    
+    user_id = current_user.id
+    # Claimed before the response starts, so the cap holds under concurrent requests
+    subscription = broker.subscribe(user_id, limit=MAX_STREAMS)
+    if subscription is None:
+        return Response(status=204)
+    try:
+        initial_count = get_unread_count(user_id)
+    except BaseException:
+        broker.unsubscribe(user_id, subscription)
+        raise
+    
+    def generate():
+        try:
+            yield f"retry: {RECONNECT_MS}\n\n"
+            yield format_sse('count', {'count': initial_count})
+            
+            ends_at = time.monotonic() + MAX_STREAM_SECONDS
+            while time.monotonic() < ends_at:
+                try:
+                    event, data = subscription.get(timeout=HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    # Heartbeat keeps proxies from closing an idle connection
+                    yield ": heartbeat\n\n"
+                    continue
+                yield format_sse(event, data)
+        finally:
+            broker.unsubscribe(user_id, subscription)
+    
+    response = Response(generate(), mimetype='text/event-stream')
+    # Also frees the slot if the client goes away before the generator starts
+    response.call_on_close(lambda: broker.unsubscribe(user_id, subscription))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @notifications_bp.route('/api/<int:notif_id>/read', methods=['POST'])
@@ -2,59 +2,81 @@
 Notification Scheduler for ITRACK
 Handles deadline checks and sends notifications
 """
-import pandas as pd
 from datetime import datetime
 from flask import current_app
-from models import get_db
-from notifications.email_service import send_deadline_reminder, send_overdue_alert, send_assignment_email
-from notifications.notification_service import create_notification
+from models import get_db, parse_date_fast
+from notifications.email_service import (
+    build_deadline_reminder, build_overdue_alert, build_assignment_email,
+    build_progress_update_email, personalize, RECIPIENT_TOKEN, PROGRESS_STATUS
+)
+from notifications.outbox import enqueue_email, enqueue_emails
+from notifications.notification_service import create_notification, create_notifications_bulk
+from notifications.deadline_schedule import roll_forward_schedule
+from notifications.ledger import claim_notifications, prune_ledger, UNSENT_CONDITION, DIGEST_RECIPIENT
+from notifications.digest import (
+    get_manager_recipients, record_digest_events, DEADLINE, OVERDUE, PROGRESS
+)
 import logging
 
 # ตั้งค่า Logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Notification thresholds
-REMINDER_DAYS = [30, 15, 7, 0]  # Days before deadline to send reminders
-
-
 def notify_deadlines():
     """
-    Check all projects and send deadline notifications
+    Send deadline notifications for projects scheduled today
     - 30, 15, 7, 0 days: reminder to Researcher
     - 7, 0 days: also notify Admin/Manager
     - Overdue: weekly notification to Researcher + Admin
+    Dates come from notification_schedule (see deadline_schedule.py); every
+    send is claimed in notification_ledger first, so re-runs on the same day
+    send nothing twice.
     """
     logger.info("⏳ Starting deadline check job...")
     
     conn = get_db()
     today = datetime.today().date()
-    count_sent = 0
+    due_date = today.isoformat()
+    # (project_id, recipient, kind, [(bucket, item), ...]) - items are only
+    # added to their bucket if the ledger claim succeeds
+    claims = []
+    # In-app notifications are collected and inserted in one statement at the end
+    pending_notifications = []
+    # Emails are collected and queued in the outbox at the end
+    researcher_messages = []
+    admin_messages = []
+    digest_events = []
     
     try:
-        # Get all projects with deadlines
-        projects = conn.execute("""
-            SELECT rp.*, u.username as assigned_name, u.email as assigned_email
-            FROM research_projects rp
+        # Move past overdue boundaries / missed days onto their next date
+        roll_forward_schedule(conn, today)
+        prune_ledger(conn, today)
+        
+        # Only projects with a notification due today (indexed on due_on)
+        # that no earlier run today has handled
+        projects = conn.execute(f"""
+            SELECT rp.*, s.kind, u.username as assigned_name, u.email as assigned_email
+            FROM notification_schedule s
+            JOIN research_projects rp ON rp.id = s.project_id
             LEFT JOIN users u ON rp.assigned_researcher_id = u.id
-        """).fetchall()
+            WHERE s.due_on = ? AND {UNSENT_CONDITION}
+        """, (due_date,)).fetchall()
     except Exception as e:
         logger.error(f"❌ Database error: {e}")
         return 0
     
-    # Get admin/manager emails
+    if not projects:
+        logger.info("✅ Job finished. Nothing (left) to send today.")
+        return 0
+    
+    # Get admin/manager emails (digest-mode managers get a summary instead)
     try:
-        admins = conn.execute("""
-            SELECT email, username FROM users 
-            WHERE role IN ('admin', 'manager') AND email IS NOT NULL AND email != ''
-        """).fetchall()
+        admins, digest_admins = get_manager_recipients(conn)
     except:
-        admins = []
+        admins, digest_admins = [], []
     
     for row in projects:
-        if not row['deadline']:
-            continue
-        
+        row = dict(row)  # sqlite3.Row has no .get()
         # Determine email recipient
         recipient_email = row.get('assigned_email') or row.get('researcher_email')
         recipient_name = row.get('assigned_name') or row.get('researcher_name') or 'ผู้รับผิดชอบ'
@@ -63,96 +85,108 @@ def notify_deadlines():
             continue
         
         try:
-            dt = pd.to_datetime(row['deadline'], errors='coerce')
-            if pd.isna(dt):
+            deadline = parse_date_fast(row['deadline'])
+            if not deadline:
                 continue
             
-            days_left = (dt.date() - today).days
+            days_left = (deadline - today).days
             project_name = row['project_th'] or f"Project #{row['id']}"
             
-            # Check if should notify
-            should_notify_researcher = False
-            should_notify_admin = False
-            
-            # Deadline reminders
-            if days_left in REMINDER_DAYS:
-                should_notify_researcher = True
-                # Notify admins for urgent (7 days and deadline day)
-                if days_left <= 7:
-                    should_notify_admin = True
+            # Researcher is notified for every scheduled date;
+            # admins for urgent reminders (7 days and deadline day) and overdue
+            if row['kind'] == 'reminder':
+                should_notify_admin = days_left <= 7
                 logger.info(f"🔔 Deadline reminder: {project_name} ({days_left} days left)")
+            else:
+                should_notify_admin = True
+                logger.info(f"❌ Overdue alert: {project_name} ({abs(days_left)} days overdue)")
+            
+            # Get researcher user ID if assigned
+            researcher_user_id = row.get('assigned_researcher_id')
             
-            # Overdue - weekly (every 7 days or first day)
-            elif days_left < 0:
-                days_overdue = abs(days_left)
-                if days_overdue == 1 or days_overdue % 7 == 0:
-                    should_notify_researcher = True
-                    should_notify_admin = True
-                    logger.info(f"❌ Overdue alert: {project_name} ({days_overdue} days overdue)")
+            researcher_items = []
+            if days_left >= 0:
+                researcher_items.append((researcher_messages, build_deadline_reminder(
+                    recipient_email, recipient_name, project_name, days_left
+                )))
+                # Create in-app notification
+                if researcher_user_id:
+                    notif_type = 'danger' if days_left == 0 else ('warning' if days_left <= 7 else 'info')
+                    researcher_items.append((pending_notifications, (
+                        researcher_user_id,
+                        f"⏰ เหลือเวลาอีก {days_left} วัน" if days_left > 0 else "🔴 ถึงกำหนดส่งวันนี้!",
+                        f"โครงการ: {project_name[:50]}",
+                        notif_type,
+                        f"/researcher/project/{row['id']}"
+                    )))
+            else:
+                researcher_items.append((researcher_messages, build_overdue_alert(
+                    recipient_email, recipient_name, project_name, 
+                    abs(days_left), is_admin=False
+                )))
+                # Create in-app notification for overdue
+                if researcher_user_id:
+                    researcher_items.append((pending_notifications, (
+                        researcher_user_id,
+                        f"❌ เลยกำหนดส่ง {abs(days_left)} วัน",
+                        f"โครงการ: {project_name[:50]}",
+                        'danger',
+                        f"/researcher/project/{row['id']}"
+                    )))
+            claims.append((row['id'], recipient_email, row['kind'], researcher_items))
             
-            # Send notifications
-            if should_notify_researcher:
-                # Get researcher user ID if assigned
-                researcher_user_id = row.get('assigned_researcher_id')
-                
+            if should_notify_admin:
+                # Rendered once per project; every admin gets a personalized copy
+                # and all copies go out in one API request
                 if days_left >= 0:
-                    success, _ = send_deadline_reminder(
-                        recipient_email, recipient_name, project_name, days_left
+                    admin_message = build_deadline_reminder(
+                        None, RECIPIENT_TOKEN, project_name, days_left
                     )
-                    # Create in-app notification
-                    if researcher_user_id:
-                        notif_type = 'danger' if days_left == 0 else ('warning' if days_left <= 7 else 'info')
-                        create_notification(
-                            user_id=researcher_user_id,
-                            title=f"⏰ เหลือเวลาอีก {days_left} วัน" if days_left > 0 else "🔴 ถึงกำหนดส่งวันนี้!",
-                            message=f"โครงการ: {project_name[:50]}",
-                            notif_type=notif_type,
-                            link=f"/researcher/project/{row['id']}"
-                        )
                 else:
-                    success, _ = send_overdue_alert(
-                        recipient_email, recipient_name, project_name, 
-                        abs(days_left), is_admin=False
+                    admin_message = build_overdue_alert(
+                        None, RECIPIENT_TOKEN, project_name, abs(days_left), is_admin=True
                     )
-                    # Create in-app notification for overdue
-                    if researcher_user_id:
-                        create_notification(
-                            user_id=researcher_user_id,
-                            title=f"❌ เลยกำหนดส่ง {abs(days_left)} วัน",
-                            message=f"โครงการ: {project_name[:50]}",
-                            notif_type='danger',
-                            link=f"/researcher/project/{row['id']}"
-                        )
-                
-                if success:
-                    count_sent += 1
-            
-            if should_notify_admin:
                 for admin in admins:
                     if admin['email']:
-                        if days_left >= 0:
-                            send_deadline_reminder(
-                                admin['email'], admin['username'],
-                                project_name, days_left
-                            )
-                        else:
-                            send_overdue_alert(
-                                admin['email'], admin['username'],
-                                project_name, abs(days_left), is_admin=True
-                            )
+                        claims.append((row['id'], admin['email'], row['kind'], [
+                            (admin_messages, personalize(admin_message, admin['email'], admin['username']))
+                        ]))
+                if digest_admins:
+                    if days_left >= 0:
+                        event = (DEADLINE, row['id'], project_name, f"เหลือเวลาอีก {days_left} วัน")
+                    else:
+                        event = (OVERDUE, row['id'], project_name, f"เลยกำหนดส่ง {abs(days_left)} วัน")
+                    claims.append((row['id'], DIGEST_RECIPIENT, row['kind'], [(digest_events, event)]))
             
         except Exception as e:
             logger.error(f"Error processing project {row['id']}: {e}")
             continue
     
-    logger.info(f"✅ Job finished. Sent {count_sent} emails.")
+    # One commit: ledger claims, emails to the outbox (sent by the outbox worker)
+    # and a single multi-row INSERT of all in-app notifications.
+    # A claim that already exists (overlapping run) drops its items.
+    with conn.transaction():
+        claimed = claim_notifications(conn, [c[:3] for c in claims], due_date)
+        for project_id, recipient, kind, items in claims:
+            if (project_id, recipient, kind) in claimed:
+                # A key listed twice in this run is still only sent once
+                claimed.discard((project_id, recipient, kind))
+                for bucket, item in items:
+                    bucket.append(item)
+        enqueue_emails(conn, researcher_messages + admin_messages)
+        record_digest_events(conn, digest_events)
+        create_notifications_bulk(pending_notifications)
+    count_sent = len(researcher_messages)
+    
+    logger.info(f"✅ Job finished. Queued {count_sent} emails ({len(admin_messages)} to admins).")
     return count_sent
 
 
 def send_assignment_notification(researcher_id, project_id):
     """
-    Send notification when researcher is assigned to a project
-    Called from assign_researcher route
+    Queue notification when researcher is assigned to a project
+    Called from assign_researcher route (joins its transaction)
+    Returns True if an email was queued
     """
     try:
         conn = get_db()
@@ -167,31 +201,57 @@ def send_assignment_notification(researcher_id, project_id):
             "SELECT project_th FROM research_projects WHERE id = ?", (project_id,)
         ).fetchone()
         
-        if researcher and researcher['email'] and project:
-            success, error = send_assignment_email(
+        if not researcher or not project:
+            logger.warning(f"⚠️ Cannot send assignment notification: missing data")
+            return False
+        
+        project_name = project['project_th'] or f"Project #{project_id}"
+        
+        with conn.transaction():
+            # In-app notification
+            create_notification(
+                user_id=researcher_id,
+                title="📬 ได้รับมอบหมายโครงการใหม่",
+                message=f"โครงการ: {project_name[:50]}",
+                notif_type='info',
+                link=f"/researcher/project/{project_id}"
+            )
+            
+            if not researcher['email']:
+                return False
+            # Email goes through the outbox (one INSERT here)
+            enqueue_email(conn, build_assignment_email(
                 researcher['email'],
                 researcher['username'],
-                project['project_th'] or f"Project #{project_id}",
+                project_name,
                 project_id
-            )
-            
-            if success:
-                logger.info(f"✅ Assignment notification sent to {researcher['email']}")
-                # Also create in-app notification
-                create_notification(
-                    user_id=researcher_id,
-                    title="📬 ได้รับมอบหมายโครงการใหม่",
-                    message=f"โครงการ: {project['project_th'][:50] if project['project_th'] else f'Project #{project_id}'}",
-                    notif_type='info',
-                    link=f"/researcher/project/{project_id}"
-                )
-                return True
-            else:
-                logger.error(f"❌ Failed to send assignment email: {error}")
-        else:
-            logger.warning(f"⚠️ Cannot send assignment notification: missing data")
+            ))
+        logger.info(f"✅ Assignment notification queued for {researcher['email']}")
+        return True
             
     except Exception as e:
         logger.error(f"❌ Assignment notification error: {e}")
     
     return False
+
+
+def send_progress_notification(conn, project, researcher_name, progress_percent, status):
+    """
+    Tell admins/managers about a progress update
+    Immediate-mode managers get an email now; digest-mode managers get it
+    in their next digest. Call inside the update's transaction.
+    """
+    admins, digest_admins = get_manager_recipients(conn)
+    project_name = project['project_th'] or f"Project #{project['id']}"
+    
+    if admins:
+        message = build_progress_update_email(
+            None, project_name, researcher_name, progress_percent, status
+        )
+        enqueue_emails(conn, [personalize(message, a['email'], a['username']) for a in admins])
+    if digest_admins:
+        status_text = PROGRESS_STATUS.get(status, ('ไม่ระบุ',))[0]
+        record_digest_events(conn, [(
+            PROGRESS, project['id'], project_name,
+            f"{researcher_name}: {progress_percent}% ({status_text})"
+        )])
@@ -0,0 +1,151 @@
+"""
+SendGrid Stand-in - Local HTTP server that accepts /v3/mail/send payloads
+Records every request and can add latency and inject 429 / 5xx responses,
+so the notification path can be exercised and measured without SendGrid.
+
+    python -m notifications.sendgrid_standin --port 8025 --latency 0.05 --rate-429 0.1
+    EMAIL_TRANSPORT=standin flask run
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StandInServer:
+    """
+    Threaded stand-in server. Use start()/stop() in scripts, or as a context manager.
+
+    Args:
+        latency: seconds added to every response
+        rate_429: fraction of requests answered with 429 (+ Retry-After)
+        rate_5xx: fraction of requests answered with 503
+        retry_after: value of the Retry-After header on 429s
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, rate_429=0.0, rate_5xx=0.0,
+                 retry_after=0, seed=None):
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = []
+        self.status_counts = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v3/mail/send"
+
+    def _handler_class(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                status = standin._handle(self.path, body)
+                self.send_response(status)
+                if status == 429:
+                    self.send_header('Retry-After', str(standin.retry_after))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _handle(self, path, body):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            roll = self._random.random()
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            if roll < self.rate_429:
+                status = 429
+            elif roll < self.rate_429 + self.rate_5xx:
+                status = 503
+            else:
+                status = 202
+            with self._lock:
+                self.status_counts[status] = self.status_counts.get(status, 0) + 1
+                if status == 202:
+                    try:
+                        self.requests.append(json.loads(body or b'{}'))
+                    except ValueError:
+                        self.requests.append({'path': path, 'raw': body.decode('utf-8', 'replace')})
+            return status
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    @property
+    def recipients(self):
+        """Number of recipients across all accepted requests"""
+        return sum(len(p.get('to', [])) for r in self.requests for p in r.get('personalizations', []))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'accepted': len(self.requests),
+                'recipients': self.recipients,
+                'status_counts': dict(self.status_counts),
+                'max_in_flight': self.max_in_flight,
+            }
+
+    def reset(self):
+        with self._lock:
+            self.requests = []
+            self.status_counts = {}
+            self.max_in_flight = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='sendgrid-standin', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local SendGrid stand-in")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds per response")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="fraction answered with 429")
+    parser.add_argument('--rate-5xx', type=float, default=0.0, help="fraction answered with 503")
+    parser.add_argument('--retry-after', type=int, default=0)
+    args = parser.parse_args()
+
+    server = StandInServer(args.host, args.port, args.latency, args.rate_429, args.rate_5xx, args.retry_after)
+    print(f"📮 SendGrid stand-in listening on {server.url}")
+    server.start()
+    try:
+        while True:
+            time.sleep(10)
+            print(f"   {server.stats()}")
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,26 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, current_app, jsonify
 from flask_login import login_required, current_user
 import pandas as pd
 import os
+import time
 from datetime import datetime
 from werkzeug.utils import secure_filename
 from models import get_db, calculate_deadline_status, parse_date_fast
 from database import IS_POSTGRES
 from services.excel_service import get_smart_df
+from services.timing import timed
+from services.metrics import metrics
 
 # ✅ Import ฟังก์ชันส่งเมล
-from notifications.email_service import send_alert_email
+from notifications.email_service import build_alert_email
+from notifications.outbox import enqueue_email
 import re
 from audit.service import log_project_action, log_action
+from services.project_changes import (
+    record_project_change, get_changes_since, INSERT, UPDATE, DELETE, ASSIGN, CLEAR
+)
+from services.cache import cache, PROJECTS, USERS
+from services.page_cache import cached_page
 
 # ✅ Import permissions
 from permissions import manager_required, can_manage_projects
@@ -22,23 +31,11 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 
 # ---------------------------------------------------------
-# 🚀 Routes
+# ⚡ Cached lookups (services/cache.py, shared by all workers)
 # ---------------------------------------------------------
-
-@research_bp.route("/")
-@login_required
-def landing():
-    # Redirect Researcher to their own dashboard
-    if current_user.role == 'researcher':
-        return redirect(url_for('researcher.dashboard'))
-    
-    conn = get_db()
-    
-    # Get year filter from request
-    selected_year = request.args.get('year', 'all')
-    
-    # Get list of available years - use different SQL for PostgreSQL
-    try:
+def get_years_list(conn):
+    """Years that appear in any project's start date or deadline (newest first)"""
+    def load():
         if IS_POSTGRES:
             # PostgreSQL uses EXTRACT function
             years_result = conn.execute("""
@@ -63,112 +60,161 @@ def landing():
                 WHERE deadline IS NOT NULL AND deadline != ''
                 ORDER BY year DESC
             """).fetchall()
-        years_list = [r['year'] for r in years_result if r['year']]
+        return [r['year'] for r in years_result if r['year']]
+    # A failed query is not cached
+    try:
+        return cache.get_or_set('research:years', load, tags=[PROJECTS])
     except:
-        years_list = []
+        return []
+
+
+def get_affiliations(conn):
+    """Distinct non-empty affiliations (sorted)"""
+    def load():
+        rows = conn.execute("""
+            SELECT DISTINCT affiliation FROM research_projects 
+            WHERE affiliation IS NOT NULL AND affiliation != '' 
+            ORDER BY affiliation
+        """).fetchall()
+        return [r['affiliation'] for r in rows]
+    return cache.get_or_set('research:affiliations', load, tags=[PROJECTS])
+
+
+def get_researchers(conn):
+    """Researcher accounts for the assignment dropdown"""
+    def load():
+        rows = conn.execute(
+            "SELECT id, username, email FROM users WHERE role = 'researcher' ORDER BY username"
+        ).fetchall()
+        return [dict(r) for r in rows]
+    return cache.get_or_set('research:researchers', load, tags=[USERS])
+
+
+# ---------------------------------------------------------
+# 🚀 Routes
+# ---------------------------------------------------------
+
+@research_bp.route("/")
+@login_required
+def landing():
+    # Redirect Researcher to their own dashboard
+    if current_user.role == 'researcher':
+        return redirect(url_for('researcher.dashboard'))
     
-    # Fetch projects with optional year filter
-    try:
-        if selected_year != 'all' and selected_year:
-            if IS_POSTGRES:
-                projects = conn.execute("""
-                    SELECT id, project_th, researcher_name, researcher_email, 
-                           affiliation, funding, deadline, start_date, end_date, status
-                    FROM research_projects
-                    WHERE EXTRACT(YEAR FROM start_date::DATE)::TEXT = ? 
-                       OR EXTRACT(YEAR FROM deadline::DATE)::TEXT = ?
-                    ORDER BY deadline ASC
-                """, (selected_year, selected_year)).fetchall()
+    conn = get_db()
+    
+    # Get year filter from request
+    selected_year = request.args.get('year', 'all')
+    
+    def build():
+        # Get list of available years (cached, invalidated by project writes)
+        years_list = get_years_list(conn)
+        
+        # Fetch projects with optional year filter
+        try:
+            if selected_year != 'all' and selected_year:
+                if IS_POSTGRES:
+                    projects = conn.execute("""
+                        SELECT id, project_th, researcher_name, researcher_email, 
+                               affiliation, funding, deadline, start_date, end_date, status
+                        FROM research_projects
+                        WHERE EXTRACT(YEAR FROM start_date::DATE)::TEXT = ? 
+                           OR EXTRACT(YEAR FROM deadline::DATE)::TEXT = ?
+                        ORDER BY deadline ASC
+                    """, (selected_year, selected_year)).fetchall()
+                else:
+                    projects = conn.execute("""
+                        SELECT id, project_th, researcher_name, researcher_email, 
+                               affiliation, funding, deadline, start_date, end_date, status
+                        FROM research_projects
+                        WHERE strftime('%Y', start_date) = ? OR strftime('%Y', deadline) = ?
+                        ORDER BY deadline ASC
+                    """, (selected_year, selected_year)).fetchall()
             else:
                 projects = conn.execute("""
                     SELECT id, project_th, researcher_name, researcher_email, 
                            affiliation, funding, deadline, start_date, end_date, status
                     FROM research_projects
-                    WHERE strftime('%Y', start_date) = ? OR strftime('%Y', deadline) = ?
                     ORDER BY deadline ASC
-                """, (selected_year, selected_year)).fetchall()
-        else:
-            projects = conn.execute("""
-                SELECT id, project_th, researcher_name, researcher_email, 
-                       affiliation, funding, deadline, start_date, end_date, status
-                FROM research_projects
-                ORDER BY deadline ASC
-            """).fetchall()
-    except:
-        projects = []
-    
-    today = datetime.today().date()
-    on_track = near_deadline = overdue = 0
-    next_deadline = None
-    
-    # Status counts for chart
-    status_counts = {'draft': 0, 'in_progress': 0, 'under_review': 0, 'completed': 0}
-    
-    # Funding by affiliation for chart
-    funding_by_affiliation = {}
-    total_funding = 0
-    
-    project_list = []
-    
-    # ⚡ OPTIMIZED: Use fast date parsing instead of pandas
-    for row in projects:
-        # Calculate deadline status using optimized function
-        days_left, deadline_status = calculate_deadline_status(row['deadline'], today)
+                """).fetchall()
+        except:
+            projects = []
         
-        # Count deadline statuses
-        if deadline_status == 'overdue':
-            overdue += 1
-        elif deadline_status == 'near_deadline':
-            near_deadline += 1
-        elif deadline_status == 'on_track':
-            on_track += 1
+        today = datetime.today().date()
+        on_track = near_deadline = overdue = 0
+        next_deadline = None
         
-        # Track next deadline
-        if days_left is not None and days_left >= 0:
-            next_deadline = days_left if next_deadline is None else min(next_deadline, days_left)
+        # Status counts for chart
+        status_counts = {'draft': 0, 'in_progress': 0, 'under_review': 0, 'completed': 0}
         
-        # Count by status
-        status = row['status'] or 'draft'
-        if status in status_counts:
-            status_counts[status] += 1
-        else:
-            status_counts['draft'] += 1
+        # Funding by affiliation for chart
+        funding_by_affiliation = {}
+        total_funding = 0
         
-        # Sum funding by affiliation
-        affiliation = row['affiliation'] or 'ไม่ระบุ'
-        funding = row['funding'] or 0
-        funding_by_affiliation[affiliation] = funding_by_affiliation.get(affiliation, 0) + funding
-        total_funding += funding
+        project_list = []
         
-        # Build project list for display
-        project_list.append({
-            'id': row['id'],
-            'project_th': row['project_th'] or '-',
-            'researcher_name': row['researcher_name'] or '-',
-            'affiliation': affiliation,
-            'funding': funding,
-            'deadline': row['deadline'],
-            'days_left': days_left,
-            'deadline_status': deadline_status,
-            'status': status
-        })
+        # ⚡ OPTIMIZED: Use fast date parsing instead of pandas
+        for row in projects:
+            # Calculate deadline status using optimized function
+            days_left, deadline_status = calculate_deadline_status(row['deadline'], today)
+            
+            # Count deadline statuses
+            if deadline_status == 'overdue':
+                overdue += 1
+            elif deadline_status == 'near_deadline':
+                near_deadline += 1
+            elif deadline_status == 'on_track':
+                on_track += 1
+            
+            # Track next deadline
+            if days_left is not None and days_left >= 0:
+                next_deadline = days_left if next_deadline is None else min(next_deadline, days_left)
+            
+            # Count by status
+            status = row['status'] or 'draft'
+            if status in status_counts:
+                status_counts[status] += 1
+            else:
+                status_counts['draft'] += 1
+            
+            # Sum funding by affiliation
+            affiliation = row['affiliation'] or 'ไม่ระบุ'
+            funding = row['funding'] or 0
+            funding_by_affiliation[affiliation] = funding_by_affiliation.get(affiliation, 0) + funding
+            total_funding += funding
+            
+            # Build project list for display
+            project_list.append({
+                'id': row['id'],
+                'project_th': row['project_th'] or '-',
+                'researcher_name': row['researcher_name'] or '-',
+                'affiliation': affiliation,
+                'funding': funding,
+                'deadline': row['deadline'],
+                'days_left': days_left,
+                'deadline_status': deadline_status,
+                'status': status
+            })
+        
+        return dict(total=len(projects),
+                    on_track=on_track,
+                    near_deadline=near_deadline,
+                    overdue=overdue,
+                    next_deadline=next_deadline,
+                    total_funding=total_funding,
+                    status_counts=status_counts,
+                    funding_by_affiliation=funding_by_affiliation,
+                    project_list=project_list,
+                    years_list=years_list,
+                    selected_year=selected_year)
     
-    return render_template("research/index.html",
-                           total=len(projects),
-                           on_track=on_track,
-                           near_deadline=near_deadline,
-                           overdue=overdue,
-                           next_deadline=next_deadline,
-                           total_funding=total_funding,
-                           status_counts=status_counts,
-                           funding_by_affiliation=funding_by_affiliation,
-                           project_list=project_list,
-                           years_list=years_list,
-                           selected_year=selected_year,
-                           sheets=session.get("sheets"),
-                           columns=session.get("columns"),
-                           rows=session.get("rows"),
-                           active_sheet=session.get("active_sheet"))
+    # Data is cached per (filters, role, data version); the page itself is
+    # rendered per request with the user's own session state
+    return cached_page("landing", "research/index.html", build, extra=dict(
+        sheets=session.get("sheets"),
+        columns=session.get("columns"),
+        rows=session.get("rows"),
+        active_sheet=session.get("active_sheet")))
 
 @research_bp.route("/upload", methods=["POST"])
 @login_required
@@ -191,30 +237,32 @@ def upload():
     error_msg = None
 
     try:
-        if filename.lower().endswith('.csv'):
-            sheets = ["CSV_File"]
-            session["excel_path"] = path
-        elif filename.lower().endswith('.xls'):
-            # Old Excel format
-            try:
-                xl = pd.ExcelFile(path, engine='xlrd')
-                sheets = xl.sheet_names
-            except Exception as e1:
-                error_msg = f"xlrd error: {e1}"
-        else:
-            # .xlsx format - try multiple methods
-            try:
-                xl = pd.ExcelFile(path, engine='openpyxl')
-                sheets = xl.sheet_names
-            except Exception as e1:
-                error_msg = f"openpyxl error: {e1}"
-                # Fallback: try without specifying engine
+        # Reading the workbook to list its sheets is the slow part of an upload
+        with timed('pandas'):
+            if filename.lower().endswith('.csv'):
+                sheets = ["CSV_File"]
+                session["excel_path"] = path
+            elif filename.lower().endswith('.xls'):
+                # Old Excel format
                 try:
-                    xl = pd.ExcelFile(path)
+                    xl = pd.ExcelFile(path, engine='xlrd')
                     sheets = xl.sheet_names
-                    error_msg = None
-                except Exception as e2:
-                    error_msg = f"Fallback error: {e2}"
+                except Exception as e1:
+                    error_msg = f"xlrd error: {e1}"
+            else:
+                # .xlsx format - try multiple methods
+                try:
+                    xl = pd.ExcelFile(path, engine='openpyxl')
+                    sheets = xl.sheet_names
+                except Exception as e1:
+                    error_msg = f"openpyxl error: {e1}"
+                    # Fallback: try without specifying engine
+                    try:
+                        xl = pd.ExcelFile(path)
+                        sheets = xl.sheet_names
+                        error_msg = None
+                    except Exception as e2:
+                        error_msg = f"Fallback error: {e2}"
 
         if sheets:
             session["sheets"] = sheets
@@ -334,6 +382,7 @@ def map_columns():
         flash("กรุณาเลือกอย่างน้อย 1 field สำหรับ mapping", "warning")
         return redirect(url_for("research.landing"))
 
+    started = time.perf_counter()
     path, sheet = session.get("excel_path"), session.get("active_sheet")
     df = get_smart_df(path, sheet)
 
@@ -342,57 +391,64 @@ def map_columns():
 
     conn = get_db()
     count = 0
+    rejected = 0
+    new_ids = []
 
-    for _, r in df.iterrows():
-        try:
-            fund = 0
-            f_col = mapping.get("funding")
-            if f_col and f_col in r:
-                # import re moved to top
-                clean_f = re.sub(r'[^\d.]', '', str(r[f_col]))
-                fund = float(clean_f) if clean_f else 0
+    with conn.transaction():
+        for _, r in df.iterrows():
+            try:
+                fund = 0
+                f_col = mapping.get("funding")
+                if f_col and f_col in r:
+                    # import re moved to top
+                    clean_f = re.sub(r'[^\d.]', '', str(r[f_col]))
+                    fund = float(clean_f) if clean_f else 0
 
-            # Date Fields
-            deadline_str = ""
-            if mapping.get("deadline") in r:
-                deadline_str = parse_date(r[mapping.get("deadline")])
+                # Date Fields
+                deadline_str = ""
+                if mapping.get("deadline") in r:
+                    deadline_str = parse_date(r[mapping.get("deadline")])
                 
-            start_str = ""
-            if mapping.get("start_date") in r:
-                start_str = parse_date(r[mapping.get("start_date")])
+                start_str = ""
+                if mapping.get("start_date") in r:
+                    start_str = parse_date(r[mapping.get("start_date")])
 
-            end_str = ""
-            if mapping.get("end_date") in r:
-                end_str = parse_date(r[mapping.get("end_date")])
+                end_str = ""
+                if mapping.get("end_date") in r:
+                    end_str = parse_date(r[mapping.get("end_date")])
 
-            email_val = ""
-            e_col = mapping.get("researcher_email")
-            if e_col and e_col in r:
-                email_val = str(r[e_col]).strip()
+                email_val = ""
+                e_col = mapping.get("researcher_email")
+                if e_col and e_col in r:
+                    email_val = str(r[e_col]).strip()
 
-            conn.execute("""INSERT INTO research_projects
-                (project_th, project_en, researcher_name, researcher_email, affiliation, funding, deadline, start_date, end_date)
-                VALUES (?,?,?,?,?,?,?,?,?)""",
-                (str(r.get(mapping.get("project_th"), "")),
-                 str(r.get(mapping.get("project_en"), "")),
-                 str(r.get(mapping.get("researcher_name"), "")),
-                 email_val,
-                 str(r.get(mapping.get("affiliation"), "")),
-                 fund, deadline_str, start_str, end_str))
+                # Savepoint per row: a bad row is skipped without aborting the import
+                with conn.transaction():
+                    cursor = conn.execute("""INSERT INTO research_projects
+                        (project_th, project_en, researcher_name, researcher_email, affiliation, funding, deadline, start_date, end_date)
+                        VALUES (?,?,?,?,?,?,?,?,?)""" + (" RETURNING id" if IS_POSTGRES else ""),
+                        (str(r.get(mapping.get("project_th"), "")),
+                         str(r.get(mapping.get("project_en"), "")),
+                         str(r.get(mapping.get("researcher_name"), "")),
+                         email_val,
+                         str(r.get(mapping.get("affiliation"), "")),
+                         fund, deadline_str, start_str, end_str))
+                    new_ids.append(cursor.fetchone()['id'] if IS_POSTGRES else cursor.lastrowid)
 
-            count += 1
-        except Exception as e:
-            print("Insert error:", e, r)
-            continue
+                count += 1
+            except Exception as e:
+                print("Insert error:", e, r)
+                rejected += 1
+                continue
 
-    conn.commit()
-    # conn.close()
+        record_project_change(conn, INSERT, new_ids)
+        log_project_action("PROJECTS_IMPORTED", details=f"Imported {count} projects")
+    metrics.observe_import('map_columns', count, rejected, time.perf_counter() - started)
 
     session.pop("sheets", None)
     session.pop("columns", None)
     session.pop("rows", None)
 
-    log_project_action("PROJECTS_IMPORTED", details=f"Imported {count} projects")
     flash(f'บันทึกข้อมูลสำเร็จ {count} รายการ!', 'success')
     return redirect(url_for("research.landing"))
 
@@ -429,13 +485,10 @@ def dashboard():
     rows = conn.execute(sql, params).fetchall()
     
     # Get distinct affiliations for filter
-    aff_rows = conn.execute("SELECT DISTINCT affiliation FROM research_projects WHERE affiliation != '' ORDER BY affiliation").fetchall()
-    aff_list = [r['affiliation'] for r in aff_rows]
+    aff_list = get_affiliations(conn)
     
     # Get all researchers for assignment dropdown
-    researchers = conn.execute(
-        "SELECT id, username, email FROM users WHERE role = 'researcher' ORDER BY username"
-    ).fetchall()
+    researchers = get_researchers(conn)
     
     today = datetime.today().date()
     projects = []
@@ -481,9 +534,10 @@ def delete_project(pid):
     project = conn.execute("SELECT project_th FROM research_projects WHERE id = ?", (pid,)).fetchone()
     project_name = project['project_th'] if project else 'Unknown'
     
-    conn.execute("DELETE FROM research_projects WHERE id = ?", (pid,))
-    conn.commit()
-    log_project_action("PROJECT_DELETED", project_id=pid, details=f"Deleted: {project_name}")
+    with conn.transaction():
+        conn.execute("DELETE FROM research_projects WHERE id = ?", (pid,))
+        record_project_change(conn, DELETE, [pid])
+        log_project_action("PROJECT_DELETED", project_id=pid, details=f"Deleted: {project_name}")
     flash("ลบโครงการเรียบร้อยแล้ว", "success")
     return redirect(url_for("research.dashboard"))
 
@@ -498,9 +552,10 @@ def clear_all():
     conn = get_db()
     # Get count before clearing for audit
     count = conn.execute("SELECT COUNT(*) as cnt FROM research_projects").fetchone()['cnt']
-    conn.execute("DELETE FROM research_projects")
-    conn.commit()
-    log_action("DATA_CLEARED", target_type="project", details=f"Cleared {count} projects")
+    with conn.transaction():
+        conn.execute("DELETE FROM research_projects")
+        record_project_change(conn, CLEAR)
+        log_action("DATA_CLEARED", target_type="project", details=f"Cleared {count} projects")
     flash("ล้างข้อมูลทั้งหมดเรียบร้อยแล้ว", "warning")
     return redirect(url_for("research.dashboard"))
 
@@ -517,11 +572,9 @@ def send_project_alert(pid):
         if not pd.isna(dt):
              days_left = (dt.date() - datetime.today().date()).days
         
-        success, msg = send_alert_email(row['researcher_email'], row['project_th'], days_left)
-        if success:
-            flash(f"ส่งเมลแจ้งเตือนไปยัง {row['researcher_email']} แล้ว", "success")
-        else:
-            flash(f"ส่งเมลไม่สำเร็จ: {msg}", "danger")
+        with conn.transaction():
+            enqueue_email(conn, build_alert_email(row['researcher_email'], row['project_th'], days_left))
+        flash(f"ส่งเมลแจ้งเตือนไปยัง {row['researcher_email']} แล้ว", "success")
     else:
         flash("ไม่พบข้อมูลอีเมลหรือโครงการ", "warning")
         
@@ -538,35 +591,36 @@ def edit_project(pid):
     conn = get_db()
     
     if request.method == "POST":
-        # Update project data
-        conn.execute("""
-            UPDATE research_projects SET
-                project_th = ?,
-                project_en = ?,
-                researcher_name = ?,
-                researcher_email = ?,
-                affiliation = ?,
-                funding = ?,
-                start_date = ?,
-                end_date = ?,
-                deadline = ?,
-                status = ?
-            WHERE id = ?
-        """, (
-            request.form.get('project_th', ''),
-            request.form.get('project_en', ''),
-            request.form.get('researcher_name', ''),
-            request.form.get('researcher_email', ''),
-            request.form.get('affiliation', ''),
-            float(request.form.get('funding') or 0),
-            request.form.get('start_date', ''),
-            request.form.get('end_date', ''),
-            request.form.get('deadline', ''),
-            request.form.get('status', 'draft'),
-            pid
-        ))
-        conn.commit()
-        log_project_action("PROJECT_UPDATED", project_id=pid, details=f"Updated: {request.form.get('project_th', '')}")
+        fields = {
+            'project_th': request.form.get('project_th', ''),
+            'project_en': request.form.get('project_en', ''),
+            'researcher_name': request.form.get('researcher_name', ''),
+            'researcher_email': request.form.get('researcher_email', ''),
+            'affiliation': request.form.get('affiliation', ''),
+            'funding': float(request.form.get('funding') or 0),
+            'start_date': request.form.get('start_date', ''),
+            'end_date': request.form.get('end_date', ''),
+            'deadline': request.form.get('deadline', ''),
+            'status': request.form.get('status', 'draft'),
+        }
+        with conn.transaction():
+            # Update project data
+            conn.execute("""
+                UPDATE research_projects SET
+                    project_th = ?,
+                    project_en = ?,
+                    researcher_name = ?,
+                    researcher_email = ?,
+                    affiliation = ?,
+                    funding = ?,
+                    start_date = ?,
+                    end_date = ?,
+                    deadline = ?,
+                    status = ?
+                WHERE id = ?
+            """, (*fields.values(), pid))
+            record_project_change(conn, UPDATE, [pid], fields)
+            log_project_action("PROJECT_UPDATED", project_id=pid, details=f"Updated: {request.form.get('project_th', '')}")
         flash("บันทึกการแก้ไขเรียบร้อยแล้ว", "success")
         return redirect(url_for("research.dashboard"))
     
@@ -616,26 +670,28 @@ def assign_researcher(pid):
         return redirect(url_for('research.dashboard'))
     
     try:
-        # Assign researcher to project
-        conn.execute(
-            "UPDATE research_projects SET assigned_researcher_id = ? WHERE id = ?",
-            (researcher_id, pid)
-        )
-        conn.commit()
-        
-        log_project_action(
-            "RESEARCHER_ASSIGNED",
-            project_id=pid,
-            details=f"Assigned {researcher['username']} to project: {project['project_th']}"
-        )
-        
-        # Send assignment notification email
-        email_sent = False
-        try:
-            from notifications.scheduler import send_assignment_notification
-            email_sent = send_assignment_notification(researcher_id, pid)
-        except Exception as notify_err:
-            print(f"⚠️ Notification error (non-critical): {notify_err}")
+        with conn.transaction():
+            # Assign researcher to project
+            conn.execute(
+                "UPDATE research_projects SET assigned_researcher_id = ? WHERE id = ?",
+                (researcher_id, pid)
+            )
+            # A project with no recipient before gets its schedule rows here
+            record_project_change(conn, ASSIGN, [pid], {'assigned_researcher_id': int(researcher_id)})
+            
+            log_project_action(
+                "RESEARCHER_ASSIGNED",
+                project_id=pid,
+                details=f"Assigned {researcher['username']} to project: {project['project_th']}"
+            )
+            
+            # Send assignment notification email (in-app notification joins this commit)
+            email_sent = False
+            try:
+                from notifications.scheduler import send_assignment_notification
+                email_sent = send_assignment_notification(researcher_id, pid)
+            except Exception as notify_err:
+                print(f"⚠️ Notification error (non-critical): {notify_err}")
         
         if email_sent:
             flash(f'✅ มอบหมายโครงการให้ {researcher["username"]} สำเร็จ และส่ง Email แจ้งเตือนแล้ว', 'success')
@@ -675,7 +731,7 @@ def download_template():
     
     # Write to Excel in memory
     output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+    with timed('pandas'), pd.ExcelWriter(output, engine='openpyxl') as writer:
         df.to_excel(writer, index=False, sheet_name='Projects')
     output.seek(0)
     
@@ -704,8 +760,10 @@ def quick_import():
         return redirect(url_for("research.landing"))
     
     try:
+        started = time.perf_counter()
         # Read Excel file
-        df = pd.read_excel(file, engine='openpyxl')
+        with timed('pandas'):
+            df = pd.read_excel(file, engine='openpyxl')
         
         # Column mapping (Thai headers to database fields)
         column_map = {
@@ -728,87 +786,98 @@ def quick_import():
         updated = 0
         skipped = 0
         errors = []
+        new_ids = []
+        updated_ids = []
         
-        for idx, row in df.iterrows():
-            try:
-                project_th = str(row.get('project_th', '')).strip() if pd.notna(row.get('project_th')) else ''
-                project_en = str(row.get('project_en', '')).strip() if pd.notna(row.get('project_en')) else ''
+        with conn.transaction():
+            for idx, row in df.iterrows():
+                try:
+                    project_th = str(row.get('project_th', '')).strip() if pd.notna(row.get('project_th')) else ''
+                    project_en = str(row.get('project_en', '')).strip() if pd.notna(row.get('project_en')) else ''
                 
-                # Skip if no project name
-                if not project_th and not project_en:
-                    skipped += 1
-                    continue
+                    # Skip if no project name
+                    if not project_th and not project_en:
+                        skipped += 1
+                        continue
                 
-                researcher_name = str(row.get('researcher_name', '')).strip() if pd.notna(row.get('researcher_name')) else ''
-                researcher_email = str(row.get('researcher_email', '')).strip() if pd.notna(row.get('researcher_email')) else ''
-                affiliation = str(row.get('affiliation', '')).strip() if pd.notna(row.get('affiliation')) else ''
+                    researcher_name = str(row.get('researcher_name', '')).strip() if pd.notna(row.get('researcher_name')) else ''
+                    researcher_email = str(row.get('researcher_email', '')).strip() if pd.notna(row.get('researcher_email')) else ''
+                    affiliation = str(row.get('affiliation', '')).strip() if pd.notna(row.get('affiliation')) else ''
                 
-                # Handle funding
-                funding = 0
-                if pd.notna(row.get('funding')):
-                    try:
-                        funding = float(row.get('funding', 0))
-                    except:
-                        funding = 0
+                    # Handle funding
+                    funding = 0
+                    if pd.notna(row.get('funding')):
+                        try:
+                            funding = float(row.get('funding', 0))
+                        except:
+                            funding = 0
                 
-                # Handle dates
-                deadline = ''
-                if pd.notna(row.get('deadline')):
-                    dt = pd.to_datetime(row.get('deadline'), errors='coerce')
-                    if not pd.isna(dt):
-                        deadline = dt.strftime('%Y-%m-%d')
+                    # Handle dates
+                    deadline = ''
+                    if pd.notna(row.get('deadline')):
+                        dt = pd.to_datetime(row.get('deadline'), errors='coerce')
+                        if not pd.isna(dt):
+                            deadline = dt.strftime('%Y-%m-%d')
                 
-                start_date = ''
-                if pd.notna(row.get('start_date')):
-                    dt = pd.to_datetime(row.get('start_date'), errors='coerce')
-                    if not pd.isna(dt):
-                        start_date = dt.strftime('%Y-%m-%d')
+                    start_date = ''
+                    if pd.notna(row.get('start_date')):
+                        dt = pd.to_datetime(row.get('start_date'), errors='coerce')
+                        if not pd.isna(dt):
+                            start_date = dt.strftime('%Y-%m-%d')
                 
-                end_date = ''
-                if pd.notna(row.get('end_date')):
-                    dt = pd.to_datetime(row.get('end_date'), errors='coerce')
-                    if not pd.isna(dt):
-                        end_date = dt.strftime('%Y-%m-%d')
+                    end_date = ''
+                    if pd.notna(row.get('end_date')):
+                        dt = pd.to_datetime(row.get('end_date'), errors='coerce')
+                        if not pd.isna(dt):
+                            end_date = dt.strftime('%Y-%m-%d')
                 
-                # Check if project exists (by project_th)
-                existing = None
-                if project_th:
-                    existing = conn.execute(
-                        "SELECT id FROM research_projects WHERE project_th = ?",
-                        (project_th,)
-                    ).fetchone()
+                    # Savepoint per row: a bad row is skipped without aborting the import
+                    with conn.transaction():
+                        # Check if project exists (by project_th)
+                        existing = None
+                        if project_th:
+                            existing = conn.execute(
+                                "SELECT id FROM research_projects WHERE project_th = ?",
+                                (project_th,)
+                            ).fetchone()
                 
-                if existing:
-                    # UPDATE existing project
-                    conn.execute("""
-                        UPDATE research_projects SET
-                            project_en = ?, researcher_name = ?, researcher_email = ?,
-                            affiliation = ?, funding = ?, deadline = ?,
-                            start_date = ?, end_date = ?
-                        WHERE id = ?
-                    """, (project_en, researcher_name, researcher_email, 
-                          affiliation, funding, deadline, start_date, end_date,
-                          existing['id']))
-                    updated += 1
-                else:
-                    # INSERT new project
-                    conn.execute("""
-                        INSERT INTO research_projects 
-                        (project_th, project_en, researcher_name, researcher_email, 
-                         affiliation, funding, deadline, start_date, end_date, status)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'draft')
-                    """, (project_th, project_en, researcher_name, researcher_email,
-                          affiliation, funding, deadline, start_date, end_date))
-                    inserted += 1
+                        if existing:
+                            # UPDATE existing project
+                            conn.execute("""
+                                UPDATE research_projects SET
+                                    project_en = ?, researcher_name = ?, researcher_email = ?,
+                                    affiliation = ?, funding = ?, deadline = ?,
+                                    start_date = ?, end_date = ?
+                                WHERE id = ?
+                            """, (project_en, researcher_name, researcher_email, 
+                                  affiliation, funding, deadline, start_date, end_date,
+                                  existing['id']))
+                            updated_ids.append(existing['id'])
+                            updated += 1
+                        else:
+                            # INSERT new project
+                            cursor = conn.execute("""
+                                INSERT INTO research_projects 
+                                (project_th, project_en, researcher_name, researcher_email, 
+                                 affiliation, funding, deadline, start_date, end_date, status)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'draft')
+                            """ + (" RETURNING id" if IS_POSTGRES else ""),
+                                (project_th, project_en, researcher_name, researcher_email,
+                                 affiliation, funding, deadline, start_date, end_date))
+                            new_ids.append(cursor.fetchone()['id'] if IS_POSTGRES else cursor.lastrowid)
+                            inserted += 1
                     
-            except Exception as e:
-                errors.append(f"บรรทัด {idx + 2}: {str(e)}")
-                skipped += 1
-        
-        conn.commit()
-        
-        # Log action
-        log_action("QUICK_IMPORT", details=f"Inserted: {inserted}, Updated: {updated}, Skipped: {skipped}")
+                except Exception as e:
+                    errors.append(f"บรรทัด {idx + 2}: {str(e)}")
+                    skipped += 1
+            
+            record_project_change(conn, INSERT, new_ids)
+            record_project_change(conn, UPDATE, updated_ids)
+            
+            # Log action
+            log_action("QUICK_IMPORT", details=f"Inserted: {inserted}, Updated: {updated}, Skipped: {skipped}")
+        metrics.observe_import('quick_import', inserted + updated, len(errors), time.perf_counter() - started,
+                               skipped=skipped - len(errors))
         
         # Flash result
         flash(f"นำเข้าเสร็จสิ้น: เพิ่มใหม่ {inserted} รายการ, อัพเดท {updated} รายการ, ข้าม {skipped} รายการ", "success")
@@ -822,6 +891,19 @@ def quick_import():
     return redirect(url_for("research.landing"))
 
 
+# ---------------------------------------------------------
+# 🔄 Change Feed (incremental sync)
+# ---------------------------------------------------------
+@research_bp.route("/api/projects/changes")
+@login_required
+@manager_required
+def project_changes():
+    """API: compact project deltas after ?since=<seq> (0 = from the beginning)"""
+    since = request.args.get('since', 0, type=int)
+    limit = request.args.get('limit', 1000, type=int)
+    return jsonify({'success': True, **get_changes_since(get_db(), since, limit)})
+
+
 # ---------------------------------------------------------
 # 📊 Export Data
 # ---------------------------------------------------------
@@ -904,7 +986,7 @@ def export_data():
     
     # Write to Excel with formatting
     output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+    with timed('pandas'), pd.ExcelWriter(output, engine='openpyxl') as writer:
         df.to_excel(writer, index=False, sheet_name='Projects')
         
         # Auto-adjust column widths
@@ -924,9 +1006,11 @@ def export_data():
     filename = f"ITRACK_Report_{datetime.today().strftime('%Y%m%d')}.xlsx"
     
     log_action("EXPORT_DATA", details=f"Exported {len(projects)} projects, year={selected_year}")
+    data = output.getvalue()
+    metrics.inc('itrack_export_bytes_total', len(data), export='projects_xlsx')
     
     return Response(
-        output.getvalue(),
+        data,
         mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
         headers={'Content-Disposition': f'attachment;filename={filename}'}
     )
@@ -946,105 +1030,102 @@ def executive_report():
     # Get filter parameters
     selected_affiliation = request.args.get('affiliation', 'all')
     
-    # Get list of all affiliations
-    aff_rows = conn.execute("""
-        SELECT DISTINCT affiliation FROM research_projects 
-        WHERE affiliation IS NOT NULL AND affiliation != '' 
-        ORDER BY affiliation
-    """).fetchall()
-    affiliations_list = [r['affiliation'] for r in aff_rows]
-    
-    # Fetch projects with optional affiliation filter
-    base_sql = """
-        SELECT rp.*, u.username as assigned_researcher_name
-        FROM research_projects rp
-        LEFT JOIN users u ON rp.assigned_researcher_id = u.id
-    """
-    
-    if selected_affiliation != 'all' and selected_affiliation:
-        projects = conn.execute(base_sql + " WHERE rp.affiliation = ? ORDER BY rp.deadline ASC", 
-                               (selected_affiliation,)).fetchall()
-    else:
-        projects = conn.execute(base_sql + " ORDER BY rp.deadline ASC").fetchall()
-    
-    # Statistics
-    total = len(projects)
-    on_track = near_deadline = overdue = completed = in_progress = 0
-    total_funding = 0
-    funding_by_affiliation = {}
-    progress_by_status = {'not_started': 0, 'in_progress': 0, 'completed': 0, 'on_hold': 0, 'delayed': 0}
-    project_list = []
-    
-    for p in projects:
-        # Funding
-        funding = p['funding'] or 0
-        total_funding += funding
+    def build():
+        # Get list of all affiliations
+        affiliations_list = get_affiliations(conn)
         
-        aff = p['affiliation'] or 'ไม่ระบุ'
-        funding_by_affiliation[aff] = funding_by_affiliation.get(aff, 0) + funding
+        # Fetch projects with optional affiliation filter
+        base_sql = """
+            SELECT rp.*, u.username as assigned_researcher_name
+            FROM research_projects rp
+            LEFT JOIN users u ON rp.assigned_researcher_id = u.id
+        """
         
-        # Status counters
-        status = p['current_status'] or 'not_started'
-        if status in progress_by_status:
-            progress_by_status[status] += 1
+        if selected_affiliation != 'all' and selected_affiliation:
+            projects = conn.execute(base_sql + " WHERE rp.affiliation = ? ORDER BY rp.deadline ASC", 
+                                   (selected_affiliation,)).fetchall()
+        else:
+            projects = conn.execute(base_sql + " ORDER BY rp.deadline ASC").fetchall()
         
-        if status == 'completed':
-            completed += 1
-        elif status == 'in_progress':
-            in_progress += 1
+        # Statistics
+        total = len(projects)
+        on_track = near_deadline = overdue = completed = in_progress = 0
+        total_funding = 0
+        funding_by_affiliation = {}
+        progress_by_status = {'not_started': 0, 'in_progress': 0, 'completed': 0, 'on_hold': 0, 'delayed': 0}
+        project_list = []
         
-        # Deadline status
-        deadline_status = 'no_deadline'
-        days_left = None
-        if p['deadline']:
-            dt = pd.to_datetime(p['deadline'], errors='coerce')
-            if not pd.isna(dt):
-                days_left = (dt.date() - today).days
-                if days_left < 0:
-                    overdue += 1
-                    deadline_status = 'overdue'
-                elif days_left <= 7:
-                    near_deadline += 1
-                    deadline_status = 'near_deadline'
-                else:
-                    on_track += 1
-                    deadline_status = 'on_track'
+        for p in projects:
+            # Funding
+            funding = p['funding'] or 0
+            total_funding += funding
+            
+            aff = p['affiliation'] or 'ไม่ระบุ'
+            funding_by_affiliation[aff] = funding_by_affiliation.get(aff, 0) + funding
+            
+            # Status counters
+            status = p['current_status'] or 'not_started'
+            if status in progress_by_status:
+                progress_by_status[status] += 1
+            
+            if status == 'completed':
+                completed += 1
+            elif status == 'in_progress':
+                in_progress += 1
+            
+            # Deadline status
+            deadline_status = 'no_deadline'
+            days_left = None
+            if p['deadline']:
+                dt = pd.to_datetime(p['deadline'], errors='coerce')
+                if not pd.isna(dt):
+                    days_left = (dt.date() - today).days
+                    if days_left < 0:
+                        overdue += 1
+                        deadline_status = 'overdue'
+                    elif days_left <= 7:
+                        near_deadline += 1
+                        deadline_status = 'near_deadline'
+                    else:
+                        on_track += 1
+                        deadline_status = 'on_track'
+            
+            project_list.append({
+                'id': p['id'],
+                'project_th': p['project_th'] or '-',
+                'researcher_name': p['researcher_name'] or '-',
+                'assigned_researcher': p['assigned_researcher_name'] or 'ยังไม่มอบหมาย',
+                'affiliation': aff,
+                'progress_percent': p['progress_percent'] or 0,
+                'current_status': status,
+                'deadline': p['deadline'] or '-',
+                'days_left': days_left,
+                'deadline_status': deadline_status,
+                'funding': funding
+            })
         
-        project_list.append({
-            'id': p['id'],
-            'project_th': p['project_th'] or '-',
-            'researcher_name': p['researcher_name'] or '-',
-            'assigned_researcher': p['assigned_researcher_name'] or 'ยังไม่มอบหมาย',
-            'affiliation': aff,
-            'progress_percent': p['progress_percent'] or 0,
-            'current_status': status,
-            'deadline': p['deadline'] or '-',
-            'days_left': days_left,
-            'deadline_status': deadline_status,
-            'funding': funding
-        })
-    
-    # Sort funding by affiliation
-    top_affiliations = sorted(funding_by_affiliation.items(), key=lambda x: x[1], reverse=True)[:5]
-    
-    # Calculate average progress
-    avg_progress = sum(p['progress_percent'] for p in project_list) / total if total > 0 else 0
+        # Sort funding by affiliation
+        top_affiliations = sorted(funding_by_affiliation.items(), key=lambda x: x[1], reverse=True)[:5]
+        
+        # Calculate average progress
+        avg_progress = sum(p['progress_percent'] for p in project_list) / total if total > 0 else 0
+        
+        return dict(total=total,
+                    on_track=on_track,
+                    near_deadline=near_deadline,
+                    overdue=overdue,
+                    completed=completed,
+                    in_progress=in_progress,
+                    avg_progress=avg_progress,
+                    total_funding=total_funding,
+                    top_affiliations=top_affiliations,
+                    progress_by_status=progress_by_status,
+                    project_list=project_list,
+                    report_date=today.strftime('%d/%m/%Y'),
+                    affiliations_list=affiliations_list,
+                    selected_affiliation=selected_affiliation)
     
     log_action("VIEW_REPORT", details=f"Viewed executive report, affiliation={selected_affiliation}")
     
-    return render_template("research/report.html",
-                           total=total,
-                           on_track=on_track,
-                           near_deadline=near_deadline,
-                           overdue=overdue,
-                           completed=completed,
-                           in_progress=in_progress,
-                           avg_progress=avg_progress,
-                           total_funding=total_funding,
-                           top_affiliations=top_affiliations,
-                           progress_by_status=progress_by_status,
-                           project_list=project_list,
-                           report_date=today.strftime('%d/%m/%Y'),
-                           affiliations_list=affiliations_list,
-                           selected_affiliation=selected_affiliation)
+    return cached_page("executive_report", "research/report.html", build)
 
@@ -7,8 +7,15 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_required, current_user
 from models import get_db
 from permissions import researcher_required, can_update_progress
+from services.data_version import get_data_version
+from services.project_changes import record_project_change, PROGRESS
+from services.http_cache import conditional_response
+from notifications.scheduler import send_progress_notification
 from datetime import datetime
 import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 researcher_bp = Blueprint('researcher', __name__, url_prefix='/researcher')
 
@@ -132,24 +139,35 @@ def update_progress(project_id):
     now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     
     try:
-        # Update project
-        conn.execute("""
-            UPDATE research_projects
-            SET progress_percent = ?,
-                current_status = ?,
-                last_updated_at = ?,
-                last_updated_by = ?
-            WHERE id = ?
-        """, (progress_percent, status, now, current_user.id, project_id))
-        
-        # Insert update history
-        conn.execute("""
-            INSERT INTO project_updates 
-            (project_id, updated_by, updated_at, progress_percent, status, remarks, delay_reason)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (project_id, current_user.id, now, progress_percent, status, remarks, delay_reason))
-        
-        conn.commit()
+        with conn.transaction():
+            # Update project
+            conn.execute("""
+                UPDATE research_projects
+                SET progress_percent = ?,
+                    current_status = ?,
+                    last_updated_at = ?,
+                    last_updated_by = ?
+                WHERE id = ?
+            """, (progress_percent, status, now, current_user.id, project_id))
+            
+            # Insert update history
+            conn.execute("""
+                INSERT INTO project_updates 
+                (project_id, updated_by, updated_at, progress_percent, status, remarks, delay_reason)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (project_id, current_user.id, now, progress_percent, status, remarks, delay_reason))
+            
+            record_project_change(conn, PROGRESS, [project_id],
+                                  {'progress_percent': progress_percent, 'current_status': status},
+                                  reschedule=False)
+            
+            # Manager email (queued now or collected for the digest);
+            # savepoint so a notification failure never loses the update
+            try:
+                with conn.transaction():
+                    send_progress_notification(conn, project, current_user.username, progress_percent, status)
+            except Exception as notify_err:
+                logger.warning(f"⚠️ Notification error (non-critical): {notify_err}")
         
         flash(f'✅ อัปเดตความคืบหน้าเป็น {progress_percent}% สำเร็จ', 'success')
     except Exception as e:
@@ -165,16 +183,20 @@ def api_my_projects():
     """API endpoint for researcher's projects (for charts/widgets)"""
     conn = get_db()
     
-    if current_user.role == 'researcher':
-        projects = conn.execute("""
-            SELECT id, project_th, progress_percent, current_status, deadline
-            FROM research_projects
-            WHERE assigned_researcher_id = ?
-        """, (current_user.id,)).fetchall()
-    else:
-        projects = conn.execute("""
-            SELECT id, project_th, progress_percent, current_status, deadline
-            FROM research_projects
-        """).fetchall()
-    
-    return jsonify([dict(p) for p in projects])
+    def build():
+        if current_user.role == 'researcher':
+            projects = conn.execute("""
+                SELECT id, project_th, progress_percent, current_status, deadline
+                FROM research_projects
+                WHERE assigned_researcher_id = ?
+            """, (current_user.id,)).fetchall()
+        else:
+            projects = conn.execute("""
+                SELECT id, project_th, progress_percent, current_status, deadline
+                FROM research_projects
+            """).fetchall()
+        return jsonify([dict(p) for p in projects])
+    
+    # Researchers see only their own projects, so the tag is per user
+    scope = current_user.id if current_user.role == 'researcher' else 'all'
+    return conditional_response(f"p-{get_data_version()}-{scope}", build)
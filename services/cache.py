@@ -0,0 +1,300 @@
+"""
+Shared Cache - Two-tier cache for hot lookups (affiliations, researchers, years)
+Tier 1 is a per-process LRU; tier 2 is a SQLite file shared by every gunicorn
+worker on the host. Entries carry a TTL and a set of tags; invalidating a tag
+bumps its version in the shared file, so every worker sees the change on its
+next read without waiting for the TTL.
+
+Backends (CACHE_BACKEND):
+    sqlite - local LRU + shared SQLite file at CACHE_PATH (default)
+    local  - per-process LRU only (tags are per process too)
+    none   - caching disabled, every lookup runs the loader
+"""
+import os
+import json
+import hashlib
+import time
+import sqlite3
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from database import DATABASE_URL, SQLITE_PATH
+from services.invalidation_bus import bus, TAGS
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'sqlite').lower()
+# One cache file per database, so apps on the same host never share entries
+_DB_ID = hashlib.sha1((DATABASE_URL or os.path.abspath(SQLITE_PATH)).encode()).hexdigest()[:12]
+CACHE_PATH = os.getenv('CACHE_PATH', os.path.join(tempfile.gettempdir(), f'itrack-cache-{_DB_ID}.db'))
+CACHE_TTL = int(os.getenv('CACHE_TTL', 300))
+CACHE_LOCAL_MAX = int(os.getenv('CACHE_LOCAL_MAX', 512))
+
+# Tags (invalidated by the writes that change the data)
+PROJECTS = 'projects'
+USERS = 'users'
+
+# Expired shared rows are purged every this many sets
+PURGE_EVERY = 200
+
+_MISSING = object()
+
+
+class SharedTier:
+    """
+    SQLite file with entries (JSON values) and tag versions.
+    Errors are logged and treated as misses - the cache never fails a request.
+    """
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._sets = 0
+        self.errors = 0
+
+    def _conn(self):
+        if self._pid != os.getpid():
+            # Fresh connections after a fork
+            self._local = threading.local()
+            self._pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    tags TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_tags (
+                    tag TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL
+                )
+            """)
+            self._local.conn = conn
+        return conn
+
+    def _failed(self, action, e):
+        self.errors += 1
+        logger.warning(f"⚠️ Shared cache {action} failed: {e}")
+        # Drop the connection; the next call reopens it
+        self._local.conn = None
+
+    def tag_versions(self, tags):
+        """tag -> current version (0 if never invalidated); None on error."""
+        if not tags:
+            return {}
+        try:
+            rows = self._conn().execute(
+                f"SELECT tag, version FROM cache_tags WHERE tag IN ({','.join('?' * len(tags))})",
+                list(tags)
+            ).fetchall()
+        except sqlite3.Error as e:
+            self._failed('tag read', e)
+            return None
+        versions = dict.fromkeys(tags, 0)
+        versions.update(rows)
+        return versions
+
+    def get(self, key, now):
+        """(value, tag_snapshot) or None"""
+        try:
+            row = self._conn().execute(
+                "SELECT value, tags FROM cache_entries WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+        except sqlite3.Error as e:
+            self._failed('read', e)
+            return None
+        if row is None:
+            return None
+        return json.loads(row[0]), json.loads(row[1])
+
+    def set(self, key, value, snapshot, expires_at):
+        try:
+            conn = self._conn()
+            conn.execute("""
+                INSERT INTO cache_entries (key, value, tags, expires_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE
+                SET value = excluded.value, tags = excluded.tags, expires_at = excluded.expires_at
+            """, (key, json.dumps(value, ensure_ascii=False, default=str), json.dumps(snapshot), expires_at))
+            self._sets += 1
+            if self._sets % PURGE_EVERY == 0:
+                conn.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (time.time(),))
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            self._failed('write', e)
+
+    def bump(self, tags):
+        try:
+            self._conn().executemany("""
+                INSERT INTO cache_tags (tag, version) VALUES (?, 1)
+                ON CONFLICT (tag) DO UPDATE SET version = cache_tags.version + 1
+            """, [(t,) for t in tags])
+            return True
+        except sqlite3.Error as e:
+            self._failed('invalidate', e)
+            return False
+
+    def clear(self):
+        try:
+            self._conn().execute("DELETE FROM cache_entries")
+        except sqlite3.Error as e:
+            self._failed('clear', e)
+
+    def size(self):
+        try:
+            return self._conn().execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+        except sqlite3.Error:
+            return None
+
+
+class Cache:
+    """
+    get_or_set() is the main entry point:
+
+        affiliations = cache.get_or_set('affiliations', load_affiliations, tags=[PROJECTS])
+
+    A value is served only if none of its tags changed since it was stored.
+    Values must be JSON-serializable (convert rows to dicts/lists first).
+    """
+
+    def __init__(self, backend=CACHE_BACKEND, path=CACHE_PATH, ttl=CACHE_TTL, local_max=CACHE_LOCAL_MAX):
+        self.backend = backend
+        self.ttl = ttl
+        self.local_max = local_max
+        self.shared = SharedTier(path) if backend == 'sqlite' else None
+        self._local = OrderedDict()
+        self._local_tags = {}
+        self._lock = threading.Lock()
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.backend != 'none' and self.ttl > 0
+
+    def _current_versions(self, tags):
+        if self.shared is not None:
+            return self.shared.tag_versions(tags)
+        with self._lock:
+            return {t: self._local_tags.get(t, 0) for t in tags}
+
+    def _put_local(self, key, value, snapshot, expires_at):
+        with self._lock:
+            self._local[key] = (expires_at, snapshot, value)
+            self._local.move_to_end(key)
+            while len(self._local) > self.local_max:
+                self._local.popitem(last=False)
+
+    def get(self, key, default=None):
+        """Return a fresh value or default."""
+        if not self.enabled:
+            return default
+        now = time.time()
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._local[key]
+                entry = None
+            if entry is not None:
+                self._local.move_to_end(key)
+        if entry is not None:
+            expires_at, snapshot, value = entry
+            if self._current_versions(list(snapshot)) == snapshot:
+                self.local_hits += 1
+                return value
+            self.stale += 1
+            with self._lock:
+                self._local.pop(key, None)
+
+        if self.shared is not None:
+            found = self.shared.get(key, now)
+            if found is not None:
+                value, snapshot = found
+                if self.shared.tag_versions(list(snapshot)) == snapshot:
+                    self.shared_hits += 1
+                    self._put_local(key, value, snapshot, now + self.ttl)
+                    return value
+                self.stale += 1
+        self.misses += 1
+        return default
+
+    def set(self, key, value, ttl=None, tags=(), snapshot=None):
+        if not self.enabled:
+            return
+        if snapshot is None:
+            snapshot = self._current_versions(list(tags))
+        if snapshot is None:
+            return
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        self._put_local(key, value, snapshot, expires_at)
+        if self.shared is not None:
+            self.shared.set(key, value, snapshot, expires_at)
+
+    def get_or_set(self, key, loader, ttl=None, tags=()):
+        """Return the cached value, or call loader() and cache its result."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            # Versions are read before loading: a write that commits while the
+            # loader runs leaves the stored value already stale, never wrong
+            snapshot = self._current_versions(list(tags)) if self.enabled else None
+            value = loader()
+            if snapshot is not None:
+                self.set(key, value, ttl, tags, snapshot)
+        return value
+
+    def invalidate_tags(self, *tags):
+        """Make every entry carrying one of these tags stale, in all workers."""
+        if not tags or self.backend == 'none':
+            return
+        self.invalidations += 1
+        with self._lock:
+            for t in tags:
+                self._local_tags[t] = self._local_tags.get(t, 0) + 1
+        if self.shared is not None and not self.shared.bump(tags):
+            # Could not reach the shared tier: drop what this worker holds at least
+            self.clear_local()
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def clear(self):
+        self.clear_local()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def stats(self):
+        """Return hit-rate metrics for monitoring."""
+        hits = self.local_hits + self.shared_hits
+        lookups = hits + self.misses
+        return {
+            'backend': self.backend,
+            'ttl': self.ttl,
+            'local_size': len(self._local),
+            'local_max': self.local_max,
+            'shared_size': self.shared.size() if self.shared is not None else None,
+            'local_hits': self.local_hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'stale': self.stale,
+            'invalidations': self.invalidations,
+            'errors': self.shared.errors if self.shared is not None else 0,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+# Shared per-process instance
+cache = Cache()
+
+# Writes on other nodes (each node has its own shared tier) arrive via the bus
+bus.subscribe(TAGS, lambda event: cache.invalidate_tags(*event['tags']))
@@ -0,0 +1,50 @@
+"""
+Data Version Service - Monotonic version stamps for cache validation
+A stamp is a single primary-key row, so checking "did anything change?"
+costs one indexed read instead of re-running the real query.
+"""
+import logging
+from datetime import datetime
+from models import get_db
+from services.invalidation_bus import bus, TAGS
+
+logger = logging.getLogger(__name__)
+
+# Stamp bumped by every route that inserts, updates, assigns or deletes projects
+PROJECTS = 'projects'
+
+
+def get_data_version(name=PROJECTS):
+    """
+    Return the current version of a data set (0 if never bumped).
+    """
+    row = get_db().execute(
+        "SELECT version FROM data_versions WHERE name = ?", (name,)
+    ).fetchone()
+    return row['version'] if row else 0
+
+
+def get_data_stamp(name=PROJECTS):
+    """
+    Return (version, updated_at) of a data set ((0, None) if never bumped).
+    """
+    row = get_db().execute(
+        "SELECT version, updated_at FROM data_versions WHERE name = ?", (name,)
+    ).fetchone()
+    return (row['version'], row['updated_at']) if row else (0, None)
+
+
+def bump_data_version(conn, name=PROJECTS):
+    """
+    Increment the version of a data set.
+    Call inside the same transaction as the write it describes; cached
+    lookups tagged with the same name are invalidated on every node once
+    it commits.
+    """
+    conn.execute("""
+        INSERT INTO data_versions (name, version, updated_at)
+        VALUES (?, 1, ?)
+        ON CONFLICT (name) DO UPDATE
+        SET version = data_versions.version + 1, updated_at = excluded.updated_at
+    """, (name, datetime.now().isoformat()))
+    bus.publish(conn, TAGS, tags=[name])
@@ -1,6 +1,7 @@
 import pandas as pd
 import re
 import numpy as np
+from services.timing import timed_function
 
 def clean_text(val):
     """
@@ -22,6 +23,7 @@ def clean_text(val):
     
     return s.strip()
 
+@timed_function('pandas')
 def get_smart_df(path, sheet=None):
     """
     Smart Data Repair Engine
@@ -166,6 +168,7 @@ def sanitize_sheet_name(name):
         
     return s[:31]
 
+@timed_function('pandas')
 def repair_excel(path):
     """
     Attempts to repair an Excel file by reading all data and rebuilding
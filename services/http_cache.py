@@ -0,0 +1,23 @@
+"""
+HTTP Cache Helpers - Conditional GET (ETag / 304) support
+"""
+from flask import Response, make_response, request
+
+
+def conditional_response(etag, build):
+    """
+    Answer a GET with 304 Not Modified if the client already holds etag,
+    otherwise call build() and tag its response.
+
+    build is only called on a miss, so pass the expensive query/serialization
+    as a callable, e.g.:
+        return conditional_response(etag, lambda: jsonify(load_payload()))
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = make_response(build())
+    response.set_etag(etag)
+    # Per-user data: never shared caches, always revalidate
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
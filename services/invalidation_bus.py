@@ -0,0 +1,261 @@
+"""
+Invalidation Bus - Fan out cache/push invalidations to every worker on every node
+Writers publish small events inside their transaction; each worker process
+runs a listener that applies events from other processes to its own caches
+(shared cache tags, user cache, SSE broker). The publishing process applies
+its own events locally after commit.
+
+Backends (INVALIDATION_BUS):
+    postgres - NOTIFY inside the write transaction, LISTEN on a dedicated
+               connection (delivered on commit, typically within milliseconds)
+    sqlite   - rows in invalidation_events, polled every BUS_POLL_SECONDS
+    local    - this process only (single worker)
+Default: postgres when DATABASE_URL points at PostgreSQL, sqlite otherwise.
+"""
+import os
+import json
+import time
+import uuid
+import atexit
+import select
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from database import get_connection, IS_POSTGRES
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_BUS = os.getenv('INVALIDATION_BUS', 'postgres' if IS_POSTGRES else 'sqlite').lower()
+BUS_POLL_SECONDS = float(os.getenv('BUS_POLL_SECONDS', 0.5))
+# SQLite backend: events older than this are deleted (listeners are far behind otherwise)
+BUS_RETENTION_SECONDS = int(os.getenv('BUS_RETENTION_SECONDS', 600))
+
+CHANNEL = 'itrack_invalidate'
+# PostgreSQL caps NOTIFY payloads at 8000 bytes
+MAX_EVENT_BYTES = 7900
+
+# Event kinds
+TAGS = 'tags'                  # {'tags': [...]}      shared cache tags
+USER = 'user'                  # {'user_id': id}      user cache entry (None: lists only)
+NOTIFICATION = 'notification'  # {'user_id', 'id'}    new in-app notification
+UNREAD_COUNT = 'count'         # {'user_id': id}      unread count changed
+
+
+class InvalidationBus:
+    """
+    publish(conn, kind, **data) from writers; subscribe(kind, handler) from
+    the modules that own a cache. Handlers receive the event dict and must
+    only touch process-local state.
+    """
+
+    def __init__(self, backend=INVALIDATION_BUS, poll_seconds=BUS_POLL_SECONDS):
+        self.backend = backend
+        self.poll_seconds = poll_seconds
+        self._origin_pid = None
+        self._handlers = {}
+        self._app = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._atexit_registered = False
+        self.published = 0
+        self.received = 0
+        self.applied_local = 0
+        self.errors = 0
+        self.last_lag_ms = None
+
+    @property
+    def origin(self):
+        """Id stamped on this process's events (new after a fork)."""
+        if self._origin_pid != os.getpid():
+            self._origin = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+            self._origin_pid = os.getpid()
+        return self._origin
+
+    # ----- subscribers -----
+    def subscribe(self, kind, handler):
+        self._handlers.setdefault(kind, []).append(handler)
+
+    def _dispatch(self, event):
+        for handler in self._handlers.get(event.get('kind'), ()):
+            try:
+                handler(event)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"❌ Invalidation handler for {event.get('kind')} failed: {e}")
+
+    # ----- publishers -----
+    def publish(self, conn, kind, **data):
+        """Publish one event as part of conn's unit of work."""
+        self.publish_many(conn, kind, [data])
+
+    def publish_many(self, conn, kind, items):
+        """
+        Publish events of one kind (list of dicts). Inside a transaction() block
+        they are delivered only if it commits; outside one they go out at once.
+        """
+        if not items:
+            return
+        events = [dict(item, kind=kind, origin=self.origin, at=time.time()) for item in items]
+        with conn.transaction():
+            if self.backend in ('postgres', 'sqlite'):
+                messages = []
+                for e in events:
+                    message = json.dumps(e, ensure_ascii=False, default=str)
+                    if len(message.encode()) > MAX_EVENT_BYTES:
+                        # NOTIFY rejects payloads over 8000 bytes, which would fail the write
+                        logger.warning(f"⚠️ Invalidation event '{kind}' too large, applied locally only")
+                        continue
+                    messages.append(message)
+                if self.backend == 'postgres':
+                    conn.executemany("SELECT pg_notify(?, ?)", [(CHANNEL, m) for m in messages])
+                else:
+                    now = datetime.now().isoformat()
+                    conn.executemany(
+                        "INSERT INTO invalidation_events (origin, payload, created_at) VALUES (?, ?, ?)",
+                        [(self.origin, m, now) for m in messages]
+                    )
+            conn.after_commit(lambda: self._apply(events))
+        self.published += len(events)
+
+    def _apply(self, events):
+        for event in events:
+            self.applied_local += 1
+            self._dispatch(event)
+
+    def _receive(self, payloads):
+        """Apply events from other processes (listener thread)."""
+        events = []
+        for payload in payloads:
+            try:
+                event = json.loads(payload)
+            except ValueError:
+                self.errors += 1
+                continue
+            if event.get('origin') == self.origin:
+                continue
+            self.received += 1
+            if event.get('at'):
+                self.last_lag_ms = round((time.time() - event['at']) * 1000, 1)
+            events.append(event)
+        if not events:
+            return
+        # Handlers may need get_db(); the app context closes it afterwards
+        with self._app.app_context():
+            for event in events:
+                self._dispatch(event)
+
+    # ----- listener thread -----
+    def init_app(self, app):
+        self._app = app
+        self.start()
+        # Re-checked per request: a thread started before a fork does not survive it
+        app.before_request(self.start)
+
+    def start(self):
+        if self.backend not in ('postgres', 'sqlite') or self._app is None:
+            return
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            target = self._listen_postgres if self.backend == 'postgres' else self._poll_sqlite
+            self._thread = threading.Thread(target=target, name='invalidation-bus', daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.shutdown)
+                self._atexit_registered = True
+
+    def _listen_postgres(self):
+        while not self._stop.is_set():
+            db = None
+            try:
+                db = get_connection()
+                conn = db.raw_connection
+                conn.autocommit = True
+                conn.cursor().execute(f"LISTEN {CHANNEL}")
+                logger.info(f"📡 Invalidation bus listening on {CHANNEL}")
+                while not self._stop.is_set():
+                    # Wakes as soon as a NOTIFY arrives; the timeout only checks _stop
+                    if select.select([conn], [], [], 5.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    notifies = conn.notifies[:]
+                    del conn.notifies[:]
+                    self._receive([n.payload for n in notifies])
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"⚠️ Invalidation bus connection lost: {e}")
+                # Events published while disconnected are missed; TTLs bound the staleness
+                self._stop.wait(2.0)
+            finally:
+                if db is not None:
+                    try:
+                        db.close()
+                    except Exception:
+                        pass
+
+    def _poll_sqlite(self):
+        conn = None
+        last_seq = None
+        last_prune = 0.0
+        while not self._stop.is_set():
+            try:
+                if conn is None:
+                    conn = get_connection()
+                if last_seq is None:
+                    # Start from "now": earlier events are already reflected in the DB
+                    last_seq = conn.execute(
+                        "SELECT COALESCE(MAX(seq), 0) as seq FROM invalidation_events"
+                    ).fetchone()['seq']
+                rows = conn.execute(
+                    "SELECT seq, origin, payload FROM invalidation_events WHERE seq > ? ORDER BY seq",
+                    (last_seq,)
+                ).fetchall()
+                conn.commit()
+                if rows:
+                    last_seq = rows[-1]['seq']
+                    self._receive([r['payload'] for r in rows if r['origin'] != self.origin])
+                if time.monotonic() - last_prune > 60:
+                    last_prune = time.monotonic()
+                    cutoff = (datetime.now() - timedelta(seconds=BUS_RETENTION_SECONDS)).isoformat()
+                    with conn.transaction():
+                        conn.execute("DELETE FROM invalidation_events WHERE created_at < ?", (cutoff,))
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"⚠️ Invalidation bus poll failed: {e}")
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                conn = None
+            self._stop.wait(self.poll_seconds)
+        if conn is not None:
+            conn.close()
+
+    def shutdown(self, timeout=2.0):
+        self._stop.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            'backend': self.backend,
+            'origin': self.origin,
+            'listening': bool(self._thread and self._thread.is_alive() and self._pid == os.getpid()),
+            'published': self.published,
+            'received': self.received,
+            'applied_local': self.applied_local,
+            'errors': self.errors,
+            'last_lag_ms': self.last_lag_ms,
+        }
+
+
+# Shared per-process bus
+bus = InvalidationBus()
@@ -0,0 +1,422 @@
+"""
+Job Scheduler - Built-in runner for the periodic jobs
+Every worker process runs a ticker thread, but only the elected leader runs
+jobs: a PostgreSQL advisory lock (held by a dedicated connection), or a
+lease row in scheduler_lease on SQLite. Runs are recorded in job_runs,
+which is also how "is this job due?" is decided, so a new leader after a
+failover does not repeat work. The row is written as 'running' when the job
+starts and a heartbeat thread renews it (and the leadership lock) until the
+job returns; a running row whose heartbeat is older than the lease is
+marked 'abandoned' and the job becomes due again.
+
+Schedules (override per job with SCHEDULE_<JOB NAME>, 'off' disables):
+    daily@HH:MM   - once a day at/after local time HH:MM
+    every@SECONDS - at most once per interval
+"""
+import os
+import time
+import uuid
+import atexit
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from database import get_connection, IS_POSTGRES
+
+logger = logging.getLogger(__name__)
+
+# Scheduler settings
+SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', 'true').lower() == 'true'
+SCHEDULER_TICK_SECONDS = float(os.getenv('SCHEDULER_TICK_SECONDS', 30))
+SCHEDULER_LEASE_SECONDS = int(os.getenv('SCHEDULER_LEASE_SECONDS', 120))
+# Lease and running-row renewal while a job runs (several per lease period)
+JOB_HEARTBEAT_SECONDS = max(1.0, SCHEDULER_LEASE_SECONDS / 4)
+
+# Advisory lock key shared by every process talking to the same database
+ADVISORY_LOCK_KEY = 7_310_042
+
+DEFAULT_SCHEDULES = {
+    'check_deadlines': 'daily@08:00',
+    'delete_old_notifications': 'daily@03:30',
+    'send_digests': 'every@3600',
+    'drain_outbox': 'every@300',
+}
+# Archiving deletes rows from the database: only scheduled once durable storage is configured
+if os.getenv('AUDIT_ARCHIVE_DIR'):
+    DEFAULT_SCHEDULES['archive_audit_logs'] = 'daily@03:00'
+
+
+def _job_functions():
+    # Imported lazily: the job modules import models/Flask helpers
+    from notifications.scheduler import notify_deadlines
+    from notifications.notification_service import delete_old_notifications
+    from notifications.digest import send_digests
+    from notifications.outbox import drain_outbox
+    from audit.retention import archive_audit_logs
+    return {
+        'check_deadlines': notify_deadlines,
+        'archive_audit_logs': archive_audit_logs,
+        'delete_old_notifications': delete_old_notifications,
+        'send_digests': send_digests,
+        'drain_outbox': drain_outbox,
+    }
+
+
+def parse_schedule(spec):
+    """
+    'daily@08:00' -> ('daily', (8, 0)); 'every@300' -> ('every', 300);
+    'off' -> None
+    """
+    spec = (spec or '').strip().lower()
+    if not spec or spec == 'off':
+        return None
+    kind, _, value = spec.partition('@')
+    if kind == 'daily':
+        hour, minute = value.split(':')
+        return 'daily', (int(hour), int(minute))
+    if kind == 'every':
+        return 'every', int(value)
+    raise ValueError(f"Invalid schedule: {spec}")
+
+
+def format_schedule(schedule):
+    """Inverse of parse_schedule."""
+    kind, value = schedule
+    if kind == 'daily':
+        return f"daily@{value[0]:02d}:{value[1]:02d}"
+    return f"every@{value}"
+
+
+def load_schedules():
+    """Job name -> parsed schedule, with env overrides applied."""
+    schedules = {}
+    for name, default in DEFAULT_SCHEDULES.items():
+        spec = os.getenv(f'SCHEDULE_{name.upper()}', default)
+        try:
+            parsed = parse_schedule(spec)
+        except ValueError as e:
+            logger.error(f"❌ {e} for job {name}, using {default}")
+            parsed = parse_schedule(default)
+        if parsed:
+            schedules[name] = parsed
+    return schedules
+
+
+def is_due(schedule, last_started, now, running=False):
+    """
+    Whether a job with this schedule and last start time should run now.
+    Never while a run of the same job is still in progress.
+    """
+    if running:
+        return False
+    kind, value = schedule
+    if kind == 'every':
+        return last_started is None or last_started <= now - timedelta(seconds=value)
+    slot = now.replace(hour=value[0], minute=value[1], second=0, microsecond=0)
+    if now < slot:
+        return False
+    return last_started is None or last_started < slot
+
+
+# ---------------------------------------------------------
+# Leader election
+# ---------------------------------------------------------
+class _AdvisoryLock:
+    """PostgreSQL: session-level advisory lock held by a dedicated connection."""
+
+    def __init__(self, key=ADVISORY_LOCK_KEY):
+        self.key = key
+        self._conn = None
+        self.held = False
+
+    def acquire(self):
+        try:
+            if self._conn is None:
+                self._conn = get_connection()
+            if not self.held:
+                row = self._conn.execute(
+                    "SELECT pg_try_advisory_lock(?) AS locked", (self.key,)
+                ).fetchone()
+                self._conn.commit()
+                self.held = bool(row['locked'])
+            else:
+                # Connection still alive means the lock is still ours
+                self._conn.execute("SELECT 1").fetchone()
+                self._conn.commit()
+        except Exception as e:
+            logger.warning(f"⚠️ Scheduler lock connection lost: {e}")
+            self._reset()
+        return self.held
+
+    def release(self):
+        if self._conn is not None and self.held:
+            try:
+                self._conn.execute("SELECT pg_advisory_unlock(?)", (self.key,))
+                self._conn.commit()
+            except Exception:
+                pass
+        self._reset()
+
+    def _reset(self):
+        self.held = False
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+
+
+class _LeaseLock:
+    """SQLite: lease row renewed every tick; taken over once it expires."""
+
+    def __init__(self, lease_seconds=SCHEDULER_LEASE_SECONDS, name='scheduler'):
+        self.lease_seconds = lease_seconds
+        self.name = name
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.held = False
+
+    def acquire(self):
+        now = datetime.now()
+        conn = get_connection()
+        try:
+            with conn.transaction():
+                conn.execute("""
+                    INSERT INTO scheduler_lease (name, holder, expires_at)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT (name) DO UPDATE
+                    SET holder = excluded.holder, expires_at = excluded.expires_at
+                    WHERE scheduler_lease.holder = excluded.holder
+                       OR scheduler_lease.expires_at < ?
+                """, (self.name, self.holder, (now + timedelta(seconds=self.lease_seconds)).isoformat(),
+                      now.isoformat()))
+            row = conn.execute("SELECT holder FROM scheduler_lease WHERE name = ?", (self.name,)).fetchone()
+            self.held = bool(row) and row['holder'] == self.holder
+        except Exception as e:
+            logger.warning(f"⚠️ Scheduler lease check failed: {e}")
+            self.held = False
+        finally:
+            conn.close()
+        return self.held
+
+    def release(self):
+        if not self.held:
+            return
+        conn = get_connection()
+        try:
+            with conn.transaction():
+                conn.execute("DELETE FROM scheduler_lease WHERE name = ? AND holder = ?",
+                             (self.name, self.holder))
+        except Exception:
+            pass
+        finally:
+            conn.close()
+        self.held = False
+
+
+def named_lock(name, key, lease_seconds=SCHEDULER_LEASE_SECONDS):
+    """
+    Cross-process lock for work that must not overlap (e.g. one job run from
+    the scheduler and one from its /cron endpoint): advisory lock `key` on
+    PostgreSQL, lease row `name` on SQLite. acquire() also renews it.
+    """
+    return _AdvisoryLock(key) if IS_POSTGRES else _LeaseLock(lease_seconds, name=name)
+
+
+# ---------------------------------------------------------
+# Run history
+# ---------------------------------------------------------
+def _stale_cutoff(now):
+    return (now - timedelta(seconds=SCHEDULER_LEASE_SECONDS)).isoformat()
+
+
+def abandon_stale_runs(conn, now=None):
+    """Mark 'running' rows whose heartbeat stopped (node died mid-job) as abandoned."""
+    now = now or datetime.now()
+    with conn.transaction():
+        cursor = conn.execute("""
+            UPDATE job_runs SET status = 'abandoned', finished_at = ?
+            WHERE status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)
+        """, (now.isoformat(), _stale_cutoff(now)))
+    return cursor.rowcount or 0
+
+
+def last_run_times(conn):
+    """Job name -> datetime of its most recent start (abandoned runs excluded)."""
+    rows = conn.execute("""
+        SELECT job, MAX(started_at) as last_started FROM job_runs
+        WHERE status <> 'abandoned'
+        GROUP BY job
+    """).fetchall()
+    return {r['job']: datetime.fromisoformat(r['last_started']) for r in rows if r['last_started']}
+
+
+def running_jobs(conn, now=None):
+    """Names of jobs with a live 'running' row (heartbeat within the lease)."""
+    now = now or datetime.now()
+    rows = conn.execute(
+        "SELECT DISTINCT job FROM job_runs WHERE status = 'running' AND heartbeat_at >= ?",
+        (_stale_cutoff(now),)
+    ).fetchall()
+    return {r['job'] for r in rows}
+
+
+def get_job_runs(conn, limit=50, job=None):
+    """Most recent runs first."""
+    query = "SELECT * FROM job_runs"
+    params = []
+    if job:
+        query += " WHERE job = ?"
+        params.append(job)
+    query += " ORDER BY started_at DESC LIMIT ?"
+    params.append(limit)
+    return conn.execute(query, params).fetchall()
+
+
+class JobScheduler:
+    """
+    Ticker thread (one per process); runs due jobs only while it is leader.
+    Jobs run sequentially inside an app context.
+    """
+
+    def __init__(self, tick_seconds=SCHEDULER_TICK_SECONDS):
+        self.tick_seconds = tick_seconds
+        self.schedules = load_schedules()
+        self._app = None
+        self._lock = _AdvisoryLock() if IS_POSTGRES else _LeaseLock()
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._atexit_registered = False
+        self.node = f"{socket.gethostname()}:{os.getpid()}"
+
+    def init_app(self, app):
+        self._app = app
+        if not SCHEDULER_ENABLED:
+            logger.info("⏸️ Built-in scheduler disabled (SCHEDULER_ENABLED=false)")
+            return
+        self.start()
+        # Re-checked per request: a thread started before a fork does not survive it
+        app.before_request(self.start)
+
+    def start(self):
+        if not SCHEDULER_ENABLED or self._app is None:
+            return
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.node = f"{socket.gethostname()}:{os.getpid()}"
+            # Never reuse a lock connection inherited from the parent process
+            self._lock = _AdvisoryLock() if IS_POSTGRES else _LeaseLock()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='job-scheduler', daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.shutdown)
+                self._atexit_registered = True
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self._lock.acquire():
+                    self.run_due_jobs()
+            except Exception as e:
+                logger.error(f"❌ Scheduler tick failed: {e}")
+            self._stop.wait(self.tick_seconds)
+
+    def run_due_jobs(self, now=None):
+        """Run every job whose schedule says it is due (leader only)."""
+        now = now or datetime.now()
+        with self._app.app_context():
+            from models import get_db
+            conn = get_db()
+            abandoned = abandon_stale_runs(conn, now)
+            if abandoned:
+                logger.warning(f"⚠️ Marked {abandoned} stale job run(s) as abandoned")
+            last_runs = last_run_times(conn)
+            running = running_jobs(conn, now)
+        for name, schedule in self.schedules.items():
+            if self._stop.is_set():
+                break
+            if is_due(schedule, last_runs.get(name), now, running=name in running):
+                # Renew leadership before each job; stop if another node took over
+                if not self._lock.acquire():
+                    break
+                self.run_job(name)
+
+    def run_job(self, name):
+        """Run one job now and record it in job_runs. Returns the run row values."""
+        func = _job_functions()[name]
+        started = datetime.now()
+        t0 = time.perf_counter()
+        status, result = 'success', None
+        with self._app.app_context():
+            from models import get_db
+            conn = get_db()
+            # Recorded before the job runs: other nodes see it as started/in progress
+            with conn.transaction():
+                cursor = conn.execute("""
+                    INSERT INTO job_runs (job, started_at, heartbeat_at, status, node)
+                    VALUES (?, ?, ?, 'running', ?)
+                """ + (" RETURNING id" if IS_POSTGRES else ""),
+                    (name, started.isoformat(), started.isoformat(), self.node))
+                run_id = cursor.fetchone()['id'] if IS_POSTGRES else cursor.lastrowid
+            done = threading.Event()
+            heartbeat = threading.Thread(target=self._heartbeat, args=(name, run_id, done),
+                                         name=f'job-heartbeat-{name}', daemon=True)
+            heartbeat.start()
+            try:
+                result = func()
+            except Exception as e:
+                status, result = 'failed', str(e)
+                logger.error(f"❌ Scheduled job {name} failed: {e}")
+            finally:
+                done.set()
+                heartbeat.join(5.0)
+            duration_ms = int((time.perf_counter() - t0) * 1000)
+            with conn.transaction():
+                conn.execute("""
+                    UPDATE job_runs SET finished_at = ?, duration_ms = ?, status = ?, result = ?
+                    WHERE id = ?
+                """, (datetime.now().isoformat(), duration_ms, status,
+                      str(result)[:1000] if result is not None else None, run_id))
+        logger.info(f"🕒 Job {name}: {status} in {duration_ms} ms")
+        return {'job': name, 'status': status, 'duration_ms': duration_ms, 'result': result}
+
+    def _heartbeat(self, name, run_id, done):
+        """While a job runs: keep leadership and the running row fresh."""
+        conn = None
+        while not done.wait(JOB_HEARTBEAT_SECONDS):
+            if not self._lock.acquire():
+                # The job cannot be interrupted; the other leader still sees the running row
+                logger.warning(f"⚠️ Lost scheduler leadership while {name} is running")
+            try:
+                if conn is None:
+                    conn = get_connection()
+                with conn.transaction():
+                    conn.execute("UPDATE job_runs SET heartbeat_at = ? WHERE id = ?",
+                                 (datetime.now().isoformat(), run_id))
+            except Exception as e:
+                logger.warning(f"⚠️ Job heartbeat for {name} failed: {e}")
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                conn = None
+        if conn is not None:
+            conn.close()
+
+    def shutdown(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+        self._lock.release()
+
+
+# Shared per-process scheduler
+job_scheduler = JobScheduler()
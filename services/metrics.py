@@ -0,0 +1,422 @@
+"""
+Metrics - Prometheus text-format metrics served at /metrics
+Each worker process keeps its own counters and histograms in memory, adds the
+stats() counters of the components it runs (caches, email pools, audit
+writer, invalidation bus, DB connections) and writes the lot as one snapshot
+to a SQLite file shared by the workers on the host, every
+METRICS_FLUSH_SECONDS. /metrics merges the snapshots, so whichever worker
+answers a scrape reports totals for all of them:
+    counters / histograms - summed over every worker, including exited ones
+                            (folded into one "retired" row, so totals never drop)
+    gauges                - summed over live workers only
+The file is per host: scrape every node.
+
+/metrics requires METRICS_TOKEN (falls back to CRON_API_KEY) as a bearer
+token or X-API-Key header; with neither configured it answers 404.
+"""
+import os
+import json
+import time
+import uuid
+import atexit
+import bisect
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+from flask import g, request
+from database import DATABASE_URL, SQLITE_PATH, add_query_observer, connection_stats
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+_DB_ID = hashlib.sha1((DATABASE_URL or os.path.abspath(SQLITE_PATH)).encode()).hexdigest()[:12]
+METRICS_PATH = os.getenv('METRICS_PATH', os.path.join(tempfile.gettempdir(), f'itrack-metrics-{_DB_ID}.db'))
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', 5))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+IMPORT_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# name -> (type, help, histogram buckets); also the output order
+METRICS = {
+    'itrack_http_request_duration_seconds': (
+        'histogram', 'Request latency by blueprint and endpoint (until the response is built).', LATENCY_BUCKETS),
+    'itrack_http_requests_total': ('counter', 'Requests by blueprint, endpoint and status.', None),
+    'itrack_db_query_duration_seconds': (
+        'histogram', 'Statements sent through DatabaseWrapper (_count is the query count).', QUERY_BUCKETS),
+    'itrack_db_connections_opened_total': ('counter', 'Database connections opened (no pool: one per request or thread).', None),
+    'itrack_db_connections_open': ('gauge', 'Database connections currently open.', None),
+    'itrack_email_pool_connections_opened_total': ('counter', 'Connections opened by the email transport pools.', None),
+    'itrack_email_pool_idle_connections': ('gauge', 'Idle pooled email connections.', None),
+    'itrack_email_pool_size': ('gauge', 'Maximum concurrent email connections per worker.', None),
+    'itrack_email_api_retries_total': ('counter', 'SendGrid API requests retried (429/5xx/connection errors).', None),
+    'itrack_email_messages_total': ('counter', 'Outbox messages by delivery outcome (sent, retried, dead).', None),
+    'itrack_email_outbox_messages': ('gauge', 'Outbox rows by status (read from the database at scrape time).', None),
+    'itrack_import_rows_total': (
+        'counter', 'Imported spreadsheet rows by result; rows/sec = rate(imported) / rate(duration_sum).', None),
+    'itrack_import_duration_seconds': ('histogram', 'Wall time of spreadsheet imports.', IMPORT_BUCKETS),
+    'itrack_export_bytes_total': ('counter', 'Bytes produced by exports.', None),
+    'itrack_audit_queue_depth': ('gauge', 'Audit records waiting for the background writer.', None),
+    'itrack_audit_records_total': ('counter', 'Audit records by outcome.', None),
+    'itrack_cache_lookups_total': ('counter', 'Cache lookups by result.', None),
+    'itrack_cache_stale_total': ('counter', 'Cached entries dropped because a tag changed.', None),
+    'itrack_cache_hit_ratio': ('gauge', 'Hits / lookups since the workers started.', None),
+    'itrack_invalidation_events_total': ('counter', 'Invalidation bus events published and received.', None),
+}
+
+RETIRED_PID = 0
+
+
+def _key(name, labels):
+    """Snapshot key: JSON of [name, sorted label pairs]."""
+    return json.dumps([name, sorted(labels.items())], ensure_ascii=False)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def merge_snapshots(snapshots, gauges=True):
+    """Sum snapshots: counters, histograms and (optionally) gauges by key."""
+    merged = {'counters': {}, 'histograms': {}, 'gauges': {}}
+    for snap in snapshots:
+        if not snap:
+            continue
+        for kind in ('counters', 'gauges') if gauges else ('counters',):
+            target = merged[kind]
+            for key, value in snap.get(kind, {}).items():
+                target[key] = target.get(key, 0) + value
+        for key, values in snap.get('histograms', {}).items():
+            current = merged['histograms'].get(key)
+            merged['histograms'][key] = list(values) if current is None else [a + b for a, b in zip(current, values)]
+    return merged
+
+
+class Metrics:
+    """
+    Per-process registry plus the shared snapshot file.
+
+        metrics.inc('itrack_export_bytes_total', len(data), export='projects_xlsx')
+        metrics.observe('itrack_import_duration_seconds', seconds, source='quick_import')
+    """
+
+    def __init__(self, enabled=METRICS_ENABLED, path=METRICS_PATH, flush_seconds=METRICS_FLUSH_SECONDS):
+        self.enabled = enabled
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._pid = os.getpid()
+        self._token = uuid.uuid4().hex[:8]
+        self._local = threading.local()
+        self._app = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+        self._atexit_registered = False
+        self.flush_errors = 0
+
+    def _check_fork(self):
+        # A forked worker starts from zero; the parent's numbers are the parent's
+        if self._pid != os.getpid():
+            self._counters = {}
+            self._histograms = {}
+            self._pid = os.getpid()
+            self._token = uuid.uuid4().hex[:8]
+            self._local = threading.local()
+
+    # ----- recording -----
+    def inc(self, name, value=1, **labels):
+        if not self.enabled or not value:
+            return
+        self._check_fork()
+        # Cheap in-memory key; converted to the JSON key at snapshot time
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        self._check_fork()
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(buckets, value)
+        with self._lock:
+            values = self._histograms.get(key)
+            if values is None:
+                # One count per bucket, +Inf, then the sum
+                values = self._histograms[key] = [0] * (len(buckets) + 2)
+            values[index] += 1
+            values[-1] += value
+
+    def observe_import(self, source, imported, rejected, seconds, skipped=0):
+        """Record one spreadsheet import."""
+        self.inc('itrack_import_rows_total', imported, source=source, result='imported')
+        self.inc('itrack_import_rows_total', rejected, source=source, result='rejected')
+        self.inc('itrack_import_rows_total', skipped, source=source, result='skipped')
+        self.observe('itrack_import_duration_seconds', seconds, source=source)
+
+    # ----- snapshots -----
+    def snapshot(self):
+        """This process's metrics (own registry + component stats)."""
+        self._check_fork()
+        with self._lock:
+            snap = {
+                'counters': {_key(name, dict(labels)): v for (name, labels), v in self._counters.items()},
+                'histograms': {_key(name, dict(labels)): list(v) for (name, labels), v in self._histograms.items()},
+                'gauges': {},
+            }
+        try:
+            self._add_component_stats(snap)
+        except Exception as e:
+            logger.warning(f"⚠️ Metrics: component stats failed: {e}")
+        return snap
+
+    @staticmethod
+    def _add_component_stats(snap):
+        from services.cache import cache
+        from services.invalidation_bus import bus
+        from auth.user_cache import user_cache
+        from audit.writer import audit_writer
+        from notifications.email_dispatcher import dispatcher
+        from notifications.email_transport import get_transport, SMTPTransport
+
+        counters, gauges = snap['counters'], snap['gauges']
+
+        def counter(name, value, **labels):
+            counters[_key(name, labels)] = counters.get(_key(name, labels), 0) + value
+
+        def gauge(name, value, **labels):
+            gauges[_key(name, labels)] = value
+
+        counter('itrack_db_connections_opened_total', connection_stats['opened'])
+        gauge('itrack_db_connections_open', connection_stats['opened'] - connection_stats['closed'])
+
+        pool = dispatcher.pool_stats()
+        counter('itrack_email_pool_connections_opened_total', pool['connections_opened'], transport='sendgrid')
+        gauge('itrack_email_pool_idle_connections', pool['idle_connections'], transport='sendgrid')
+        gauge('itrack_email_pool_size', pool['max_in_flight'], transport='sendgrid')
+        counter('itrack_email_api_retries_total', dispatcher.retries)
+        transport = get_transport()
+        if isinstance(transport, SMTPTransport):
+            smtp = transport.stats()
+            counter('itrack_email_pool_connections_opened_total', smtp['connects'], transport='smtp')
+            gauge('itrack_email_pool_idle_connections', smtp['idle_connections'], transport='smtp')
+            gauge('itrack_email_pool_size', smtp['pool_size'], transport='smtp')
+
+        audit = audit_writer.stats()
+        gauge('itrack_audit_queue_depth', audit['queue_depth'])
+        for result in ('written', 'failed', 'rejected', 'rolled_up'):
+            counter('itrack_audit_records_total', audit[result], result=result)
+
+        shared = cache.stats()
+        for result, field in (('local_hit', 'local_hits'), ('shared_hit', 'shared_hits'), ('miss', 'misses')):
+            counter('itrack_cache_lookups_total', shared[field], cache='shared', result=result)
+        counter('itrack_cache_stale_total', shared['stale'], cache='shared')
+        users = user_cache.stats()
+        counter('itrack_cache_lookups_total', users['hits'], cache='user', result='hit')
+        counter('itrack_cache_lookups_total', users['misses'], cache='user', result='miss')
+
+        events = bus.stats()
+        counter('itrack_invalidation_events_total', events['published'], direction='published')
+        counter('itrack_invalidation_events_total', events['received'], direction='received')
+
+    # ----- shared file -----
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=2.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS metric_snapshots (
+                    pid INTEGER NOT NULL,
+                    token TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (pid, token)
+                )
+            """)
+            self._local.conn = conn
+        return conn
+
+    def _alive(self, pid, token):
+        if pid == os.getpid():
+            return token == self._token
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def flush(self):
+        """
+        Write this process's snapshot; fold snapshots of exited workers into
+        the retired row. Returns every snapshot row [(pid, data)] on success.
+        """
+        if not self.enabled:
+            return None
+        snap = self.snapshot()
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("""
+                    INSERT INTO metric_snapshots (pid, token, updated_at, data) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (pid, token) DO UPDATE SET updated_at = excluded.updated_at, data = excluded.data
+                """, (os.getpid(), self._token, time.time(), json.dumps(snap, ensure_ascii=False)))
+                rows = conn.execute("SELECT pid, token, data FROM metric_snapshots").fetchall()
+                retired, live, dead = None, [], []
+                for pid, token, data in rows:
+                    if pid == RETIRED_PID:
+                        retired = json.loads(data)
+                    elif self._alive(pid, token):
+                        live.append((pid, json.loads(data)))
+                    else:
+                        dead.append((pid, token, json.loads(data)))
+                if dead:
+                    retired = merge_snapshots([retired] + [d[2] for d in dead], gauges=False)
+                    conn.execute("""
+                        INSERT INTO metric_snapshots (pid, token, updated_at, data) VALUES (?, 'retired', ?, ?)
+                        ON CONFLICT (pid, token) DO UPDATE SET updated_at = excluded.updated_at, data = excluded.data
+                    """, (RETIRED_PID, time.time(), json.dumps(retired, ensure_ascii=False)))
+                    conn.executemany("DELETE FROM metric_snapshots WHERE pid = ? AND token = ?",
+                                     [(pid, token) for pid, token, _ in dead])
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            self.flush_errors += 1
+            self._local.conn = None
+            logger.warning(f"⚠️ Metrics flush failed: {e}")
+            return None
+        return live + ([(RETIRED_PID, retired)] if retired else [])
+
+    def collect(self):
+        """Merged metrics of every worker on this host (this process only if the file is unusable)."""
+        rows = self.flush()
+        if rows is None:
+            return merge_snapshots([self.snapshot()])
+        # The retired row carries no gauges, so this sums gauges over live workers only
+        return merge_snapshots(data for _, data in rows)
+
+    # ----- exposition -----
+    def render(self, extra_gauges=None):
+        """
+        Prometheus text format (0.0.4).
+        extra_gauges: {name: [(labels dict, value)]} computed by the caller at scrape time.
+        """
+        merged = self.collect()
+        samples = {}
+        for kind in ('counters', 'gauges', 'histograms'):
+            for key, value in merged[kind].items():
+                name, pairs = json.loads(key)
+                samples.setdefault(name, []).append((pairs, value))
+        for name, entries in (extra_gauges or {}).items():
+            samples.setdefault(name, []).extend((sorted(labels.items()), value) for labels, value in entries)
+
+        # Derived: hit ratio per cache from the summed lookup counters
+        hits, lookups = {}, {}
+        for pairs, value in samples.get('itrack_cache_lookups_total', []):
+            labels = dict(pairs)
+            lookups[labels['cache']] = lookups.get(labels['cache'], 0) + value
+            if labels['result'] != 'miss':
+                hits[labels['cache']] = hits.get(labels['cache'], 0) + value
+        samples['itrack_cache_hit_ratio'] = [
+            ([('cache', name)], round(hits.get(name, 0) / total, 4)) for name, total in lookups.items() if total
+        ]
+
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            entries = samples.get(name)
+            if not entries:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for pairs, value in sorted(entries, key=lambda e: e[0]):
+                pairs = [tuple(p) for p in pairs]
+                if kind != 'histogram':
+                    lines.append(f"{name}{_format_labels(pairs)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + (float('inf'),), value[:-1]):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else _format_value(float(bound))
+                    lines.append(f"{name}_bucket{_format_labels(pairs + [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(pairs)} {_format_value(round(value[-1], 6))}")
+                lines.append(f"{name}_count{_format_labels(pairs)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+    # ----- Flask hooks / flush thread -----
+    def init_app(self, app):
+        if not self.enabled:
+            return
+        self._app = app
+        # First before_request hook, so the latency covers the other hooks too
+        app.before_request_funcs.setdefault(None, []).insert(0, self._start_request)
+        app.before_request(self.start)
+        app.after_request(self._finish_request)
+        add_query_observer(lambda seconds: self.observe('itrack_db_query_duration_seconds', seconds))
+
+    def _start_request(self):
+        g._metrics_start = time.perf_counter()
+
+    def _finish_request(self, response):
+        start = g.pop('_metrics_start', None)
+        if start is not None:
+            blueprint = request.blueprint or 'app'
+            # Unmatched URLs share one label value so 404 scans can't blow up the series count
+            endpoint = request.endpoint or 'unmatched'
+            self.observe('itrack_http_request_duration_seconds', time.perf_counter() - start,
+                         blueprint=blueprint, endpoint=endpoint)
+            self.inc('itrack_http_requests_total', blueprint=blueprint, endpoint=endpoint,
+                     status=str(response.status_code))
+        return response
+
+    def start(self):
+        # Checked per process: a thread started before a fork does not survive it
+        if self._thread is not None and self._thread.is_alive() and self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='metrics-flush', daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.shutdown)
+                self._atexit_registered = True
+
+    def _run(self):
+        while not self._stop.wait(self.flush_seconds):
+            self.flush()
+
+    def shutdown(self, timeout=2.0):
+        # Final snapshot, so an exiting worker's counts survive it
+        self._stop.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+        self.flush()
+
+
+# Shared per-process registry
+metrics = Metrics()
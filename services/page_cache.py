@@ -0,0 +1,51 @@
+"""
+Page Cache - Cached page data + conditional GET for the manager pages
+The expensive part of a page (queries and aggregation) is cached per
+(route, filter args, role, data version, day). The template is still
+rendered per request, so CSRF tokens, flashed messages and the user's
+name are never shared between users.
+"""
+import os
+import time
+import hashlib
+from datetime import date, datetime
+from flask import Response, current_app, make_response, render_template, request, session
+from flask_login import current_user
+from services.cache import cache, PROJECTS
+from services.data_version import get_data_stamp
+
+# Seconds a page context stays cached (a project write evicts it sooner)
+PAGE_CACHE_TTL = int(os.getenv('PAGE_CACHE_TTL', 600))
+
+
+def cached_page(name, template, build_context, extra=None):
+    """
+    Render template with the cached result of build_context() (a dict that
+    must be JSON-serializable) plus extra per-request values.
+
+    Answers 304 when the browser's ETag still matches: same page data, same
+    user, and a CSRF token in its copy that has not expired yet.
+    """
+    version, updated_at = get_data_stamp()
+    args = hashlib.sha1(repr(sorted(request.args.items(multi=True))).encode()).hexdigest()[:12]
+    # Day is part of the key: days-left counters change at midnight
+    key = f"page:{name}:{current_user.role}:{version}:{date.today().isoformat()}:{args}"
+
+    csrf_limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    token_window = int(time.time() // (csrf_limit / 2)) if csrf_limit else 0
+    etag = hashlib.sha1(f"{key}|{current_user.id}|{token_window}".encode()).hexdigest()[:20]
+
+    # Pending flash messages have to be rendered, so never 304 then.
+    # If-Modified-Since alone is not trusted: the page also varies per user.
+    if '_flashes' not in session and request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        context = cache.get_or_set(key, build_context, ttl=PAGE_CACHE_TTL, tags=[PROJECTS])
+        response = make_response(render_template(template, **context, **(extra or {})))
+    response.set_etag(etag)
+    if updated_at:
+        # Stamps are naive local time; Werkzeug would read a naive value as UTC
+        response.last_modified = datetime.fromisoformat(updated_at).astimezone()
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
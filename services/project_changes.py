@@ -0,0 +1,120 @@
+"""
+Project Change Feed - Ordered log of every write to research_projects
+Each insert, update, delete, assignment and progress update adds rows to
+project_changes in the same transaction, numbered by a monotonic seq.
+Clients catch up with "everything after seq N" (get_changes_since, served
+by the incremental sync API) instead of refetching all projects.
+
+record_project_change() is the single hook for project writes: it logs the
+change, bumps the data version (which also invalidates cached lookups and
+pages) and keeps the notification schedule in step.
+"""
+import json
+import logging
+from datetime import datetime
+from flask_login import current_user
+from database import IS_POSTGRES
+from services.data_version import bump_data_version
+from notifications.deadline_schedule import rebuild_schedule, clear_schedule, ID_CHUNK
+
+logger = logging.getLogger(__name__)
+
+# Operations
+INSERT = 'insert'
+UPDATE = 'update'
+DELETE = 'delete'
+ASSIGN = 'assign'
+PROGRESS = 'progress'
+CLEAR = 'clear'   # every project deleted (project_id is NULL)
+
+# Writers take this transaction-scoped lock on PostgreSQL so rows become
+# visible in seq order (SERIAL values are handed out before commit)
+FEED_LOCK_KEY = 7_310_047
+
+MAX_CHANGES_PER_PAGE = 1000
+
+
+def record_project_change(conn, op, project_ids=None, fields=None, reschedule=True):
+    """
+    Log a change to one or more projects (call inside the write's transaction).
+
+    Args:
+        op: INSERT, UPDATE, DELETE, ASSIGN, PROGRESS or CLEAR
+        project_ids: ids affected (ignored for CLEAR)
+        fields: dict of changed columns, stored with every row
+        reschedule: keep notification_schedule in step (off for progress
+                    updates, which never change deadlines or recipients)
+    """
+    if IS_POSTGRES:
+        conn.execute("SELECT pg_advisory_xact_lock(?)", (FEED_LOCK_KEY,))
+    now = datetime.now().isoformat()
+    user_id = current_user.id if current_user and current_user.is_authenticated else None
+    payload = json.dumps(fields, ensure_ascii=False, default=str) if fields else None
+
+    ids = [None] if op == CLEAR else list(project_ids or [])
+    if ids:
+        conn.executemany("""
+            INSERT INTO project_changes (project_id, op, fields, changed_at, changed_by)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(pid, op, payload, now, user_id) for pid in ids])
+    bump_data_version(conn)
+
+    if reschedule:
+        today = datetime.today().date()
+        if op == CLEAR:
+            clear_schedule(conn)
+        elif op == DELETE:
+            clear_schedule(conn, ids)
+        elif ids:
+            rebuild_schedule(conn, today, ids)
+
+
+def get_changes_since(conn, since, limit=MAX_CHANGES_PER_PAGE):
+    """
+    Compact delta after seq `since`: changes are collapsed per project, so a
+    client gets each project's current row once (or its id if deleted).
+
+    Returns:
+        dict: {'since', 'next', 'has_more', 'reset', 'upserts': [rows], 'deletes': [ids]}
+        Pass 'next' as `since` on the following call. 'reset' means every
+        project was deleted first - drop local copies before applying.
+    """
+    limit = max(1, min(limit, MAX_CHANGES_PER_PAGE))
+    rows = conn.execute("""
+        SELECT seq, project_id, op FROM project_changes
+        WHERE seq > ? ORDER BY seq LIMIT ?
+    """, (since, limit + 1)).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    last_op = {}
+    reset = False
+    for r in rows:
+        if r['op'] == CLEAR:
+            last_op.clear()
+            reset = True
+        else:
+            last_op[r['project_id']] = r['op']
+
+    deletes = sorted(pid for pid, op in last_op.items() if op == DELETE)
+    live = [pid for pid, op in last_op.items() if op != DELETE]
+    upserts = []
+    if live:
+        for offset in range(0, len(live), ID_CHUNK):
+            chunk = live[offset:offset + ID_CHUNK]
+            upserts.extend(dict(p) for p in conn.execute(f"""
+                SELECT * FROM research_projects WHERE id IN ({','.join('?' * len(chunk))})
+            """, chunk).fetchall())
+        upserts.sort(key=lambda p: p['id'])
+        # Deleted by a later change that is beyond this page
+        missing = set(live) - {p['id'] for p in upserts}
+        deletes = sorted(set(deletes) | missing)
+
+    return {
+        'since': since,
+        'next': rows[-1]['seq'] if rows else since,
+        'has_more': has_more,
+        'reset': reset,
+        'upserts': upserts,
+        'deletes': deletes,
+    }
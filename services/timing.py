@@ -0,0 +1,154 @@
+"""
+Request Timing - Where the time goes inside one request
+Splits each request into auth (user loader), db (every statement sent through
+DatabaseWrapper), template (render_template), pandas (spreadsheet parsing and
+writing) and http (outbound email API / SMTP calls), then reports it as a
+Server-Timing header (browser dev tools → Network → Timing) and one JSON log
+line per request.
+
+Off unless REQUEST_TIMING=true. When off, no hooks are installed, decorated
+functions are returned unchanged and timed() hands back a shared no-op.
+Categories may overlap (auth includes the db time of the user lookup).
+"""
+import os
+import json
+import time
+import logging
+import threading
+import functools
+from contextlib import nullcontext
+from database import add_query_observer
+
+logger = logging.getLogger(__name__)
+
+REQUEST_TIMING = os.getenv('REQUEST_TIMING', 'false').lower() == 'true'
+# Only log requests at least this slow (0 = every request); the header is always sent
+REQUEST_TIMING_LOG_MS = float(os.getenv('REQUEST_TIMING_LOG_MS', 0))
+
+CATEGORIES = ('auth', 'db', 'template', 'pandas', 'http')
+
+# Per-thread totals of the request being served: {category: [seconds, count]}
+_local = threading.local()
+_NOOP = nullcontext()
+
+
+def record(category, seconds):
+    """Add time to the current request (ignored outside a timed request)."""
+    totals = getattr(_local, 'totals', None)
+    if totals is None:
+        return
+    entry = totals.get(category)
+    if entry is None:
+        totals[category] = [seconds, 1]
+    else:
+        entry[0] += seconds
+        entry[1] += 1
+
+
+class _Timer:
+    __slots__ = ('category', 'start')
+
+    def __init__(self, category):
+        self.category = category
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.category, time.perf_counter() - self.start)
+
+
+def timed(category):
+    """Context manager: with timed('pandas'): df = pd.read_excel(...)"""
+    if not REQUEST_TIMING:
+        return _NOOP
+    return _Timer(category)
+
+
+def timed_function(category):
+    """Decorator form of timed(); a no-op (original function) when disabled."""
+    def decorator(func):
+        if not REQUEST_TIMING:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Timer(category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ---------------------------------------------------------
+# Flask hooks
+# ---------------------------------------------------------
+
+def _start_request():
+    _local.totals = {}
+    _local.templates = []
+    _local.start = time.perf_counter()
+
+
+def _before_template(sender, template, context, **extra):
+    templates = getattr(_local, 'templates', None)
+    if templates is not None:
+        templates.append(time.perf_counter())
+
+
+def _after_template(sender, template, context, **extra):
+    templates = getattr(_local, 'templates', None)
+    if templates:
+        record('template', time.perf_counter() - templates.pop())
+
+
+def _finish_request(response):
+    from flask import request
+
+    totals = getattr(_local, 'totals', None)
+    if totals is None:
+        return response
+    total_ms = (time.perf_counter() - _local.start) * 1000
+
+    metrics = []
+    for category in CATEGORIES:
+        if category in totals:
+            seconds, count = totals[category]
+            metrics.append(f'{category};dur={seconds * 1000:.2f};desc="{count}x"')
+    metrics.append(f'total;dur={total_ms:.1f}')
+    response.headers['Server-Timing'] = ', '.join(metrics)
+
+    if total_ms >= REQUEST_TIMING_LOG_MS:
+        entry = {
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'total_ms': round(total_ms, 1),
+        }
+        for category, (seconds, count) in totals.items():
+            entry[f'{category}_ms'] = round(seconds * 1000, 2)
+            entry[f'{category}_count'] = count
+        logger.info(f"⏱️ {json.dumps(entry, ensure_ascii=False)}")
+    return response
+
+
+def _end_request(exception=None):
+    _local.totals = None
+    _local.templates = None
+
+
+def init_app(app):
+    """Install the hooks (only when REQUEST_TIMING is on)."""
+    if not REQUEST_TIMING:
+        return
+    from flask import before_render_template, template_rendered
+
+    # First before_request hook, so the total covers the other hooks too
+    app.before_request_funcs.setdefault(None, []).insert(0, _start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_end_request)
+    add_query_observer(lambda seconds: record('db', seconds))
+    before_render_template.connect(_before_template, app)
+    template_rendered.connect(_after_template, app)
+    logger.info("⏱️ Request timing enabled (Server-Timing header + log line)")
@@ -10,14 +10,20 @@ document.addEventListener('DOMContentLoaded', function () {
 
     if (!notifCount || !notifList) return;
 
-    // Fetch notification count on load
-    fetchNotificationCount();
+    // Polling interval used only when the push stream is unavailable
+    const POLL_INTERVAL = 60000;
+    // Consecutive stream errors tolerated before falling back to polling
+    const MAX_STREAM_FAILURES = 3;
+    let pollTimer = null;
+    // Last ETags seen, sent back as If-None-Match so unchanged data costs a 304
+    const etags = {};
 
-    // Refresh count every 30 seconds
-    setInterval(fetchNotificationCount, 30000);
+    const notifDropdown = document.getElementById('notifDropdown');
+
+    // Receive count/notification events via push, poll only as a fallback
+    startPush();
 
     // Load notifications when dropdown is opened
-    const notifDropdown = document.getElementById('notifDropdown');
     if (notifDropdown) {
         notifDropdown.addEventListener('click', function () {
             fetchNotifications();
@@ -33,14 +39,76 @@ document.addEventListener('DOMContentLoaded', function () {
         });
     }
 
+    /**
+     * Open the Server-Sent Events stream for live updates
+     */
+    function startPush() {
+        if (!window.EventSource) {
+            startPolling();
+            return;
+        }
+
+        const source = new EventSource('/notifications/stream');
+        let failures = 0;
+
+        source.onopen = function () {
+            failures = 0;
+        };
+
+        source.addEventListener('count', function (e) {
+            updateBadge(JSON.parse(e.data).count);
+        });
+
+        source.addEventListener('notification', function () {
+            // Refresh the list only if the user is looking at it
+            if (notifDropdown && notifDropdown.getAttribute('aria-expanded') === 'true') {
+                fetchNotifications();
+            }
+        });
+
+        source.onerror = function () {
+            failures++;
+            // CLOSED means the server refused the stream (e.g. push disabled)
+            if (source.readyState === EventSource.CLOSED || failures >= MAX_STREAM_FAILURES) {
+                source.close();
+                startPolling();
+            }
+        };
+    }
+
+    /**
+     * Fallback: poll the unread count
+     */
+    function startPolling() {
+        if (pollTimer) return;
+        fetchNotificationCount();
+        pollTimer = setInterval(fetchNotificationCount, POLL_INTERVAL);
+    }
+
+    /**
+     * Conditional GET: resolves to parsed JSON, or null on 304 Not Modified
+     */
+    function fetchIfChanged(url) {
+        const headers = {};
+        if (etags[url]) {
+            headers['If-None-Match'] = etags[url];
+        }
+        return fetch(url, { headers: headers, cache: 'no-store' })
+            .then(response => {
+                if (response.status === 304) return null;
+                const etag = response.headers.get('ETag');
+                if (etag) etags[url] = etag;
+                return response.json();
+            });
+    }
+
     /**
      * Fetch unread notification count
      */
     function fetchNotificationCount() {
-        fetch('/notifications/api/count')
-            .then(response => response.json())
+        fetchIfChanged('/notifications/api/count')
             .then(data => {
-                if (data.success) {
+                if (data && data.success) {
                     updateBadge(data.count);
                 }
             })
@@ -51,10 +119,9 @@ document.addEventListener('DOMContentLoaded', function () {
      * Fetch notification list
      */
     function fetchNotifications() {
-        fetch('/notifications/api/list')
-            .then(response => response.json())
+        fetchIfChanged('/notifications/api/list')
             .then(data => {
-                if (data.success) {
+                if (data && data.success) {
                     renderNotifications(data.notifications);
                 }
             })
@@ -0,0 +1,44 @@
+"""
+Shared fixtures: a throwaway SQLite database per test and a bare Flask app
+(no blueprints or background workers) to provide get_db()'s app context.
+
+Run from the project root:  python -m pytest -q tests
+"""
+import os
+import sys
+import tempfile
+
+# Settings are read at import time, so they are set before any app module loads
+_TMP = tempfile.mkdtemp(prefix='itrack-tests-')
+os.environ.pop('DATABASE_URL', None)
+os.environ['SQLITE_PATH'] = os.path.join(_TMP, 'unused.db')
+os.environ['SCHEDULER_ENABLED'] = 'false'
+os.environ['OUTBOX_WORKER_ENABLED'] = 'false'
+os.environ['INVALIDATION_BUS'] = 'local'
+os.environ['METRICS_ENABLED'] = 'false'
+os.environ['EMAIL_TRANSPORT'] = 'memory'
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from flask import Flask
+
+import database
+import models
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """App context on a fresh database with every table created."""
+    monkeypatch.setattr(database, 'SQLITE_PATH', str(tmp_path / 'test.db'))
+    app = Flask(__name__)
+    app.config['MAIL_SENDER'] = 'noreply@itrack.test'
+    app.teardown_appcontext(models.close_db)
+    with app.app_context():
+        models.init_db()
+        yield app
+
+
+@pytest.fixture
+def db(app):
+    return models.get_db()
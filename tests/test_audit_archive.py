@@ -0,0 +1,103 @@
+"""Audit retention: archive segments, manifest round trip and archive search."""
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from audit import retention
+
+
+def _insert_logs(db, ages_in_days, action='PROJECT_UPDATED'):
+    now = datetime.now()
+    with db.transaction():
+        for age in ages_in_days:
+            db.execute("""
+                INSERT INTO audit_logs (timestamp, user_id, username, action, target_type, target_id, details, ip_address)
+                VALUES (?, 1, 'admin', ?, 'project', ?, ?, '127.0.0.1')
+            """, ((now - timedelta(days=age)).isoformat(), action, age, f'age {age}'))
+
+
+def _hot_ids(db):
+    return sorted(r['id'] for r in db.execute("SELECT id FROM audit_logs"))
+
+
+@pytest.fixture
+def archive_dir(tmp_path, monkeypatch):
+    path = str(tmp_path / 'archive')
+    monkeypatch.setattr(retention, 'AUDIT_ARCHIVE_DIR', path)
+    return path
+
+
+def test_archive_round_trip(db, archive_dir):
+    _insert_logs(db, [400, 390, 200, 95, 40, 1])
+    before = {r['id']: dict(r) for r in db.execute("SELECT * FROM audit_logs")}
+
+    result = retention.archive_audit_logs(retention_days=90, batch_size=2)
+
+    assert result['archived'] == 4
+    assert [before[i]['target_id'] for i in _hot_ids(db)] == [40, 1]
+
+    manifest = retention.load_manifest(archive_dir)
+    assert len(manifest['segments']) == result['segments']
+    assert sum(s['rows'] for s in manifest['segments']) == 4
+    for entry in manifest['segments']:
+        with gzip.open(os.path.join(archive_dir, entry['file']), 'rt', encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f]
+        assert [r['id'] for r in rows] == list(range(entry['min_id'], entry['max_id'] + 1))
+        assert all(entry['month'] == r['timestamp'][:7] for r in rows)
+
+    # Every archived row comes back unchanged, newest first
+    archived = retention.search_archived_logs(limit=10)
+    assert [r['target_id'] for r in archived] == [95, 200, 390, 400]
+    for row in archived:
+        assert row == {k: before[row['id']][k] for k in row}
+
+    assert retention.search_archived_logs(limit=1) == archived[:1]
+    assert retention.search_archived_logs(target_id=390) == [archived[2]]
+    assert retention.search_archived_logs(action='LOGIN_SUCCESS') == []
+
+
+def test_rearchiving_after_an_interrupted_batch_keeps_rows_once(db, archive_dir):
+    _insert_logs(db, [300, 200])
+    rows = [dict(r) for r in db.execute("SELECT * FROM audit_logs")]
+    retention.archive_audit_logs(retention_days=90)
+
+    # Crash between the manifest save and the DELETE: the rows are still in the table
+    with db.transaction():
+        for row in rows:
+            db.execute("""
+                INSERT INTO audit_logs (id, timestamp, user_id, username, action, target_type, target_id, details, ip_address)
+                VALUES (:id, :timestamp, :user_id, :username, :action, :target_type, :target_id, :details, :ip_address)
+            """, row)
+    retention.archive_audit_logs(retention_days=90)
+
+    assert _hot_ids(db) == []
+    assert len(retention.load_manifest(archive_dir)['segments']) == 4
+    assert sorted(r['id'] for r in retention.search_archived_logs()) == sorted(r['id'] for r in rows)
+
+
+def test_overlapping_run_is_skipped(db, archive_dir):
+    _insert_logs(db, [300])
+    os.makedirs(archive_dir, exist_ok=True)
+    held = retention._try_file_lock(archive_dir)
+    try:
+        result = retention.archive_audit_logs(retention_days=90)
+    finally:
+        held.close()
+
+    assert result == {'archived': 0, 'segments': 0, 'skipped': 'locked'}
+    assert len(_hot_ids(db)) == 1
+    assert retention.archive_audit_logs(retention_days=90)['archived'] == 1
+
+
+def test_nothing_is_archived_without_an_archive_dir(db, monkeypatch):
+    monkeypatch.setattr(retention, 'AUDIT_ARCHIVE_DIR', None)
+    _insert_logs(db, [400, 300])
+
+    result = retention.archive_audit_logs(retention_days=90)
+
+    assert result == {'archived': 0, 'segments': 0, 'skipped': 'not_configured'}
+    assert len(_hot_ids(db)) == 2
+    assert retention.search_archived_logs() == []
@@ -0,0 +1,56 @@
+"""Audit explorer: keyset pages that continue from the table into the archive."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from audit import retention
+from audit.service import query_audit_logs, reaches_archive
+
+
+def _insert_logs(db, ages_in_days):
+    now = datetime.now()
+    with db.transaction():
+        for age in ages_in_days:
+            db.execute("""
+                INSERT INTO audit_logs (timestamp, user_id, username, action, target_type, target_id, details, ip_address)
+                VALUES (?, 1, 'admin', 'PROJECT_UPDATED', 'project', ?, ?, '127.0.0.1')
+            """, ((now - timedelta(days=age)).isoformat(), age, f'age {age}'))
+
+
+@pytest.fixture
+def archive_dir(tmp_path, monkeypatch):
+    path = str(tmp_path / 'archive')
+    monkeypatch.setattr(retention, 'AUDIT_ARCHIVE_DIR', path)
+    return path
+
+
+def test_explorer_pages_continue_into_the_archive(db, archive_dir, monkeypatch):
+    monkeypatch.setattr(retention, 'AUDIT_RETENTION_DAYS', 90)
+    _insert_logs(db, [400, 300, 200, 100, 50, 10, 5])
+    retention.archive_audit_logs()
+
+    pages, cursor = [], None
+    while True:
+        rows, cursor = query_audit_logs({}, cursor=cursor, limit=3, include_archived=True)
+        pages.append([(r['target_id'], bool(dict(r).get('archived'))) for r in rows])
+        if not cursor:
+            break
+
+    assert pages == [
+        [(5, False), (10, False), (50, False)],
+        [(100, True), (200, True), (300, True)],
+        [(400, True)],
+    ]
+    # Without the flag (or with a start date inside the retention window) only the table is read
+    assert len(query_audit_logs({}, limit=10)[0]) == 3
+    start = (datetime.now() - timedelta(days=30)).isoformat()
+    assert len(query_audit_logs({'start': start}, limit=10, include_archived=True)[0]) == 2
+
+
+def test_explorer_stays_on_the_table_without_an_archive(db, monkeypatch):
+    monkeypatch.setattr(retention, 'AUDIT_ARCHIVE_DIR', None)
+    _insert_logs(db, [400, 5])
+
+    assert not reaches_archive({})
+    rows, cursor = query_audit_logs({}, limit=10, include_archived=True)
+    assert [r['target_id'] for r in rows] == [5, 400] and cursor is None
@@ -0,0 +1,68 @@
+"""Write-behind audit writer: batches, roll-up counters and the shutdown flush."""
+import time
+
+import pytest
+
+from audit.writer import AuditWriter
+
+
+def _record(i, action='PROJECT_UPDATED'):
+    return ('2026-01-01T10:00:00', 1, 'admin', action, 'project', i, None, '127.0.0.1')
+
+
+@pytest.fixture
+def writer(app):
+    # Counters only flush on shutdown within a test
+    writer = AuditWriter(batch_size=10, flush_interval=0.05, counter_interval=3600)
+    yield writer
+    writer.shutdown()
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return predicate()
+
+
+def test_background_thread_writes_batches(db, writer):
+    for i in range(25):
+        assert writer.submit(_record(i))
+
+    assert _wait_for(lambda: writer.written == 25)
+    assert db.execute("SELECT COUNT(*) as n FROM audit_logs").fetchone()['n'] == 25
+    assert writer.batches >= 3 and writer.failed == 0
+
+
+def test_shutdown_persists_queue_and_counters(db, writer):
+    # Let the flusher open its connection first: shutdown must not reuse it from this thread
+    writer.submit(_record(0))
+    assert _wait_for(lambda: writer.written == 1)
+
+    writer.count('2026-01-01', 1, 'admin', 'VIEW_REPORT', '2026-01-01T10:00:00')
+    writer.count('2026-01-01', 1, 'admin', 'VIEW_REPORT', '2026-01-01T11:00:00')
+    writer.count('2026-01-01', None, None, 'EXPORT_DATA', '2026-01-01T12:00:00')
+    for i in range(1, 6):
+        writer.submit(_record(i))
+    writer.shutdown()
+
+    assert writer.stats()['pending_counters'] == 0 and writer.depth() == 0 and writer.failed == 0
+    assert db.execute("SELECT COUNT(*) as n FROM audit_logs").fetchone()['n'] == 6
+    counters = {(r['user_id'], r['action']): (r['count'], r['last_seen'])
+                for r in db.execute("SELECT * FROM audit_counters")}
+    assert counters == {
+        (1, 'VIEW_REPORT'): (2, '2026-01-01T11:00:00'),
+        (0, 'EXPORT_DATA'): (1, '2026-01-01T12:00:00'),
+    }
+
+
+def test_flush_from_another_thread_uses_its_own_connection(db, writer):
+    writer.submit(_record(0))
+    assert _wait_for(lambda: writer.written == 1)
+
+    # Queued while the flusher is busy elsewhere, flushed from the request thread
+    writer.count('2026-01-01', 1, 'admin', 'VIEW_REPORT', '2026-01-01T10:00:00')
+    writer.flush()
+
+    assert writer.counter_rows == 1 and writer.failed == 0
+    assert db.execute("SELECT count FROM audit_counters").fetchone()['count'] == 1
@@ -0,0 +1,80 @@
+"""Two-tier cache: per-process LRU in front of a shared SQLite file."""
+import pytest
+
+from services.cache import Cache
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'cache.db')
+
+
+def test_second_worker_reads_through_the_shared_tier(path):
+    worker_a, worker_b = Cache(path=path), Cache(path=path)
+    calls = []
+
+    def load():
+        calls.append(1)
+        return {'affiliations': ['คณะวิทยาศาสตร์', 'Engineering']}
+
+    value = worker_a.get_or_set('affiliations', load, tags=['projects'])
+    assert worker_b.get_or_set('affiliations', load, tags=['projects']) == value
+    assert worker_b.get_or_set('affiliations', load, tags=['projects']) == value
+
+    assert len(calls) == 1
+    assert worker_b.shared_hits == 1 and worker_b.local_hits == 1
+
+
+def test_invalidating_a_tag_is_seen_by_every_worker(path):
+    worker_a, worker_b = Cache(path=path), Cache(path=path)
+    worker_a.set('years', [2025], tags=['projects'])
+    worker_a.set('users', ['admin'], tags=['users'])
+    assert worker_b.get('years') == [2025]
+
+    worker_a.invalidate_tags('projects')
+
+    # worker_b still holds 'years' locally, but the tag version moved on
+    assert worker_b.get('years') is None
+    assert worker_a.get('years') is None
+    assert worker_b.get('users') == ['admin']
+    # Stale in its LRU and in the shared file
+    assert worker_b.stale == 2
+
+
+def test_value_loaded_during_a_write_is_stored_already_stale(path):
+    cache = Cache(path=path)
+
+    def load():
+        # A write commits while the loader runs
+        cache.invalidate_tags('projects')
+        return 'old'
+
+    assert cache.get_or_set('k', load, tags=['projects']) == 'old'
+    assert cache.get('k') is None
+
+
+def test_entries_expire_and_the_lru_is_bounded(path):
+    cache = Cache(path=path, local_max=2)
+    cache.set('expired', 1, ttl=-1)
+    assert cache.get('expired') is None
+
+    for key in ('a', 'b', 'c'):
+        cache.set(key, key)
+    assert list(cache._local) == ['b', 'c']
+    # Evicted locally, still served by the shared tier
+    assert cache.get('a') == 'a'
+    assert cache.shared_hits == 1
+
+
+def test_local_and_disabled_backends(path):
+    local = Cache(backend='local')
+    local.set('k', 'v', tags=['projects'])
+    assert local.get('k') == 'v'
+    local.invalidate_tags('projects')
+    assert local.get('k') is None
+
+    disabled = Cache(backend='none')
+    calls = []
+    for _ in range(2):
+        disabled.get_or_set('k', lambda: calls.append(1))
+    assert len(calls) == 2
@@ -0,0 +1,80 @@
+"""Invalidation bus: events follow the transaction and reach other workers."""
+import threading
+
+import pytest
+
+from services import invalidation_bus
+from services.invalidation_bus import InvalidationBus, TAGS, USER
+
+
+def _recorder(bus, kind):
+    seen = []
+    bus.subscribe(kind, seen.append)
+    return seen
+
+
+def _stored(db):
+    return db.execute("SELECT COUNT(*) as n FROM invalidation_events").fetchone()['n']
+
+
+@pytest.mark.parametrize('backend', ['local', 'sqlite'])
+def test_events_are_applied_only_after_commit(db, backend):
+    bus = InvalidationBus(backend=backend)
+    seen = _recorder(bus, TAGS)
+
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            bus.publish(db, TAGS, tags=['projects'])
+            raise RuntimeError
+    assert seen == [] and _stored(db) == 0
+
+    with db.transaction():
+        bus.publish(db, TAGS, tags=['projects'])
+        assert seen == []
+    assert [e['tags'] for e in seen] == [['projects']]
+    assert _stored(db) == (1 if backend == 'sqlite' else 0)
+
+
+def test_sqlite_listener_applies_events_from_other_workers(app, db):
+    publisher = InvalidationBus(backend='sqlite')
+    listener = InvalidationBus(backend='sqlite', poll_seconds=0.01)
+    received = []
+    arrived = {0: threading.Event(), 2: threading.Event()}
+
+    def on_user(event):
+        received.append(event['user_id'])
+        if event['user_id'] in arrived:
+            arrived[event['user_id']].set()
+
+    listener.subscribe(USER, on_user)
+    listener.init_app(app)
+    try:
+        # The listener starts from the newest row it sees, so ping until it is polling
+        for _ in range(100):
+            with db.transaction():
+                publisher.publish(db, USER, user_id=0)
+            if arrived[0].wait(0.05):
+                break
+        received.clear()
+
+        with db.transaction():
+            publisher.publish_many(db, USER, [{'user_id': 1}, {'user_id': 2}])
+        # Its own events are applied once, after commit, not again by the poller
+        listener.publish(db, USER, user_id=3)
+        assert arrived[2].wait(5)
+    finally:
+        listener.shutdown()
+
+    assert sorted(u for u in received if u) == [1, 2, 3]
+    assert listener.applied_local == 1
+
+
+def test_oversized_events_stay_local(db, monkeypatch):
+    monkeypatch.setattr(invalidation_bus, 'MAX_EVENT_BYTES', 100)
+    bus = InvalidationBus(backend='sqlite')
+    seen = _recorder(bus, TAGS)
+
+    with db.transaction():
+        bus.publish(db, TAGS, tags=['x' * 200])
+
+    assert len(seen) == 1 and _stored(db) == 0
@@ -0,0 +1,132 @@
+"""Job scheduler: lease-based leadership and the job_runs history."""
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+from services import job_scheduler
+from services.job_scheduler import (
+    JobScheduler, _LeaseLock, abandon_stale_runs, is_due, last_run_times, running_jobs,
+    SCHEDULER_LEASE_SECONDS,
+)
+
+
+def _add_run(db, job, started, heartbeat, status='running', node='other-node:1'):
+    with db.transaction():
+        db.execute("INSERT INTO job_runs (job, started_at, heartbeat_at, status, node) VALUES (?, ?, ?, ?, ?)",
+                   (job, started.isoformat(), heartbeat.isoformat(), status, node))
+
+
+def _runs(query):
+    # Jobs run in their own app context; read back on a separate connection
+    conn = database.get_connection()
+    try:
+        return conn.execute(query).fetchall()
+    finally:
+        conn.close()
+
+
+def test_only_one_holder_until_the_lease_is_released(db):
+    a, b = _LeaseLock(60), _LeaseLock(60)
+
+    assert a.acquire()
+    assert not b.acquire()
+    # Renewal by the holder keeps it
+    assert a.acquire() and not b.acquire()
+
+    a.release()
+    assert b.acquire() and not a.acquire()
+
+
+def test_expired_lease_is_taken_over(db):
+    a, b = _LeaseLock(-1), _LeaseLock(60)
+    assert a.acquire()
+
+    assert b.acquire()
+    assert not a.acquire()
+    # The old holder's release must not drop the new holder's lease
+    a.held = True
+    a.release()
+    assert b.acquire() and not _LeaseLock(60).acquire()
+
+
+def test_named_locks_are_independent(db):
+    assert _LeaseLock(60, name='archive').acquire()
+    assert _LeaseLock(60, name='scheduler').acquire()
+    assert not _LeaseLock(60, name='archive').acquire()
+
+
+def test_stale_running_rows_are_abandoned(db):
+    now = datetime.now()
+    stale = now - timedelta(seconds=SCHEDULER_LEASE_SECONDS + 60)
+    _add_run(db, 'send_digests', now - timedelta(minutes=5), now)
+    _add_run(db, 'drain_outbox', stale, stale)
+    _add_run(db, 'check_deadlines', stale, stale, status='success')
+
+    assert running_jobs(db, now) == {'send_digests'}
+    assert abandon_stale_runs(db, now) == 1
+    # Abandoned runs do not count as the last run, so the job is due again
+    assert set(last_run_times(db)) == {'send_digests', 'check_deadlines'}
+
+
+def test_is_due():
+    now = datetime(2026, 10, 19, 9, 0)
+    daily = ('daily', (8, 0))
+    assert is_due(daily, None, now)
+    assert is_due(daily, now - timedelta(days=1), now)
+    assert not is_due(daily, now.replace(hour=8, minute=5), now)
+    assert not is_due(daily, None, now.replace(hour=7))
+    assert not is_due(daily, None, now, running=True)
+    assert is_due(('every', 300), now - timedelta(seconds=300), now)
+    assert not is_due(('every', 300), now - timedelta(seconds=10), now)
+
+
+@pytest.fixture
+def scheduler(app, monkeypatch):
+    calls = []
+    monkeypatch.setattr(job_scheduler, '_job_functions', lambda: {
+        'ok': lambda: calls.append('ok') or 3,
+        'broken': lambda: 1 / 0,
+    })
+    scheduler = JobScheduler()
+    scheduler._app = app
+    scheduler.schedules = {'ok': ('every', 300), 'broken': ('every', 300)}
+    scheduler.calls = calls
+    yield scheduler
+    scheduler._lock.release()
+
+
+def test_leader_runs_due_jobs_once_and_records_them(db, scheduler):
+    scheduler.run_due_jobs()
+    scheduler.run_due_jobs()
+
+    assert scheduler.calls == ['ok']
+    runs = {r['job']: r for r in _runs("SELECT * FROM job_runs")}
+    assert runs['ok']['status'] == 'success' and runs['ok']['result'] == '3'
+    assert runs['broken']['status'] == 'failed' and 'division' in runs['broken']['result']
+    assert all(r['finished_at'] and r['node'] == scheduler.node for r in runs.values())
+
+
+def test_job_running_elsewhere_is_skipped_until_its_heartbeat_stops(db, scheduler):
+    now = datetime.now()
+    _add_run(db, 'ok', now - timedelta(hours=1), now)
+    scheduler.schedules = {'ok': ('every', 300)}
+
+    scheduler.run_due_jobs(now)
+    assert scheduler.calls == []
+
+    later = now + timedelta(seconds=SCHEDULER_LEASE_SECONDS + 1)
+    scheduler.run_due_jobs(later)
+    assert scheduler.calls == ['ok']
+    assert [r['status'] for r in _runs("SELECT status FROM job_runs ORDER BY id")] == ['abandoned', 'success']
+
+
+def test_job_is_not_started_after_leadership_moved(db, scheduler):
+    other = _LeaseLock(60)
+    assert other.acquire()
+
+    # Leadership is re-checked before every job
+    scheduler.run_due_jobs()
+
+    assert scheduler.calls == []
+    assert _runs("SELECT * FROM job_runs") == []
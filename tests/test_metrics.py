@@ -0,0 +1,83 @@
+"""Metrics: per-process registry, the shared snapshot file and text exposition."""
+import json
+
+import pytest
+
+from services.metrics import Metrics, merge_snapshots, RETIRED_PID
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'metrics.db')
+
+
+def _lines(text, prefix):
+    return [line for line in text.splitlines() if line.startswith(prefix)]
+
+
+def test_histogram_and_counter_exposition(path):
+    registry = Metrics(enabled=True, path=path)
+    for seconds in (0.003, 0.2, 0.2, 20):
+        registry.observe('itrack_http_request_duration_seconds', seconds, blueprint='admin', endpoint='admin.audit')
+    registry.inc('itrack_export_bytes_total', 512, export='audit_csv')
+    registry.inc('itrack_export_bytes_total', 256, export='audit_csv')
+    registry.inc('itrack_export_bytes_total', 1, export='a "quoted"\nname')
+
+    text = registry.render()
+
+    assert '# TYPE itrack_http_request_duration_seconds histogram' in text
+    buckets = _lines(text, 'itrack_http_request_duration_seconds_bucket')
+    assert buckets[0] == ('itrack_http_request_duration_seconds_bucket'
+                          '{blueprint="admin",endpoint="admin.audit",le="0.005"} 1')
+    assert buckets[5].endswith('le="0.25"} 3')
+    assert buckets[-1].endswith('le="+Inf"} 4')
+    assert _lines(text, 'itrack_http_request_duration_seconds_count') == [
+        'itrack_http_request_duration_seconds_count{blueprint="admin",endpoint="admin.audit"} 4'
+    ]
+    assert _lines(text, 'itrack_http_request_duration_seconds_sum')[0].endswith(' 20.403')
+    assert 'itrack_export_bytes_total{export="audit_csv"} 768' in text
+    assert 'itrack_export_bytes_total{export="a \\"quoted\\"\\nname"} 1' in text
+
+
+def test_workers_are_summed_and_exited_workers_retired(path):
+    worker, exited = Metrics(enabled=True, path=path), Metrics(enabled=True, path=path)
+    worker.inc('itrack_email_messages_total', 3, result='sent')
+    exited.inc('itrack_email_messages_total', 2, result='sent')
+    exited.flush()
+
+    # Same pid, other token: from worker's side that snapshot belongs to an exited process
+    rows = dict(worker.flush())
+    retired = rows[RETIRED_PID]['counters']
+    assert retired[json.dumps(['itrack_email_messages_total', [['result', 'sent']]])] == 2
+
+    text = worker.render()
+    assert 'itrack_email_messages_total{result="sent"} 5' in text
+    # Totals never drop once a worker is gone
+    worker.flush()
+    assert 'itrack_email_messages_total{result="sent"} 5' in worker.render()
+
+
+def test_merge_sums_gauges_of_live_workers_only():
+    a = {'counters': {'c': 1}, 'gauges': {'g': 2}, 'histograms': {'h': [1, 0, 0.5]}}
+    b = {'counters': {'c': 4}, 'gauges': {'g': 3}, 'histograms': {'h': [0, 1, 2.0]}}
+
+    assert merge_snapshots([a, b]) == {'counters': {'c': 5}, 'gauges': {'g': 5}, 'histograms': {'h': [1, 1, 2.5]}}
+    assert merge_snapshots([a, None, b], gauges=False)['gauges'] == {}
+
+
+def test_cache_hit_ratio_is_derived_from_the_lookups(path):
+    registry = Metrics(enabled=True, path=path)
+    registry.inc('itrack_cache_lookups_total', 2, cache='report', result='local_hit')
+    registry.inc('itrack_cache_lookups_total', 1, cache='report', result='shared_hit')
+    registry.inc('itrack_cache_lookups_total', 1, cache='report', result='miss')
+
+    assert 'itrack_cache_hit_ratio{cache="report"} 0.75' in registry.render()
+
+
+def test_disabled_registry_records_nothing(path):
+    registry = Metrics(enabled=False, path=path)
+    registry.inc('itrack_export_bytes_total', 10, export='x')
+    registry.observe('itrack_import_duration_seconds', 1.0, source='x')
+
+    assert registry.flush() is None
+    assert registry._counters == {} and registry._histograms == {}
@@ -0,0 +1,64 @@
+"""Notification ledger: set-based claims that never send a notification twice."""
+from datetime import date, timedelta
+
+from notifications import ledger
+from notifications.deadline_schedule import rebuild_schedule
+from notifications.scheduler import notify_deadlines
+
+
+def _ledger_rows(db):
+    return db.execute("SELECT COUNT(*) as n FROM notification_ledger").fetchone()['n']
+
+
+def test_each_key_is_claimed_once_across_runs(db):
+    first = [(1, 'a@itrack.test', 'due_7'), (1, 'b@itrack.test', 'due_7'), (2, 'a@itrack.test', 'due_7')]
+    with db.transaction():
+        assert ledger.claim_notifications(db, first, '2026-10-19') == set(first)
+
+    # An overlapping run only gets the keys nobody claimed yet
+    second = first[1:] + [(3, 'c@itrack.test', 'overdue')]
+    with db.transaction():
+        assert ledger.claim_notifications(db, second, '2026-10-19') == {(3, 'c@itrack.test', 'overdue')}
+
+    # A different date is a different notification
+    with db.transaction():
+        assert ledger.claim_notifications(db, first[:1], '2026-10-20') == set(first[:1])
+    assert _ledger_rows(db) == 5
+
+
+def test_claims_span_several_chunks(db, monkeypatch):
+    monkeypatch.setattr(ledger, 'CLAIM_CHUNK', 3)
+    keys = [(i, f'user{i}@itrack.test', 'due_1') for i in range(8)]
+    with db.transaction():
+        ledger.claim_notifications(db, keys[:4], '2026-10-19')
+        claimed = ledger.claim_notifications(db, keys + keys[:2], '2026-10-19')
+
+    assert claimed == set(keys[4:])
+    assert _ledger_rows(db) == 8
+
+
+def test_rolled_back_claims_can_be_claimed_again(db):
+    keys = [(1, 'a@itrack.test', 'due_7')]
+    try:
+        with db.transaction():
+            ledger.claim_notifications(db, keys, '2026-10-19')
+            raise RuntimeError('send failed')
+    except RuntimeError:
+        pass
+
+    with db.transaction():
+        assert ledger.claim_notifications(db, keys, '2026-10-19') == set(keys)
+
+
+def test_deadline_job_rerun_sends_nothing_twice(db):
+    today = date.today()
+    with db.transaction():
+        for i in range(3):
+            db.execute("INSERT INTO research_projects (project_th, deadline, researcher_email) VALUES (?, ?, ?)",
+                       (f'Project {i}', (today + timedelta(days=15)).isoformat(), f'r{i}@itrack.test'))
+        rebuild_schedule(db, today)
+
+    assert notify_deadlines() == 3
+    assert notify_deadlines() == 0
+    assert db.execute("SELECT COUNT(*) as n FROM email_outbox").fetchone()['n'] == 3
+    assert _ledger_rows(db) == 3
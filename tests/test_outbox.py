@@ -0,0 +1,119 @@
+"""Email outbox: claim leases, result recording and the drain loop."""
+from datetime import datetime
+
+import pytest
+
+from notifications import outbox
+from notifications.email_transport import MemoryTransport, set_transport
+
+
+def _message(i, html=None):
+    return {'to': f'user{i}@itrack.test', 'subject': 'Deadline', 'html': html or f'<p>{i}</p>'}
+
+
+def _enqueue(db, messages):
+    with db.transaction():
+        outbox.enqueue_emails(db, messages)
+
+
+def _statuses(db):
+    return {r['to_email']: r['status'] for r in db.execute("SELECT to_email, status FROM email_outbox")}
+
+
+@pytest.fixture
+def transport():
+    transport = MemoryTransport()
+    previous = set_transport(transport)
+    yield transport
+    set_transport(previous)
+
+
+def test_claim_never_hands_out_a_row_twice(db):
+    _enqueue(db, [_message(i) for i in range(3)])
+
+    token_a, rows_a = outbox.claim_batch(db, limit=2)
+    token_b, rows_b = outbox.claim_batch(db, limit=2)
+    _, rows_c = outbox.claim_batch(db, limit=2)
+
+    assert token_a != token_b
+    assert len(rows_a) == 2 and len(rows_b) == 1 and rows_c == []
+    assert {r['id'] for r in rows_a}.isdisjoint(r['id'] for r in rows_b)
+    assert all(r['status'] == 'sending' and r['attempts'] == 1 for r in rows_a + rows_b)
+
+
+def test_expired_lease_is_reclaimed_and_old_token_is_ignored(db):
+    _enqueue(db, [_message(1)])
+    old_token, rows = outbox.claim_batch(db, lease_seconds=-1)
+
+    new_token, reclaimed = outbox.claim_batch(db)
+    assert [r['id'] for r in reclaimed] == [r['id'] for r in rows]
+    assert reclaimed[0]['attempts'] == 2
+
+    # The first worker finishing late must not overwrite the newer claim
+    outbox.record_results(db, old_token, rows, [(True, None)])
+    assert _statuses(db) == {'user1@itrack.test': 'sending'}
+
+    outbox.record_results(db, new_token, reclaimed, [(True, None)])
+    assert _statuses(db) == {'user1@itrack.test': 'sent'}
+
+
+def test_record_results_sent_retry_and_dead(db):
+    _enqueue(db, [_message(i) for i in range(3)])
+    db.execute("UPDATE email_outbox SET attempts = ? WHERE to_email = 'user2@itrack.test'",
+               (outbox.OUTBOX_MAX_ATTEMPTS - 1,))
+    db.commit()
+
+    token, rows = outbox.claim_batch(db)
+    outcome = outbox.record_results(db, token, rows, [(True, None), (False, 'SMTP 451'), (False, 'SMTP 550')])
+
+    assert outcome == {'sent': 1, 'retried': 1, 'dead': 1}
+    assert _statuses(db) == {
+        'user0@itrack.test': 'sent',
+        'user1@itrack.test': 'pending',
+        'user2@itrack.test': 'dead',
+    }
+    retry = db.execute("SELECT next_attempt_at, last_error FROM email_outbox "
+                       "WHERE to_email = 'user1@itrack.test'").fetchone()
+    assert retry['next_attempt_at'] > datetime.now().isoformat()
+    assert retry['last_error'] == 'SMTP 451'
+    # Not due yet, so nothing to claim
+    assert outbox.claim_batch(db)[1] == []
+
+
+def test_drain_sends_everything_and_shares_identical_messages(db, transport):
+    _enqueue(db, [_message(i, html='<p>same</p>') for i in range(3)] + [_message(9)])
+
+    totals = outbox.drain_outbox()
+
+    assert totals['sent'] == 4 and totals['batches'] == 1
+    assert set(_statuses(db).values()) == {'sent'}
+    # Three identical bodies in one request, one request for the other message
+    assert len(transport.payloads) == 2
+    assert sorted(to for to, _ in transport.messages) == sorted(f'user{i}@itrack.test' for i in (0, 1, 2, 9))
+
+
+def test_drain_extends_the_lease_between_rounds(db):
+    class OneAtATime(MemoryTransport):
+        max_batch = 1
+        concurrency = 1
+
+        def __init__(self):
+            super().__init__()
+            self.leases = []
+
+        def send(self, payloads, api_key):
+            self.leases.append(db.execute(
+                "SELECT MIN(lease_until) as lease FROM email_outbox WHERE status = 'sending'"
+            ).fetchone()['lease'])
+            return super().send(payloads, api_key)
+
+    transport = OneAtATime()
+    previous = set_transport(transport)
+    try:
+        _enqueue(db, [_message(i) for i in range(3)])
+        assert outbox.drain_outbox()['sent'] == 3
+    finally:
+        set_transport(previous)
+
+    assert len(transport.leases) == 3
+    assert transport.leases == sorted(transport.leases) and transport.leases[0] < transport.leases[-1]
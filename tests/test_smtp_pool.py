@@ -0,0 +1,128 @@
+"""SMTP transport against a local relay: connection reuse and reconnects."""
+import socket
+import threading
+import socketserver
+
+import pytest
+
+from notifications.email_transport import SMTPTransport
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: every command succeeds, DATA is stored."""
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.sessions.append(self.connection)
+        self.wfile.write(b'220 localhost test relay\r\n')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b'EHLO':
+                self.wfile.write(b'250-localhost\r\n250 8BITMIME\r\n')
+            elif command == b'DATA':
+                self.wfile.write(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+                body = []
+                for data in iter(self.rfile.readline, b''):
+                    if data == b'.\r\n':
+                        break
+                    body.append(data)
+                if server.reject_next:
+                    server.reject_next = False
+                    self.wfile.write(b'451 4.3.0 Try again later\r\n')
+                else:
+                    server.messages.append(b''.join(body))
+                    self.wfile.write(b'250 2.0.0 Queued\r\n')
+            elif command == b'QUIT':
+                self.wfile.write(b'221 Bye\r\n')
+                return
+            else:
+                self.wfile.write(b'250 OK\r\n')
+
+
+class LocalRelay(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _SMTPHandler)
+        self.port = self.server_address[1]
+        self.lock = threading.Lock()
+        self.sessions = []
+        self.messages = []
+        self.reject_next = False
+
+    def drop_connections(self):
+        """Close every client connection, as a relay restart would."""
+        with self.lock:
+            sessions, self.sessions = self.sessions, []
+        for conn in sessions:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def handle_error(self, request, client_address):
+        # Dropped connections are expected here
+        pass
+
+
+@pytest.fixture
+def relay():
+    server = LocalRelay()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def transport(relay):
+    transport = SMTPTransport(host='127.0.0.1', port=relay.port, username=None, starttls=False,
+                              use_ssl=False, pool_size=1, timeout=5)
+    yield transport
+    transport.close()
+
+
+def _payload(to):
+    return {
+        'personalizations': [{'to': [{'email': to}]}],
+        'from': {'email': 'noreply@itrack.test', 'name': 'ITRACK System'},
+        'subject': f'Hello {to}',
+        'content': [{'type': 'text/plain', 'value': 'body'}, {'type': 'text/html', 'value': '<p>body</p>'}],
+    }
+
+
+def test_connection_is_reused_across_calls(relay, transport):
+    for i in range(3):
+        assert transport.send([_payload(f'user{i}@itrack.test')], None) == [(True, None)]
+
+    assert len(relay.messages) == 3
+    assert transport.connects == 1
+    assert transport.reconnects == 0
+
+
+def test_reconnects_after_the_relay_drops_the_connection(relay, transport):
+    assert transport.send([_payload('before@itrack.test')], None) == [(True, None)]
+    relay.drop_connections()
+
+    # The pooled connection is dead: the transport must notice and retry on a new one
+    assert transport.send([_payload('after@itrack.test')], None) == [(True, None)]
+
+    assert len(relay.messages) == 2
+    assert b'after@itrack.test' in relay.messages[-1]
+    assert transport.connects == 2
+    assert transport.reconnects >= 1
+
+
+def test_temporary_rejection_keeps_the_connection(relay, transport):
+    relay.reject_next = True
+    [(success, error)] = transport.send([_payload('later@itrack.test')], None)
+
+    assert not success and error.startswith('SMTP 451')
+    assert transport.send([_payload('next@itrack.test')], None) == [(True, None)]
+    assert transport.connects == 1
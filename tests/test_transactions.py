@@ -0,0 +1,106 @@
+"""DatabaseWrapper.transaction(): one commit, savepoints and after_commit hooks."""
+import pytest
+
+import database
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'SQLITE_PATH', str(tmp_path / 'tx.db'))
+    conn = database.get_connection()
+    conn.execute("CREATE TABLE items (name TEXT)")
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def _names(conn):
+    return [r['name'] for r in conn.execute("SELECT name FROM items ORDER BY rowid")]
+
+
+def _committed():
+    """Read through a second connection: only committed rows are visible."""
+    other = database.get_connection()
+    try:
+        return _names(other)
+    finally:
+        other.close()
+
+
+def test_outer_block_commits_once(conn):
+    with conn.transaction():
+        conn.execute("INSERT INTO items VALUES ('a')")
+        with conn.transaction():
+            conn.execute("INSERT INTO items VALUES ('b')")
+            assert conn.in_transaction
+        # The inner block only released its savepoint
+        assert _committed() == []
+
+    assert not conn.in_transaction
+    assert _committed() == ['a', 'b']
+
+
+def test_failing_inner_block_only_undoes_its_own_statements(conn):
+    with conn.transaction():
+        conn.execute("INSERT INTO items VALUES ('outer')")
+        with pytest.raises(ValueError):
+            with conn.transaction():
+                conn.execute("INSERT INTO items VALUES ('inner')")
+                raise ValueError
+        conn.execute("INSERT INTO items VALUES ('after')")
+
+    assert _names(conn) == ['outer', 'after']
+
+
+def test_failing_outer_block_rolls_everything_back(conn):
+    with pytest.raises(RuntimeError):
+        with conn.transaction():
+            conn.execute("INSERT INTO items VALUES ('a')")
+            with conn.transaction():
+                conn.execute("INSERT INTO items VALUES ('b')")
+            raise RuntimeError
+
+    assert _names(conn) == []
+    assert not conn.in_transaction
+
+
+def test_after_commit_runs_after_the_outer_commit(conn):
+    seen = []
+    with conn.transaction():
+        conn.execute("INSERT INTO items VALUES ('a')")
+        with conn.transaction():
+            conn.after_commit(lambda: seen.append(('inner', _committed(), conn.in_transaction)))
+        conn.after_commit(lambda: seen.append(('outer', _committed(), conn.in_transaction)))
+        assert seen == []
+
+    assert seen == [('inner', ['a'], False), ('outer', ['a'], False)]
+
+
+def test_after_commit_callbacks_of_rolled_back_blocks_are_dropped(conn):
+    seen = []
+    with conn.transaction():
+        conn.after_commit(lambda: seen.append('kept'))
+        with pytest.raises(ValueError):
+            with conn.transaction():
+                conn.after_commit(lambda: seen.append('savepoint'))
+                raise ValueError
+    assert seen == ['kept']
+
+    with pytest.raises(ValueError):
+        with conn.transaction():
+            conn.after_commit(lambda: seen.append('rolled back'))
+            raise ValueError
+    assert seen == ['kept']
+
+    # Outside a transaction the callback runs straight away
+    conn.after_commit(lambda: seen.append('now'))
+    assert seen == ['kept', 'now']
+
+
+def test_failing_callback_does_not_stop_the_others(conn):
+    seen = []
+    with conn.transaction():
+        conn.after_commit(lambda: 1 / 0)
+        conn.after_commit(lambda: seen.append('ran'))
+
+    assert seen == ['ran']